@@ -1,36 +1,63 @@
-def unwrap_metricsDict(mydict):
+import os
+import stat
+import sys
+import time
+
+# the conversion programs share the se package with semonitor.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from se.metrics import unwrap_metricsDict  # noqa: E402,F401
+
+
+def readLines(inFile, follow=False, followInterval=.5):
     """
-    A iterator/generator function to "flatten" (aka unwrap) the attributes stored in the parsed device dictionaries,
-    after they have been wrapped in the device type and device id identifiers.  The inverse (sort of) to the
-    ParseDevice.wrap_in_ids method.
+    A iterator/generator function that returns the lines of JSON input as they become available, and ends at the end of
+    the input.
 
-    Will work equally well on a json.loads dictionary (where the json was created from a parsed device dictionary).
+    Pipes, sockets and terminals (eg stdin when piped from semonitor) are read with blocking reads, so no time is spent
+    polling while waiting for data, and the input ends when the writer closes it.  A regular file ends when its end is
+    reached, unless it is being followed, in which case its size is checked every followInterval seconds for new data,
+    as `tail -f` does.  If a followed file is truncated it is read again from the start, and if it is replaced (eg by
+    log rotation) the new file is opened once the old one has been read to its end.
 
-    :param mydict: A nested set of dictionaries, the deepest level of which records the attributes for a device.  "Date"
-     must be one of those device attributes, because that is how the algorithm knows it has reached the bottom of the
-     nest.
+    :param inFile: An open file object, eg sys.stdin.
+    :param follow: Wait for new data to be written to a regular file instead of ending at its end.
+    :param followInterval: The number of seconds between checks for new data in a followed file.
 
-    :return: A graphite style structured name for the device instance, and a {name: value} dictionary of it's attributes.
+    :return: Each complete line of input.  A partial last line is only returned if the input ends without it being
+     completed.
     """
 
-    def nice(k):
-        # Remove characters which give graphite or open (a file) problems.
-        # Also remove an extra level of naming (devices) that I don't really need anymore.
-        # Todo tidy up and delete the removal of "devices" when testing is over.
-        return str(k).replace("\x00", '').replace(" ", "_").replace(
-            "devices", "")
+    try:
+        following = follow and stat.S_ISREG(os.fstat(inFile.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        following = False
+    if not following:
+        for line in iter(inFile.readline, ""):
+            yield line
+        return
 
-    for k, v in mydict.items():
-        if "Date" in v.keys():
-            yield nice(k), v
+    partial = ""
+    while True:
+        line = inFile.readline()
+        if line.endswith("\n"):
+            yield partial + line
+            partial = ""
+        elif line:
+            # the writer hasn't finished the line yet
+            partial += line
         else:
-            for k2, v2 in unwrap_metricsDict(v):
-                if len(nice(k2)) == 0:
-                    # Silently drop this extra level of naming
-                    yield nice(k), v2
-                elif len(nice(k)) == 0:
-                    # Silently drop this extra level of naming
-                    yield nice(k2), v2
-                else:
-                    yield "{}.{}".format(nice(k), nice(k2)), v2
-
+            time.sleep(followInterval)
+            position = inFile.tell()
+            if os.fstat(inFile.fileno()).st_size < position:
+                inFile.seek(0)
+                partial = ""
+                continue
+            try:
+                replaced = not os.path.samestat(os.stat(inFile.name), os.fstat(inFile.fileno()))
+            except OSError:
+                # the file has been moved away and the new one hasn't been created yet
+                continue
+            if replaced and os.fstat(inFile.fileno()).st_size == position:
+                inFile.close()
+                inFile = open(inFile.name)
+                partial = ""
@@ -6,15 +6,19 @@ graphite will accept batches of metrics (in a pickled nested list of tuples form
 2004) as well as individual metric values, one at a time, over the (usually) 2003 port.
 
 The `Pickle2Graphite` class converts a nested dictionary (such as produced by `json.loads` on some solaredge traffic
-that has been processed by semonitor) into the nested list of tuples structure expected by carbon.  The `send` method
+that has been processed by semonitor) into the nested list of tuples structure expected by carbon.  The `PickleSender`
 pickles it, adds the requisite header, and sends it to graphite.
 
-You may need to adjust the delay parameter, depending upon the capacity and busyness of the graphite server.  I have
-found 0.2 works fine **for me** in production mode, when I am "following" some existing metrics in real time, as the
-solaredge inverter emits them, but I needed to increase it to as much as 5.0 the first time I sent a new batch of metrics
-to graphite, otherwise the carbon listener seemed to be swamped and didn't have time to create all the new metrics.
-To be completely precise, I had problems when I sent an existing batch of metrics to a new "test"  base, which meant
-graphite / carbon had to create a whole lot of new whisper files all at once.
+The `PickleSender` keeps a connection to carbon open and sends the metrics in batches of up to a configurable number of
+metrics.  Rather than waiting a fixed delay after each batch, it watches how quickly carbon takes the data: if a send
+blocks, or the data sent earlier hasn't been acknowledged yet, carbon is falling behind (typically because it is busy
+creating new whisper files), and the delay between batches is doubled; while carbon keeps up the delay is halved again.
+If carbon can't be reached, the batches are appended to an optional spool file, which is sent before any new metrics
+once the connection is back.
+
+For bulk loads of historical metrics use backfill mode.  The metrics of many lines are collected into full batches,
+and each batch is sent as soon as carbon has acknowledged the previous one, so carbon is kept busy without the socket
+buffers and carbon's own queues filling up.
 """
 
 import json
@@ -24,7 +28,15 @@ import sys
 import socket
 import struct
 import pickle
-from common import unwrap_metricsDict
+import os
+from common import unwrap_metricsDict, readLines
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # the amount of unacknowledged data can't be found on Windows, so only the time taken by sends is used
+    fcntl = None
 
 try:
     import syslog
@@ -49,36 +61,40 @@ hostName = "localhost"
 # The usual graphite installation default is 2004.
 port = 2004
 devices = ["inverters", "optimizers"]
-delay = .2
+maxDelay = 5.0              # maximum seconds between batches when carbon is falling behind
+batchSize = 500             # maximum metrics in a batch
+spoolFileName = None
+maxSpoolSize = 100000000    # maximum bytes in the spool file
+backfill = False
 following = False
 
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "b:fh:p:")
+(opts, args) = getopt.getopt(sys.argv[1:], "Bb:d:fh:m:n:p:s:")
 try:
     inFile = open(args[0])
 except:
     inFile = sys.stdin
 for opt in opts:
+    if opt[0] == "-B":
+        backfill = True
     if opt[0] == "-b":
         base = opt[1] + "."
+    if opt[0] == "-d":
+        maxDelay = float(opt[1])
     if opt[0] == "-h":
         hostName = opt[1]
+    if opt[0] == "-m":
+        maxSpoolSize = int(opt[1])
+    if opt[0] == "-n":
+        batchSize = int(opt[1])
     if opt[0] == "-p":
         port = int(opt[1])
+    if opt[0] == "-s":
+        spoolFileName = opt[1]
     if opt[0] == "-f":
         following = True
 
 
-def getJsonStr(inFile, following):
-    jsonStr = inFile.readline()
-    if jsonStr == "" and following:
-        while jsonStr == "":
-            #wait for more data
-            time.sleep(delay)
-            jsonStr = inFile.readline()
-    return jsonStr
-
-
 class Pickle2Graphite(list):
     """
     Convert a (json) nested dictionary of dictionaries of metrics into the list of tuples format expected by the
@@ -94,8 +110,8 @@ class Pickle2Graphite(list):
             except KeyError:
                 log("Date or Time is missing or incorrectly formatted for this set of metrics"
                     )
-                (year, month, day, hour, minute, second) = (1970, 01, 01, 00,
-                                                            01, 01)
+                (year, month, day, hour, minute, second) = (1970, 1, 1, 0,
+                                                            1, 1)
             # Set the dst parameter in mktime to -1, so that the system determines whether dst is in effect!
             # Without this, when dst is in effect, the timeStamp is 3600 seconds into the future!
             timeStamp = time.mktime((int(year), int(month),
@@ -116,34 +132,193 @@ class Pickle2Graphite(list):
                             # A nested tuple as per the expectations of the pickle graphite interface
                             self.append((fullName, (timeStamp,
                                                     str(devAttrs[devAttr]))))
-                    except ValueError:
+                    except (TypeError, ValueError):
                         # It is not a numeric metric
                         pass
 
-    def send(self, graphiteSocket):
-        # Remove the non list attributes from self, to keep graphite (actually the carbon listener) happy.
-        payload = pickle.dumps(list(self))
-        header = struct.pack("!L", len(payload))
-        # print len(payload)
-        graphiteSocket.send(header + payload)
-        time.sleep(delay)
+
+class PickleSender(object):
+    """
+    Send lists of metric tuples to carbon's pickle listener in batches of up to batchSize metrics over a persistent
+    connection, pacing the batches according to how quickly carbon takes them, and spooling them to a file while carbon
+    can't be reached.
+    """
+
+    # a send which takes longer than this has been blocked by carbon not reading fast enough
+    slowSend = 0.05
+    # the delay is reduced to zero when it goes below this
+    minDelay = 0.01
+    maxRetryDelay = 60
+
+    def __init__(self, hostName, port, batchSize, maxDelay, spoolFileName=None, maxSpoolSize=0, backfill=False):
+        self.address = (hostName, port)
+        self.batchSize = batchSize
+        self.maxDelay = maxDelay
+        self.spoolFileName = spoolFileName
+        self.maxSpoolSize = maxSpoolSize
+        self.backfill = backfill
+        self.metrics = []
+        self.sock = None
+        self.delay = 0
+        self.retryTime = 0
+        self.retryDelay = 1
+
+    def add(self, metrics):
+        """
+        Queue a list of metric tuples, sending as many full batches as there are.  Unless backfilling, the rest are
+        sent too, so that live metrics aren't held back waiting for the next line of input.
+        """
+        self.metrics.extend(metrics)
+        while len(self.metrics) >= self.batchSize:
+            self.send(self.metrics[:self.batchSize])
+            del self.metrics[:self.batchSize]
+        if self.metrics and not self.backfill:
+            self.flush()
+
+    def flush(self):
+        if self.metrics:
+            self.send(self.metrics)
+            self.metrics = []
+
+    def send(self, metrics):
+        # Protocol 2 can be unpickled by any version of carbon.
+        payload = pickle.dumps(list(metrics), protocol=2)
+        message = struct.pack("!L", len(payload)) + payload
+        if not (self.sendSpool() and self.sendMessage(message)):
+            self.spool(message)
+
+    def sendMessage(self, message):
+        """
+        Send a pickled batch, and adjust the delay before the next one to how carbon is keeping up.  Returns False if
+        it couldn't be sent.
+        """
+        if not self.connect():
+            return False
+        try:
+            if self.backfill:
+                self.waitForAcks(len(message))
+            sendTime = time.time()
+            self.sock.sendall(message)
+            sendTime = time.time() - sendTime
+        except OSError as ex:
+            log("Graphite send failed", ex)
+            self.disconnect()
+            return False
+        if sendTime > self.slowSend or self.unacknowledged() > len(message):
+            self.delay = min(max(self.delay * 2, self.minDelay), self.maxDelay)
+        elif self.delay >= self.minDelay:
+            self.delay /= 2
+        else:
+            self.delay = 0
+        if self.delay and not self.backfill:
+            time.sleep(self.delay)
+        return True
+
+    def unacknowledged(self):
+        """
+        The number of bytes that have been sent to carbon but not acknowledged yet (Linux only).
+        """
+        if fcntl is None:
+            return 0
+        try:
+            return struct.unpack("i", fcntl.ioctl(self.sock.fileno(), termios.TIOCOUTQ, b"\0\0\0\0"))[0]
+        except OSError:
+            return 0
+
+    def waitForAcks(self, size):
+        """
+        Wait until no more than size bytes are unacknowledged, so that there is at most one batch in flight.  If it
+        can't be found out, the delay is used instead.
+        """
+        if fcntl is None:
+            time.sleep(self.delay)
+            return
+        endTime = time.time() + self.maxRetryDelay
+        while self.unacknowledged() > size:
+            if time.time() > endTime:
+                raise socket.timeout("carbon has stopped acknowledging metrics")
+            time.sleep(self.minDelay)
+
+    def connect(self):
+        if self.sock:
+            return True
+        if time.time() < self.retryTime:
+            return False
+        try:
+            self.sock = socket.create_connection(self.address)
+            self.retryDelay = 1
+            return True
+        except OSError as ex:
+            log("Graphite connection to", self.address, "failed", ex)
+            self.disconnect()
+            return False
+
+    def disconnect(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self.retryTime = time.time() + self.retryDelay
+        self.retryDelay = min(self.retryDelay * 2, self.maxRetryDelay)
+
+    def spool(self, message):
+        """
+        Append a batch that couldn't be sent to the spool file, if there is room.
+        """
+        if not self.spoolFileName:
+            log("Dropped", len(message), "bytes of metrics, no spool file")
+            return
+        try:
+            with open(self.spoolFileName, "ab") as spoolFile:
+                if spoolFile.tell() + len(message) > self.maxSpoolSize:
+                    log("Dropped", len(message), "bytes of metrics, the spool file is full")
+                    return
+                spoolFile.write(message)
+        except OSError as ex:
+            log("Unable to write to", self.spoolFileName, ex)
+
+    def sendSpool(self):
+        """
+        Send the batches in the spool file, and remove it once they have all been sent.  Returns False if they couldn't
+        all be sent, in which case the file is left as it is, so some of the batches may be sent again later.
+        """
+        if not (self.spoolFileName and os.path.exists(self.spoolFileName)):
+            return True
+        if not self.connect():
+            return False
+        log("Sending spooled metrics from", self.spoolFileName)
+        with open(self.spoolFileName, "rb") as spoolFile:
+            while True:
+                header = spoolFile.read(4)
+                if len(header) < 4:
+                    break
+                payload = spoolFile.read(struct.unpack("!L", header)[0])
+                if not self.sendMessage(header + payload):
+                    return False
+        os.remove(self.spoolFileName)
+        return True
+
+    def close(self):
+        self.flush()
+        self.sendSpool()
+        if self.sock:
+            self.sock.close()
+            self.sock = None
 
 
 if __name__ == "__main__":
     # Timeout if no connection after 10 seconds,
     #   in which case check that graphite is running, and the hostName and port is correct.
     socket.setdefaulttimeout(10.0)
-    graphiteSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     # NB `port` must be the carbon pickle port, usually 2004 is configured by default.
-    graphiteSocket.connect((hostName, port))
-    jsonStr = getJsonStr(inFile, following)
-    while jsonStr != "":
-        try:
-            inDict = json.loads(jsonStr)
-            pickle2graphite = Pickle2Graphite(inDict, base=base)
-            pickle2graphite.send(graphiteSocket)
-        except ValueError:
-            log('WARNING json.loads had a problem with the following jsonStr\n',
-                jsonStr, "\n", "=" * 80, "\n")
-        jsonStr = getJsonStr(inFile, following)
-    graphiteSocket.close()
+    sender = PickleSender(hostName, port, batchSize, maxDelay, spoolFileName, maxSpoolSize, backfill)
+    try:
+        for jsonStr in readLines(inFile, following):
+            try:
+                inDict = json.loads(jsonStr)
+            except ValueError:
+                log('WARNING json.loads had a problem with the following jsonStr\n',
+                    jsonStr, "\n", "=" * 80, "\n")
+                continue
+            sender.add(Pickle2Graphite(inDict, base=base))
+    finally:
+        sender.close()
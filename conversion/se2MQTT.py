@@ -6,67 +6,133 @@
 # -u mosquitto client user id
 # -p mosquitto client password
 # -s mosquitto server (dns or ip address)
+# -P mosquitto server port (default 1883)
 # -t mosquitto MQTT topic to publish to
+# -q quality of service of the published messages (default 0)
+# -r publish retained messages, so a new subscriber gets the last values of every device straight away
+# -m maximum number of outgoing messages waiting to be sent to the server, messages are dropped when it is full (default 1000)
+# -a also publish the accumulated state of all the inverters and optimizers to the topic, as earlier versions did
+#
+# A single connection to the server is kept open, and is reconnected automatically by a background network loop
+# if it is lost.  For each input line the state of each device in it is published to its own topic, named
+# <topic>/<device type>/<device id>, eg /ha/value/solaredge/optimizers/100F7A1B, so the payloads only contain
+# the devices that have reported.  When the input only contains the values that have changed (semonitor.py -l)
+# the published state still contains all the values of the device.  Messages published while the connection is
+# down are only queued if the quality of service is 1 or 2.
 #
 #example:
 #
 # python3 se2MQTT.py -c solaredge -u solaredge -p s0lar3dg3 -s mosquitto.domain.local -t /ha/value/solaredge /root/solaredge/performance.json
 #
-# follow /root/solaredge/performance.json file and publish to topic "/ha/value/solaredge" on server "mosquitto.domain.local" with client id "solaredge" and user "solaredge" and password "s0lar3dg3"
+# follow /root/solaredge/performance.json file and publish to topics under "/ha/value/solaredge" on server "mosquitto.domain.local" with client id "solaredge" and user "solaredge" and password "s0lar3dg3"
 #
 # python3 semonitor.py -t 4 -d /root/solaredge/selog.txt -s 7f123456 -vvvv /dev/ttyUSB0 | python3 se2MQTT.py -c solaredge -u solaredge -p s0lar3dg3 -s mosquitto.domain.local -t /ha/value/solaredge
 #
-# pipe output from semonitor directly into se2MQTT.py and publish to topic "/ha/value/solaredge" on server "mosquitto.domain.local" with client id "solaredge" and user "solaredge" and password "s0lar3dg3"
+# pipe output from semonitor directly into se2MQTT.py and publish to topics under "/ha/value/solaredge" on server "mosquitto.domain.local" with client id "solaredge" and user "solaredge" and password "s0lar3dg3"
 
 import json
 import getopt
-import time
 import sys
+import threading
 import paho.mqtt.client as mqtt
+from common import readLines
+from se.mqtt import DeviceStates, newClient
+
+# parameter defaults
+clientid = ""
+user = None
+passwd = None
+server = "localhost"
+port = 1883
+topic = "solaredge"
+qos = 0
+retain = False
+maxQueue = 1000
+aggregate = False
+
+# seconds to wait for the first connection to the server before reading the input
+CONNECT_TIMEOUT = 5
+
+# A long lived connection to the MQTT server.  The paho network loop runs in a background thread, which sends the
+# queued messages and reconnects to the server when the connection is lost.  Messages with a quality of service of 0
+# are discarded while there is no connection, so the first connection is waited for.
+class MQTTPublisher(object):
+    def __init__(self, server, port, clientid, user, passwd, qos, retain, maxQueue):
+        self.qos = qos
+        self.retain = retain
+        self.lastMsg = None
+        self.connected = threading.Event()
+        self.client = newClient(clientid, user, passwd, maxQueue)
+        self.client.on_connect = self.onConnect
+        self.client.on_disconnect = self.onDisconnect
+        self.client.connect_async(server, port)
+        self.client.loop_start()
+        if not self.connected.wait(CONNECT_TIMEOUT):
+            print("MQTT not connected to " + server)
 
-# state values
-stateDict = {"inverters": {}, "optimizers": {}}
+    def onConnect(self, client, userdata, flags, rc, *args):
+        print("MQTT connected: " + str(rc))
+        if rc == 0:
+            self.connected.set()
+
+    def onDisconnect(self, client, userdata, *args):
+        print("MQTT disconnected: " + str(args[-2] if len(args) > 1 else args[0]))
+        self.connected.clear()
+
+    def publish(self, topic, payload):
+        msg = self.client.publish(topic, payload, self.qos, self.retain)
+        if msg.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            print("MQTT queue full, dropped message for " + topic)
+        elif msg.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.lastMsg = msg
+
+    # wait for the queued messages to be sent, then disconnect
+    def close(self, timeout=10):
+        if self.lastMsg and self.client.is_connected():
+            try:
+                self.lastMsg.wait_for_publish(timeout)
+            except (RuntimeError, ValueError) as ex:
+                print("MQTT Exception: " + str(ex))
+        self.client.disconnect()
+        self.client.loop_stop()
 
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "c:u:p:s:t:")
+(opts, args) = getopt.getopt(sys.argv[1:], "ac:m:p:P:q:rs:t:u:")
 try:
     inFile = open(args[0])
 except:
     inFile = sys.stdin
 for opt in opts:
+    if opt[0] == "-a":
+        aggregate = True
     if opt[0] == "-c":
         clientid = opt[1]
+    if opt[0] == "-m":
+        maxQueue = int(opt[1])
     if opt[0] == "-u":
         user = opt[1]
     if opt[0] == "-p":
         passwd = opt[1]
+    if opt[0] == "-P":
+        port = int(opt[1])
+    if opt[0] == "-q":
+        qos = int(opt[1])
+    if opt[0] == "-r":
+        retain = True
     if opt[0] == "-s":
         server = opt[1]
     if opt[0] == "-t":
         topic = opt[1]
 
-# read the input forever
-while True:
-    jsonStr = ""
-    # wait for data
-    while jsonStr == "":
-        time.sleep(.1)
-        jsonStr = inFile.readline()
-    inDict = json.loads(jsonStr)
-    # update the state values
-    stateDict["inverters"].update(inDict["inverters"])
-    stateDict["optimizers"].update(inDict["optimizers"])
-    # zero current energy and power when an event occurs
-    if len(inDict["events"]) != 0:
-        for inverter in stateDict["inverters"].keys():
-            stateDict["inverters"][inverter]["Eac"] = 0.0
-            stateDict["inverters"][inverter]["Pac"] = 0.0
-    # send to MQTT
-    try:
-        mqttc = mqtt.Client(client_id=clientid)
-        mqttc.username_pw_set(user, passwd)
-        mqttc.connect(server)
-        mqttc.publish(topic, json.dumps(stateDict))
-        mqttc.disconnect()
-    except Exception as ex:
-        print "MQTT Exception: " + str(ex)
+publisher = MQTTPublisher(server, port, clientid, user, passwd, qos, retain, maxQueue)
+states = DeviceStates()
+try:
+    # read the input until it ends, following the input file
+    for jsonStr in readLines(inFile, follow=inFile is not sys.stdin):
+        # update the states of the devices in the message, and send them to MQTT
+        for devTopic, payload in states.update(json.loads(jsonStr), topic):
+            publisher.publish(devTopic, payload)
+        if aggregate:
+            publisher.publish(topic, json.dumps(states.aggregate()))
+finally:
+    publisher.close()
@@ -6,7 +6,7 @@ import json
 import argparse
 import csv
 
-from common import unwrap_metricsDict
+from common import unwrap_metricsDict, readLines
 
 
 if __name__ == "__main__":
@@ -29,7 +29,7 @@ if __name__ == "__main__":
     devsFile = {}
 
     # process the data
-    for jsonStr in args.infile:
+    for jsonStr in readLines(args.infile):
         for baseName, devAttrs in sorted(unwrap_metricsDict(json.loads(jsonStr))):
             devName, devId = baseName.split(".", 1)
             if devName not in devsFile:
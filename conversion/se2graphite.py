@@ -7,7 +7,10 @@ import getopt
 import time
 import sys
 import socket
-from common import unwrap_metricsDict
+import threading
+from collections import deque
+from common import readLines
+from se.graphite import metricLines
 
 try:
     import syslog
@@ -30,10 +33,119 @@ base = ""
 hostName = "localhost"
 port = 2003
 devices = ["inverters", "optimizers"]
-delay = .1
+delay = .1              # seconds between batches
+batchSize = 65536       # maximum bytes in a batch
+batchInterval = 1.0     # maximum seconds that a metric waits for its batch to be sent
+spoolSize = 100000      # maximum metrics kept while graphite can't be reached
+maxRetryDelay = 60      # maximum seconds between attempts to reconnect
+
+# Send metric lines to the graphite text listener in batches.  Lines are buffered until there are batchSize bytes of
+# them, or the first of them has waited batchInterval seconds, and then written with a single sendall, which is
+# followed by the delay so that graphite isn't swamped.  If graphite can't be reached the lines stay in the buffer,
+# which holds at most spoolSize lines (the oldest are dropped), and the connection is retried with an increasing delay.
+class GraphiteSender(object):
+    def __init__(self, hostName, port, batchSize, batchInterval, delay, spoolSize):
+        self.address = (hostName, port)
+        self.batchSize = batchSize
+        self.batchInterval = batchInterval
+        self.delay = delay
+        self.lines = deque(maxlen=spoolSize)
+        self.size = 0
+        self.dropped = 0
+        self.sock = None
+        self.retryTime = 0
+        self.retryDelay = 1
+        self.lock = threading.Lock()
+        self.timer = None
+
+    # queue a metric line to be sent
+    def add(self, line):
+        line = line.encode("utf-8")
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.size -= len(self.lines[0])
+                self.dropped += 1
+            self.lines.append(line)
+            self.size += len(line)
+            if self.size >= self.batchSize:
+                self.flush()
+            elif not self.timer:
+                self.timer = threading.Timer(self.batchInterval, self.timedFlush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def timedFlush(self):
+        with self.lock:
+            self.timer = None
+            self.flush()
+
+    # send the buffered lines in batches of up to batchSize bytes, the lock must be held
+    def flush(self):
+        while self.lines:
+            if not self.connect():
+                return
+            batch = []
+            batchBytes = 0
+            for line in self.lines:
+                if batch and batchBytes + len(line) > self.batchSize:
+                    break
+                batch.append(line)
+                batchBytes += len(line)
+            try:
+                self.sock.sendall(b"".join(batch))
+            except OSError as ex:
+                log("Graphite send failed", ex)
+                self.disconnect()
+                continue
+            for i in range(len(batch)):
+                self.lines.popleft()
+            self.size -= batchBytes
+            time.sleep(self.delay)
+
+    def connect(self):
+        if self.sock:
+            return True
+        if time.time() < self.retryTime:
+            return False
+        try:
+            self.sock = socket.create_connection(self.address, timeout=10)
+            self.retryDelay = 1
+            if self.dropped:
+                log("Dropped", self.dropped, "metrics while graphite was unavailable")
+                self.dropped = 0
+            return True
+        except OSError as ex:
+            log("Graphite connection to", self.address, "failed", ex)
+            self.disconnect()
+            return False
+
+    def disconnect(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self.retryTime = time.time() + self.retryDelay
+        self.retryDelay = min(self.retryDelay * 2, maxRetryDelay)
+
+    # send any lines that are left, retrying until graphite can be reached or the timeout
+    def close(self, timeout=maxRetryDelay):
+        endTime = time.time() + timeout
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            while True:
+                self.flush()
+                if not self.lines or time.time() >= endTime:
+                    break
+                time.sleep(max(0, min(self.retryTime, endTime) - time.time()))
+            if self.lines:
+                log("Unable to send", len(self.lines), "metrics to graphite")
+            if self.sock:
+                self.sock.close()
+                self.sock = None
 
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "b:h:p:")
+(opts, args) = getopt.getopt(sys.argv[1:], "b:d:h:i:p:q:s:")
 try:
     inFile = open(args[0])
 except:
@@ -41,50 +153,29 @@ except:
 for opt in opts:
     if opt[0] == "-b":
         base = opt[1] + "."
+    if opt[0] == "-d":
+        delay = float(opt[1])
     if opt[0] == "-h":
         hostName = opt[1]
+    if opt[0] == "-i":
+        batchInterval = float(opt[1])
     if opt[0] == "-p":
         port = int(opt[1])
+    if opt[0] == "-q":
+        spoolSize = int(opt[1])
+    if opt[0] == "-s":
+        batchSize = int(opt[1])
 
 if __name__ == "__main__":
-    graphiteSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    graphiteSocket.connect((hostName, port))
-    jsonStr = inFile.readline()
-    while jsonStr != "":
-        inDict = json.loads(jsonStr)
-        for baseName, devAttrs in unwrap_metricsDict(inDict):
-            # convert date and time to unix time
+    sender = GraphiteSender(hostName, port, batchSize, batchInterval, delay, spoolSize)
+    try:
+        for jsonStr in readLines(inFile):
             try:
-                (year, month, day) = devAttrs["Date"].split("-")
-                (hour, minute, second) = devAttrs["Time"].split(":")
-            except KeyError:
-                log("Date or Time is missing or incorrectly formatted for this set of metrics"
-                    )
-                (year, month, day, hour, minute, second) = (1970, 01, 01, 00,
-                                                            01, 01)
-            # Set the dst parameter in mktime to -1, so that the system determines whether dst is in effect!
-            # Without this, when dst is in effect, the timeStamp is 3600 seconds into the future!
-            timeStamp = time.mktime((int(year), int(month),
-                                     int(day), int(hour), int(minute),
-                                     int(second), 0, 0, -1))
-            # Treat every attribute as a metric - except for non-numeric ones!
-            for devAttr in devAttrs.keys():
-                if devAttr != "Date" and devAttr != "Time" and devAttr != 'Undeciphered_data':
-                    try:
-                        # Weed out attributes with non numeric values (graphite does this too, but why clog the network?)
-                        test = float(devAttrs[devAttr])
-                        if test != test:
-                            # It's a nan!
-                            pass
-                        else:
-                            fullName = "{}{}.{}".format(
-                                base, baseName, devAttr)
-                            metric = "{} {} {}\n".format(
-                                fullName, str(devAttrs[devAttr]), timeStamp)
-                            graphiteSocket.send(metric)
-                            time.sleep(delay)
-                    except ValueError:
-                        # It's not a numeric metric, ignore it
-                        pass
-        jsonStr = inFile.readline()
-    graphiteSocket.close()
+                inDict = json.loads(jsonStr)
+            except ValueError:
+                log("json.loads had a problem with", jsonStr)
+                continue
+            for metric in metricLines(inDict, base):
+                sender.add(metric)
+    finally:
+        sender.close()
@@ -5,35 +5,16 @@
 
 import json
 import getopt
-import time
 import sys
+from common import readLines
+from se.state import State, StateWriter, readState
 
 initialize = False
-
-# return the sum of the specified attribute of the items in the specified dictionary
-# ignore the stats item
-def sumItems(itemDict, itemAttr):
-    itemSum = 0
-    for item in itemDict.keys():
-        if item != "stats":
-            itemSum += itemDict[item][itemAttr]
-    return itemSum
-
-# return the average of the specified attribute of the items in the specified dictionary
-# ignore the stats item
-def avgItems(itemDict, itemAttr):
-    try:
-        return sumItems(itemDict, itemAttr)/(len(itemDict) - 1)
-    except ZeroDivisionError:
-        return 0
-
-def writeState(stateDict, outFileName):
-    # update the state file
-    with open(outFileName, "w") as outFile:
-        json.dump(stateDict, outFile)
+minInterval = 5.0
+binFileName = None
 
 # get program arguments and options
-(opts, args) = getopt.getopt(sys.argv[1:], "i:o:")
+(opts, args) = getopt.getopt(sys.argv[1:], "b:i:m:o:")
 try:
     inFile = open(args[0])
 except:
@@ -44,6 +25,11 @@ for opt in opts:
         inverters = opt[1].split(",")
     if opt[0] == "-o":
         outFileName = opt[1]
+    if opt[0] == "-m":
+        minInterval = float(opt[1])
+    if opt[0] == "-b":
+        binFileName = opt[1]
+writer = StateWriter(outFileName, minInterval, binFileName)
 
 # initialize the state dictionary
 if initialize:
@@ -54,48 +40,18 @@ if initialize:
                     {"stats": {"Temp": 0.0}}}
     for inverter in inverters:
         stateDict["inverters"]["stats"][inverter] = {"Vac":0.0, "Pac":0.0, "Eac":0.0, "Eday":0.0, "Etot": 0.0, "Temp": 0.0}
-    writeState(stateDict, outFileName)
+    with writer.lock:
+        writer.update(stateDict)
 else:
     # start with values from the file if it exists
-    try:
-        with open(outFileName) as stateFile:
-            stateDict = json.load(stateFile)
-    except IOError:
-        pass
+    stateDict = readState(outFileName)
+state = State(stateDict)
 
-# read the input forever
-while True:
-    jsonStr = ""
-    # wait for data
-    while jsonStr == "":
-        time.sleep(.1)
-        jsonStr = inFile.readline()
-    inDict = json.loads(jsonStr)
-    # update the state values
-    stateDict["inverters"].update(inDict["inverters"])
-    stateDict["optimizers"].update(inDict["optimizers"])
-    # compute optimizer power
-    for optimizer in stateDict["optimizers"].keys():
-        if optimizer != "stats":
-            stateDict["optimizers"][optimizer]["Pdc"] = stateDict["optimizers"][optimizer]["Vmod"] * stateDict["optimizers"][optimizer]["Imod"]
-    # compute the stats
-    stateDict["inverters"]["stats"]["Vac"] = avgItems(stateDict["inverters"], "Vac")
-    stateDict["inverters"]["stats"]["Pac"] = sumItems(stateDict["inverters"], "Pac")
-    stateDict["inverters"]["stats"]["Eac"] = sumItems(stateDict["inverters"], "Eac")
-    Eday = sumItems(stateDict["inverters"], "Eday")
-    # only update Eday if it increases
-    if Eday > stateDict["inverters"]["stats"]["Eday"]:
-        stateDict["inverters"]["stats"]["Eday"] = Eday
-    stateDict["inverters"]["stats"]["Etot"] = sumItems(stateDict["inverters"], "Etot")
-    stateDict["inverters"]["stats"]["Temp"] = avgItems(stateDict["inverters"], "Temp")
-    stateDict["optimizers"]["stats"]["Temp"] = avgItems(stateDict["optimizers"], "Temp")
-    # zero current energy and power for devices when an event occurs
-    if len(inDict["events"]) != 0:
-        for inverter in stateDict["inverters"].keys():
-            stateDict["inverters"][inverter]["Eac"] = 0.0
-            stateDict["inverters"][inverter]["Pac"] = 0.0
-        for optimizer in stateDict["optimizers"].keys():
-            stateDict["optimizers"][optimizer]["Vmod"] = 0.0
-            stateDict["optimizers"][optimizer]["Vopt"] = 0.0
-            stateDict["optimizers"][optimizer]["Imod"] = 0.0
-    writeState(stateDict, outFileName)
+# read the input until it ends, following the input file
+try:
+    for jsonStr in readLines(inFile, follow=inFile is not sys.stdin):
+        with writer.lock:
+            state.update(json.loads(jsonStr))
+            writer.update(stateDict)
+finally:
+    writer.close()
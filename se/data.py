@@ -6,8 +6,7 @@ import json
 import logging
 import se.logutils
 import se.commands
-from se.dataparams import *
-from se.datadevices import ParseDevice, merge_update
+from se.datadevices import ParseDevice, merge_update, numpy
 import codecs
 
 logger = logging.getLogger(__name__)
@@ -15,41 +14,36 @@ logger = logging.getLogger(__name__)
 # message debugging sequence numbers
 outSeq = 0
 
+# seTypes of the device data blocks to decode (None for all of them) and to skip without decoding, see setDeviceFilter
+includeTypes = None
+excludeTypes = set()
+
+# window of recently seen device data blocks, which are skipped as duplicates (None to decode them all)
+blockWindow = None
+
+# smallest number of blocks of the same type and length that are worth decoding as a batch
+batchMin = 2
+
+# parsers for the message data, indexed by function code, see registerParser
+parsers = {}
+
 # parse the message data
 def parseData(function, data):
-    if function in [
-            se.commands.PROT_RESP_ACK, se.commands.PROT_RESP_NACK, se.commands.PROT_CMD_MISC_GET_VER,
-            se.commands.PROT_CMD_MISC_GET_TYPE, se.commands.PROT_CMD_SERVER_GET_GMT,
-            se.commands.PROT_CMD_SERVER_GET_NAME, se.commands.PROT_CMD_POLESTAR_GET_STATUS,
-            se.commands.PROT_CMD_POLESTAR_MASTER_GRANT, se.commands.PROT_RESP_POLESTAR_MASTER_GRANT_ACK
-    ]:
-        # functions with no arguments
-        return ''.join(x.encode('hex') for x in data)
-    elif function == se.commands.PROT_CMD_SERVER_POST_DATA:
-        return parseDeviceData(data)
-    elif function == se.commands.PROT_RESP_POLESTAR_GET_STATUS:
-        return parseStatus(data)
-    elif function in [se.commands.PROT_CMD_PARAMS_GET_SINGLE, se.commands.PROT_CMD_UPGRADE_START]:
-        return parseParam(data)
-    elif function in [se.commands.PROT_CMD_MISC_RESET, se.commands.PROT_RESP_PARAMS_SINGLE]:
-        return parseValueType(data)
-    elif function == se.commands.PROT_RESP_MISC_GET_VER:
-        return parseVersion(data)
-    elif function == se.commands.PROT_CMD_PARAMS_SET_SINGLE:
-        return parseParamValue(data)
-    elif function == se.commands.PROT_CMD_UPGRADE_WRITE:
-        return parseOffsetLength(data)
-    elif function == se.commands.PROT_RESP_UPGRADE_SIZE:
-        return parseLong(data)
-    elif function in [se.commands.PROT_RESP_MISC_GET_TYPE]:
-        return parseParam(data)
-    elif function == se.commands.PROT_RESP_SERVER_GMT:
-        return parseTime(data)
-    elif function == se.commands.PROT_RESP_POLESTAR_GET_ENERGY_STATISTICS_STATUS:
-        return parseEnergyStats(data)
-    else:
+    try:
+        parser = parsers[function]
+    except KeyError:
         # unknown function type
         logger.info("Unknown function 0x%04x", function)
+        return parseHex(data)
+    return parser(data)
+
+# add, or replace, the parser for the data of messages with any of the specified function codes
+def registerParser(functions, parser):
+    for function in functions:
+        parsers[function] = parser
+
+# the message data as a hex string
+def parseHex(data):
     return codecs.encode(data, 'hex').decode('ascii')
 
 def parseEnergyStats(data):
@@ -126,147 +120,113 @@ def parseStatus(data):
         logger.data(l)
     return {"status": 0}
 
-# parse device data
+# parse device data, filtered as set by setDeviceFilter and setBlockWindow
 def parseDeviceData(data):
+    return decodeDeviceData(data, includeTypes, excludeTypes, blockWindow)
+
+# return the device data without the blocks that parseDeviceData would skip, so that it can be decoded later, or
+# elsewhere, with decodeDeviceData
+def filterDeviceData(data):
+    if includeTypes is None and not excludeTypes and blockWindow is None:
+        return data
+    devHdrLen = 8
+    blocks = []
+    dataPtr = 0
+    while dataPtr < len(data):
+        (seType, seId, devLen) = struct.unpack("<HLH", data[dataPtr:dataPtr + devHdrLen])
+        block = data[dataPtr:dataPtr + devHdrLen + devLen]
+        dataPtr += devHdrLen + devLen
+        if seType in excludeTypes or (includeTypes is not None and seType not in includeTypes):
+            continue
+        if blockWindow is not None and blockWindow.seen(block):
+            continue
+        blocks.append(block)
+    return b"".join(blocks)
+
+# parse device data, skipping the blocks with seTypes which aren't included (None for all of them) or are excluded,
+# and the blocks which are in the window of recently seen blocks (None to decode them all)
+def decodeDeviceData(data, includeTypes=None, excludeTypes=frozenset(), blockWindow=None):
     devHdrLen = 8
-    invDict = {}
-    optDict = {}
-    eventDict = {}
-    # Add a master dictionary, to store anything parsed by ParseDevice, indexed by the `_devType`
-    devsDict = {}
+    # Add a master dictionary, to store everything parsed by ParseDevice, indexed by the `_devType`
+    # The inverters, optimizers and events dictionaries are always reported, even if they are empty
+    devsDict = {"inverters": {}, "optimizers": {}, "events": {}}
+    # blocks for ParseDevice, in message order, and the ones which can be decoded together indexed by seType and length
+    devices = []
+    batches = {}
 
     dataPtr = 0
     while dataPtr < len(data):
         # device header
         (seType, seId,
          devLen) = struct.unpack("<HLH", data[dataPtr:dataPtr + devHdrLen])
+        if seType in excludeTypes or (includeTypes is not None and seType not in includeTypes):
+            # unwanted device, skip over its data
+            dataPtr += devHdrLen + devLen
+            continue
+        if blockWindow is not None and blockWindow.seen(data[dataPtr:dataPtr + devHdrLen + devLen]):
+            # the device has already reported exactly this data, skip over it
+            dataPtr += devHdrLen + devLen
+            continue
         seId = parseId(seId)
         dataPtr += devHdrLen
         # device data
-        if seType == 0x0000:  # optimizer data
-            optDict[seId] = parseOptData(seId, optItems,
-                                         data[dataPtr:dataPtr + devLen])
-            logDevice("optimizer:     ", seType, seId, devLen, optDict[seId])
-        elif seType == 0x0080:  # new format optimizer data
-            optDict[seId] = parseNewOptData(seId, optItems,
-                                            data[dataPtr:dataPtr + devLen])
-            logDevice("optimizer:     ", seType, seId, devLen, optDict[seId])
-        elif seType == 0x0082:  # s440 optimizers
-            optDict[seId] = parseS440OptData(seId, optItems,
-                                            data[dataPtr:dataPtr + devLen])
-            logDevice("optimizer:     ", seType, seId, devLen, optDict[seId])
-        elif seType == 0x0010:  # inverter data
-            invDict[seId] = parseInvData(seId, invItems,
-                                         data[dataPtr:dataPtr + devLen])
-            # Correct odd case where solaredge inverter sends Nan value in opposite byte order to all other float values
-            # ie solaredge sends b'\xff\xff\x7f\xff' which in little endian format unpacks as - 3.402... * 10 ** 38
-            # but b'\xff\x7f\xff\xff' unpacks as Nan, which is the "correct" value when this byte pattern is seen.
-            if invDict[seId]["Pmax"] < -3 * 10**38:
-                invDict[seId]["Pmax"] = float('nan')
-            logDevice("inverter:     ", seType, seId, devLen, invDict[seId])
-        elif seType == 0x0011:  # 3 phase inverter data
-            invDict[seId] = parseInv3PhData(seId, inv3PhItems,
-                                            data[dataPtr:dataPtr + devLen])
-            logDevice("inverter:     ", seType, seId, devLen, invDict[seId])
-        elif seType == 0x0300:  # wake or sleep event
-            eventDict[seId] = parseEventData(seId, eventItems,
-                                             data[dataPtr:dataPtr + devLen])
-            logDevice("event:         ", seType, seId, devLen, eventDict[seId])
-        else:  # unknown device type, or one that ParseDevice can handle
-
-            # In production would usually set explorer to False, to prevent excessively long (and mostly useless) parse
-            # results for unknown device types.
-            parsedDevice = ParseDevice(
-                data[dataPtr - devHdrLen:dataPtr + devLen], explorer=False)
-            # Add the new device attributes (wrapped in  dictionary of appropriate identifiers) to the dictionary of devices
-            merge_update(devsDict, parsedDevice.wrap_in_ids())
-            logDevice("{}: ".format(parsedDevice._devType), seType, seId,
-                      devLen, parsedDevice.wrap_in_ids())
+        block = data[dataPtr - devHdrLen:dataPtr + devLen]
+        if batchDecoding(seType, devLen):
+            # defer decoding until all the blocks like it have been found
+            batches.setdefault((seType, devLen), []).append(len(devices))
+            devices.append([seType, seId, devLen, block])
+        else:
+            # In production would usually set explorer to False, to prevent excessively long (and mostly useless)
+            # parse results for unknown device types.
+            devices.append([seType, seId, devLen, ParseDevice(block, explorer=False)])
 
         dataPtr += devLen
-    # A bit of a lazy way out, but embed the pre-existing dictionaries into devsDict
-    devsDict["inverters"] = invDict
-    devsDict["optimizers"] = optDict
-    devsDict["events"] = eventDict
+
+    # decode the deferred blocks, a batch at a time, unless there is only one of them
+    for (seType, devLen), slots in batches.items():
+        blocks = [devices[slot][3] for slot in slots]
+        if len(blocks) < batchMin:
+            parsedDevices = [ParseDevice(block, explorer=False) for block in blocks]
+        else:
+            parsedDevices = ParseDevice.subclassFor(seType).parseBatch(blocks)
+        for slot, parsedDevice in zip(slots, parsedDevices):
+            devices[slot][3] = parsedDevice
+
+    for seType, seId, devLen, parsedDevice in devices:
+        if parsedDevice._legacy:
+            # A legacy device replaces any earlier block for the same seId, rather than being merged with it
+            devsDict[parsedDevice._devType][parsedDevice._seId] = parsedDevice
+        else:
+            # Add the new device attributes (wrapped in  dictionary of appropriate identifiers) to the dictionary of devices
+            merge_update(devsDict, parsedDevice.wrap_in_ids())
+        logDevice("{}: ".format(parsedDevice._devType), seType, seId,
+                  devLen, parsedDevice.wrap_in_ids())
 
     return devsDict
 
-def parseEventData(seId, eventItems, devData):
-    # unpack data and map to items
-    seEventData = [
-        struct.unpack(eventInFmt, devData[:invInFmtLen])[i] for i in eventIdx
-    ]
-    seEventData[2] = formatDateTime(seEventData[2])
-    if seEventData[1] == 0:
-        seEventData[3] = formatDateTime(seEventData[3])
-    else:
-        seEventData[4] = formatDateTime(seEventData[4])
-    return devDataDict(seId, eventItems, seEventData)
-
-def parseInvData(seId, invItems, devData):
-    # unpack data and map to items
-    seInvData = [
-        struct.unpack(invInFmt, devData[:invInFmtLen])[i] for i in invIdx
-    ]
-    return devDataDict(seId, invItems, seInvData)
-
-def parseInv3PhData(seId, invItems, devData):
-    # unpack data and map to items
-    seInvData = [
-        struct.unpack(inv3PhInFmt, devData[:inv3PhInFmtLen])[i]
-        for i in inv3PhIdx
-    ]
-    return devDataDict(seId, invItems, seInvData)
-
-def parseOptData(seId, optItems, devData):
-    # unpack data and map to items
-    seOptData = [
-        struct.unpack(optInFmt, devData[:optInFmtLen])[i] for i in optIdx
-    ]
-    seOptData[1] = parseId(seOptData[1])
-    return devDataDict(seId, optItems, seOptData)
-
-def parseNewOptData(seId, optItems, devData):
-    data = bytearray()
-    data.extend(devData)
-    (timeStamp, uptime) = struct.unpack("<LH", devData[0:6])
-    vpan = 0.125 * (data[6] | (data[7] << 8 & 0x300))
-    vopt = 0.125 * (data[7] >> 2 | (data[8] << 6 & 0x3c0))
-    imod = 0.00625 * (data[9] << 4 | (data[8] >> 4 & 0xf))
-    eday = 0.25 * (data[11] << 8 | data[10])
-    temp = 2.0 * struct.unpack("<b", devData[12:13])[0]
-    # Don't have an inverter ID in the data, substitute 0
-    return devDataDict(seId, optItems,
-                       [timeStamp, 0, uptime, vpan, vopt, imod, eday, temp])
-
-def parseS440OptData(seId, optItems, devData):
-    data = bytearray()
-    data.extend(devData)
-    (timeStamp, uptime) = struct.unpack("<LH", devData[0:6])
-    vpan = 0.125 * (data[6] | (data[7] << 8 & 0x300))
-    vopt = 0.125 * (data[7] >> 2 | (data[8] << 6 & 0x3c0))
-    imod = 0.00625 * (data[9] << 4 | (data[8] >> 4 & 0xf))
-    # we don't have those fields
-    eday = 0
-    temp = 0
-    # Don't have an inverter ID in the data, substitute 0
-    return devDataDict(seId, optItems,
-                       [timeStamp, 0, uptime, vpan, vopt, imod, eday, temp])
-
-# create a dictionary of device data items
-def devDataDict(seId, itemNames, itemValues):
-    devDict = {}
-    try:
-        devDict["Date"] = formatDateStamp(itemValues[0])
-        devDict["Time"] = formatTimeStamp(itemValues[0])
-    except Exception as ex:
-        logger.info("Invalid time stamp: "+str(itemValues[0])+" "+str(ex))
-        devDict["Date"] = "invalid"
-        devDict["Time"] = "invalid"
-    devDict["ID"] = seId
-    for i in range(3, len(itemNames)):
-        devDict[itemNames[i]] = itemValues[i - 2]
-    return devDict
+# only decode the device data blocks with the included seTypes (or all of them if there are none)
+# and never the ones with the excluded seTypes
+def setDeviceFilter(include=None, exclude=None):
+    global includeTypes, excludeTypes
+    includeTypes = set(include) if include else None
+    excludeTypes = set(exclude) if exclude else set()
+
+# skip the device data blocks which are in the window of recently seen blocks (or none if it is None)
+def setBlockWindow(window):
+    global blockWindow
+    blockWindow = window
+
+# return True if blocks of this type and length can be decoded in batches
+def batchDecoding(seType, devLen):
+    if numpy is None:
+        return False
+    deviceClass = ParseDevice.subclassFor(seType)
+    if deviceClass is None or not deviceClass._batch:
+        return False
+    # blocks that don't match the definitions are left to ParseDevice, which reports them as undeciphered data
+    # or, for legacy devices, ignores the extra data
+    defnLen = sum(paramLen for paramLen, paramInFmt, paramName, outFormatFn, out, comment in deviceClass._defn)
+    return devLen == defnLen or (deviceClass._legacy and devLen > defnLen)
 
 # write device data to output files
 def writeData(msgDict, outFile):
@@ -279,30 +239,33 @@ def writeData(msgDict, outFile):
         outFile.flush()
 
 # remove the extra bit that is sometimes set in a device ID and upcase the letters
-def parseId(seId):
-    return ("%x" % (seId & 0xff7fffff)).upper()
-
-# format a date
-def formatDateStamp(timeStamp):
-    return time.strftime("%Y-%m-%d", time.localtime(timeStamp))
-
-# format a time
-def formatTimeStamp(timeStamp):
-    return time.strftime("%H:%M:%S", time.localtime(timeStamp))
+parseId = ParseDevice.parseId
 
 # format a timestamp using asctime
-# return the hex value if timestamp is invalid
-def formatDateTime(timeStamp):
-    try:
-        return time.asctime(time.localtime(timeStamp))
-    except ValueError:
-        return ''.join(x.encode('hex') for x in struct.pack("<L", timeStamp))
-    except Exception as ex:
-        logger.info("Invalid time stamp: "+str(timeStamp)+" "+str(ex))
-        return "invalid"
+formatDateTime = ParseDevice.formatDateTime
 
 # formatted print of device data
 def logDevice(devType, seType, seId, devLen, devData):
     logger.data("%s %s type: %04x len: %04x", devType, seId, seType, devLen)
     for k,v in devData.items():
         logger.data("    %s : %s", k, v)
+
+# functions with no arguments
+registerParser([
+    se.commands.PROT_RESP_ACK, se.commands.PROT_RESP_NACK, se.commands.PROT_CMD_MISC_GET_VER,
+    se.commands.PROT_CMD_MISC_GET_TYPE, se.commands.PROT_CMD_SERVER_GET_GMT,
+    se.commands.PROT_CMD_SERVER_GET_NAME, se.commands.PROT_CMD_POLESTAR_GET_STATUS,
+    se.commands.PROT_CMD_POLESTAR_MASTER_GRANT, se.commands.PROT_RESP_POLESTAR_MASTER_GRANT_ACK
+], parseHex)
+registerParser([se.commands.PROT_CMD_SERVER_POST_DATA], parseDeviceData)
+registerParser([se.commands.PROT_RESP_POLESTAR_GET_STATUS], parseStatus)
+registerParser([
+    se.commands.PROT_CMD_PARAMS_GET_SINGLE, se.commands.PROT_CMD_UPGRADE_START, se.commands.PROT_RESP_MISC_GET_TYPE
+], parseParam)
+registerParser([se.commands.PROT_CMD_MISC_RESET, se.commands.PROT_RESP_PARAMS_SINGLE], parseValueType)
+registerParser([se.commands.PROT_RESP_MISC_GET_VER], parseVersion)
+registerParser([se.commands.PROT_CMD_PARAMS_SET_SINGLE], parseParamValue)
+registerParser([se.commands.PROT_CMD_UPGRADE_WRITE], parseOffsetLength)
+registerParser([se.commands.PROT_RESP_UPGRADE_SIZE], parseLong)
+registerParser([se.commands.PROT_RESP_SERVER_GMT], parseTime)
+registerParser([se.commands.PROT_RESP_POLESTAR_GET_ENERGY_STATISTICS_STATUS], parseEnergyStats)
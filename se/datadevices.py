@@ -33,12 +33,22 @@ import time
 import binascii
 import logging
 
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, without it every data block is parsed individually
+    numpy = None
+
 logger = logging.getLogger(__name__)
 
 # Spacer field for documenting field definitions more neatly, used for convenience
 sp = "\n\t\t\t\t\t\t: "
 # Create a "utility" constant, to use later to make code less verbose
 nan = float('nan')
+# The numpy equivalents of the (little endian, standard size) struct formats used in field definitions
+batchFormats = {
+    'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'l': '<i4', 'L': '<u4', 'f': '<f4', 'd': '<f8'
+}
 
 class ParseDevice(dict):
     """
@@ -93,6 +103,29 @@ class ParseDevice(dict):
     # See ParseDevice_0x0030 for an example.
     _hypotheses = []
 
+    # BATCH decoding, optional.
+    #
+    # Subclasses whose items can all be decoded with numpy (see the parseBatch method) set this to True, so that all the
+    # blocks of that seType and length in one message are decoded together rather than one at a time.
+    # Any derivations must then also be coded as array operations, in the batchDerivations method.
+    _batch = False
+
+    # BITFIELDS, optional, for items which are packed into the data on bit rather than byte boundaries.
+    #
+    # The bytes which contain them are defined in _defn with the 'x' (skip) format, and each item is defined here as a
+    # list of [bitOffset, bitLen, paramName, scale, out (to csv) True or False, comment]
+    # where bitOffset counts from the least significant bit of the first byte of the device data (ie little endian).
+    # See ParseDevice_0x0080 for an example.
+    _bitfields = []
+
+    # LEGACY layout, optional.
+    #
+    # Inverters, optimizers and events were decoded before ParseDevice existed, and are still reported in their own
+    # dictionaries, keyed by seId, containing only Date, Time, ID and the defined items.  Subclasses for those seTypes set
+    # this to True and set _devName (and _devType) to the name of the dictionary.  The "not reported" nan check is not
+    # applied to their floats, and any data beyond the definitions is ignored rather than reported as Undeciphered_data.
+    _legacy = False
+
     def __new__(cls, data, explorer=False):
         # Some fancy footwork so that I can always start to create a ParseDevice, but actually get a subclass which is
         # appropriate for the seType encountered in the data block (provided a subclass specific to the seType has been
@@ -101,9 +134,9 @@ class ParseDevice(dict):
         (seType, seId, devLen) = struct.unpack("<HLH", data[0:devHdrLen])
 
         # Search for a subclass which can handle this seType
-        for subclass in cls.__subclasses__():
-            if subclass._dev == seType:
-                return (subclass(data))
+        subclass = cls.subclassFor(seType)
+        if subclass is not None:
+            return (subclass(data))
 
         # Otherwise either return a ParseDevice_Explorer (explorer=True),
         # which is a special subclass which will parse almost anything,
@@ -125,6 +158,29 @@ class ParseDevice(dict):
             ]]
             return newInstance
 
+    @classmethod
+    def subclassFor(cls, seType):
+        """
+        Find the subclass tuned to a particular seType.
+
+        :param seType: The seType from the header of a block of seData.
+        :return: The subclass of ParseDevice which parses blocks of that seType, or None if there isn't one.
+        """
+        for subclass in cls.__subclasses__():
+            if subclass._dev == seType:
+                return subclass
+        return None
+
+    @classmethod
+    def seTypesFor(cls, devName):
+        """
+        Find the seTypes parsed by the subclasses with a particular device name.
+
+        :param devName: A device name, eg "inverters" or "batteries".
+        :return: A list of the seTypes, which is empty if devName is not known.
+        """
+        return [subclass._dev for subclass in cls.__subclasses__() if subclass._devName == devName]
+
     @staticmethod
     def parseId(seId):
         return ("%x" % (seId & 0xff7fffff)).upper()
@@ -147,6 +203,18 @@ class ParseDevice(dict):
             logger.info("Invalid time stamp: "+str(timeStamp)+" "+str(ex))
             return "invalid"
 
+    # format a timestamp using asctime
+    # return the hex value if timestamp is invalid
+    @staticmethod
+    def formatDateTime(timeStamp):
+        try:
+            return time.asctime(time.localtime(timeStamp))
+        except ValueError:
+            return binascii.hexlify(struct.pack("<L", timeStamp)).decode('ascii')
+        except Exception as ex:
+            logger.info("Invalid time stamp: "+str(timeStamp)+" "+str(ex))
+            return "invalid"
+
     # format a hex entry as a readable string
     @staticmethod
     def hexData(data):
@@ -187,6 +255,13 @@ class ParseDevice(dict):
         self.codeDerivations()
         self.checkHypotheses()
 
+    def __reduce__(self):
+        """
+        Pickle a parsed device as a plain dictionary of its items, as it can't be created again without its data block.
+        This is how parsed devices are returned from the parser processes of semonitor.py -n.
+        """
+        return (dict, (dict(self),))
+
     def parseDevTable(self, data):
 
         dataPtr = 0
@@ -199,23 +274,27 @@ class ParseDevice(dict):
         # For (almost) all subclasses, _devType will already have this value.
         # This is necessary only when a default catchall parse is happening, because a specific parser for seType has
         # not been defined.
-        self._devType = '{}_{:#06x}'.format(self._devName, seType)
+        if not self._legacy:
+            self._devType = '{}_{:#06x}'.format(self._devName, seType)
         # Store seId as an attribute for later use as part of the standard "dictionary of dictionaries" wrapper when
         # a parsed instance is converted to json.
         self._seId = self.parseId(seId)
 
-        self.update({
-            'seType': '{:#06x}'.format(seType),
-            'seId': self._seId,
-            'devLen': devLen,
-            'devType': self._devType
-        })
+        if self._legacy:
+            self['ID'] = self._seId
+        else:
+            self.update({
+                'seType': '{:#06x}'.format(seType),
+                'seId': self._seId,
+                'devLen': devLen,
+                'devType': self._devType
+            })
 
         if self.defnLen > devLen:
             raise ValueError(
                 'You have defined more bytes, {}, than the message contains, {}'.
                 format(self.defnLen, devLen))
-        elif self.defnLen < devLen:
+        elif self.defnLen < devLen and not self._legacy:
             # By default, convert any remaining undefined bytes to their representation as a hexadecimal string.
             self._defn.append([
                 devLen - self.defnLen, 'hex', "Undeciphered_data",
@@ -224,7 +303,11 @@ class ParseDevice(dict):
 
         for paramLen, paramInFmt, paramName, outFormatFn, out, comment in self._defn:
             # Extract the field
-            if paramInFmt == 'hex':
+            if paramInFmt == 'x':
+                # Skip the bytes, they are either not reported or are decoded as _bitfields
+                dataPtr += paramLen
+                continue
+            elif paramInFmt == 'hex':
                 self[paramName] = data[dataPtr:dataPtr + paramLen]
             # Check for a specific value which I believe should be interpreted as nan
             # In little endian format '\xff\xff\x7f\xff' unpacks -3.402...*10**38.
@@ -234,7 +317,7 @@ class ParseDevice(dict):
             # Note that if unpacked in **big** endian format, this special value actually unpacks as nan.
             # I suspect a legacy "bug" somewhere in the solaredge messages, but in the meantime just check the bytes
             # and fix it.
-            elif paramInFmt == 'f' and (
+            elif paramInFmt == 'f' and not self._legacy and (
                     data[dataPtr:dataPtr + paramLen] == b'\xff\xff\x7f\xff'):
                 self[paramName] = float('nan')
             else:
@@ -261,9 +344,17 @@ class ParseDevice(dict):
                     logger.debug('"%s is not a valid time, changed to "00:00:01"',
                         format(self[paramName]))
                     self["Time"] = "00:00:01"
+                if self._legacy:
+                    # Legacy devices only report the formatted Date and Time
+                    del self[paramName]
             elif outFormatFn is not None:
                 self[paramName] = outFormatFn(self[paramName])
             dataPtr += paramLen
+
+        if self._bitfields:
+            bits = int.from_bytes(data[devHdrLen:devHdrLen + self.defnLen], 'little')
+            for bitOffset, bitLen, paramName, scale, out, comment in self._bitfields:
+                self[paramName] = scale * (bits >> bitOffset & ((1 << bitLen) - 1))
         return
 
     def setDerivationDefaults(self):
@@ -277,11 +368,144 @@ class ParseDevice(dict):
     def checkHypotheses(self):
         for hypothesis in self._hypotheses:
             if not eval(hypothesis):
-                msg = [
-                    "Failed hypothesis", self.__class__.__name__, self["Date"],
-                    self["Time"], ":", hypothesis, "is not True"
-                ]
-                logging.warn(" ".join(msg))
+                self.failedHypothesis(hypothesis)
+
+    def failedHypothesis(self, hypothesis):
+        msg = [
+            "Failed hypothesis", self.__class__.__name__, self["Date"],
+            self["Time"], ":", hypothesis, "is not True"
+        ]
+        logging.warn(" ".join(msg))
+
+    @classmethod
+    def batchDtype(cls, devLen):
+        """
+        Generate a numpy structured dtype from the _defn list, which maps a complete data block (header included) of
+        this seType onto a single record.
+
+        :param devLen: The length of the data block, which must be at least the length of the definitions.
+        :return: A numpy dtype, with one named field per header item and per (not skipped) definition.
+        """
+        names = ['seType', 'seId', 'devLen']
+        formats = ['<u2', '<u4', '<u2']
+        offsets = [0, 2, 6]
+        offset = 8
+        for paramLen, paramInFmt, paramName, outFormatFn, out, comment in cls._defn:
+            if paramInFmt == 'x':
+                offset += paramLen
+                continue
+            names.append(paramName)
+            if paramInFmt == 'hex':
+                formats.append('V{}'.format(paramLen))
+            elif paramInFmt.endswith('s'):
+                formats.append('S{}'.format(paramLen))
+            else:
+                formats.append(batchFormats[paramInFmt])
+            offsets.append(offset)
+            offset += paramLen
+        return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': 8 + devLen})
+
+    @classmethod
+    def parseBatch(cls, blocks):
+        """
+        Decode a list of data blocks of this seType, which all have the same length, in one pass using numpy.
+
+        The result is exactly the same as creating a ParseDevice from each block in turn, but the unpacking, the
+        "not reported" nan check and any derivations are done as array operations over all the blocks at once, and the
+        Date and Time strings are only formatted once for each distinct timestamp.
+
+        :param blocks: A list of blocks of seData, each including the standard header.
+        :return: A list of parsed device instances, in the same order as blocks.
+        """
+        devLen = struct.unpack("<H", blocks[0][6:8])[0]
+        records = numpy.frombuffer(b"".join(blocks), dtype=cls.batchDtype(devLen))
+
+        # Unpack each field into an array of values, one per block
+        cols = {}
+        for paramLen, paramInFmt, paramName, outFormatFn, out, comment in cls._defn:
+            if paramInFmt == 'x':
+                continue
+            elif paramInFmt == 'f' and not cls._legacy:
+                # The same "not reported" check as parseDevTable, applied to the whole column at once.
+                with numpy.errstate(invalid='ignore'):
+                    values = records[paramName].astype(numpy.float64)
+                values[records[paramName].view('<u4') == 0xff7fffff] = nan
+                cols[paramName] = values
+            else:
+                cols[paramName] = records[paramName]
+        if cls._bitfields:
+            # Assemble each bitfield from the bytes which contain it, least significant byte first
+            octets = numpy.frombuffer(b"".join(blocks), dtype=numpy.uint8).reshape(len(blocks), 8 + devLen)
+            for bitOffset, bitLen, paramName, scale, out, comment in cls._bitfields:
+                bits = numpy.zeros(len(blocks), dtype=numpy.uint64)
+                for byte in range(bitOffset // 8, (bitOffset + bitLen + 7) // 8):
+                    bits |= octets[:, 8 + byte].astype(numpy.uint64) << numpy.uint64(8 * (byte - bitOffset // 8))
+                bits = bits >> numpy.uint64(bitOffset % 8) & numpy.uint64((1 << bitLen) - 1)
+                cols[paramName] = scale * bits.astype(numpy.float64) if isinstance(scale, float) else scale * bits
+        cls.batchDerivations(cols)
+
+        # Convert the arrays back to python values, formatting them as parseDevTable would
+        items = []
+        dateTimes = {}
+        for paramLen, paramInFmt, paramName, outFormatFn, out, comment in cls._defn:
+            if paramInFmt == 'x':
+                continue
+            values = cols[paramName].tolist()
+            if paramInFmt.endswith('s'):
+                values = [value.decode('utf-8').strip('\x00') for value in values]
+            if outFormatFn == 'dateTime':
+                for value in set(values):
+                    dateTimes[value] = (cls.formatDateStamp(value), cls.formatTimeStamp(value))
+            elif outFormatFn is not None:
+                values = [outFormatFn(value) for value in values]
+            items.append((paramName, outFormatFn, values))
+        for bitOffset, bitLen, paramName, scale, out, comment in cls._bitfields:
+            items.append((paramName, None, cols[paramName].tolist()))
+
+        devices = []
+        seTypes = records['seType'].tolist()
+        seIds = records['seId'].tolist()
+        for i in range(len(blocks)):
+            device = super(ParseDevice, cls).__new__(cls)
+            device._seId = cls.parseId(seIds[i])
+            if cls._legacy:
+                device['ID'] = device._seId
+            else:
+                device.update({
+                    'seType': '{:#06x}'.format(seTypes[i]),
+                    'seId': device._seId,
+                    'devLen': devLen,
+                    'devType': device._devType
+                })
+            for paramName, outFormatFn, values in items:
+                if outFormatFn == 'dateTime':
+                    if not cls._legacy:
+                        # Legacy devices only report the formatted Date and Time
+                        device[paramName] = values[i]
+                    (device['Date'], device['Time']) = dateTimes[values[i]]
+                else:
+                    device[paramName] = values[i]
+            device.setDerivationDefaults()
+            devices.append(device)
+
+        # Evaluate each hypothesis over the whole batch if it can be, otherwise one device at a time
+        for hypothesis in cls._hypotheses:
+            try:
+                held = eval(hypothesis, globals(), {'self': cols})
+                if getattr(held, 'shape', None) != (len(devices),):
+                    raise TypeError("not an array result")
+            except Exception:
+                held = [eval(hypothesis, globals(), {'self': device}) for device in devices]
+            for device, ok in zip(devices, held):
+                if not ok:
+                    device.failedHypothesis(hypothesis)
+        return devices
+
+    @classmethod
+    def batchDerivations(cls, cols):
+        # Subclasses which set _batch, and which override codeDerivations, must override this with the equivalent array
+        # operations on cols, a dictionary of item names to numpy arrays of item values.
+        pass
 
     def wrap_in_ids(self):
         """
@@ -309,6 +533,10 @@ class ParseDevice(dict):
             name for itemLen, fmt, name, outFmt, out, comment in cls._defn
             if out
         ]
+        devItemNames.extend([
+            paramName for bitOffset, bitLen, paramName, scale, out, comment in cls._bitfields
+            if out
+        ])
         devItemNames.extend([
             paramName for paramName, paramDefault, out, comment in cls._derivn
             if out
@@ -356,6 +584,12 @@ class ParseDevice(dict):
                     itemLine.format(byte, paramLen, word, paramName, comment))
                 byte += paramLen
                 word = byte / 4.0
+        if len(cls._bitfields) > 0:
+            msg.append("Bit packed items\n")
+            for bitOffset, bitLen, paramName, scale, out, comment in cls._bitfields:
+                msg.append(
+                    itemLine.format('bit', bitOffset, bitLen, paramName,
+                                    '(scale={}) {}'.format(scale, comment)))
         if len(cls._derivn) > 0:
             msg.append("Derived items\n")
             for paramName, paramDefault, out, comment in cls._derivn:
@@ -367,6 +601,278 @@ class ParseDevice(dict):
             msg.append(subclass.itemDefs())
         return "\n".join(msg)
 
+class ParseDevice_0x0010(ParseDevice):
+    def __new__(cls, data):
+        # Create a bare minimum instance of a dictionary.
+        # NB This step is essential, because otherwise, when this subclass was instantiated / created, it would call
+        # the __new__ method of ParseDevice itself, which would redirect the creation to this subclass, and so on until
+        # the recursion limit was reached!
+        return super(ParseDevice, cls).__new__(cls)
+
+    _dev = 0x0010
+    _devName = 'inverters'
+    _devType = _devName
+    _legacy = True
+    _batch = True
+    _defn = [
+        # device specific fields
+        #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
+        [4, 'L', "dateTime", "dateTime", False, "Seconds since the epoch"],
+        [4, 'L', 'Uptime', None, True, "Seconds, uptime ?"],
+        [4, 'L', 'Interval', None, True, "Seconds, time in last interval ?"],
+        [4, 'f', 'Temp', None, True, "degrees C, temperature"],
+        [4, 'f', 'Eday', None, True, "Wh, energy produced today"],
+        [4, 'f', 'Eac', None, True, "Wh, energy produced in last interval"],
+        [4, 'f', 'Vac', None, True, "Volts, AC"],
+        [4, 'f', 'Iac', None, True, "Amps, AC"],
+        [4, 'f', 'Freq', None, True, "Hz, frequency"],
+        [8, 'x', 'data9_10', None, False, "Not reported, 0xff7fffff"],
+        [4, 'f', 'Vdc', None, True, "Volts, DC"],
+        [4, 'x', 'data12', None, False, "Not reported, 0xff7fffff"],
+        [4, 'f', 'Etot', None, True, "Wh, total energy produced"],
+        [
+            16, 'x', 'data14_17', None, False,
+            "Not reported, unknown" + sp + "0xff7fffff" + sp + "0.0" + sp + "0.0"
+        ],
+        [4, 'f', 'Pmax', None, True, "W, max power (eg 5000)"],
+        [
+            16, 'x', 'data19_22', None, False,
+            "Not reported, 0.0" + sp + "unknown" + sp + "0xff7fffff" + sp + "0xff7fffff"
+        ],
+        [4, 'f', 'Pac', None, True, "W, AC power"],
+        [8, 'x', 'data24_25', None, False, "Not reported, unknown" + sp + "0xff7fffff"],
+    ]
+
+    def codeDerivations(self):
+        # Correct odd case where solaredge inverter sends Nan value in opposite byte order to all other float values
+        # ie solaredge sends b'\xff\xff\x7f\xff' which in little endian format unpacks as - 3.402... * 10 ** 38
+        # but b'\xff\x7f\xff\xff' unpacks as Nan, which is the "correct" value when this byte pattern is seen.
+        if self['Pmax'] < -3 * 10**38:
+            self['Pmax'] = nan
+
+    @classmethod
+    def batchDerivations(cls, cols):
+        # The same Pmax correction as codeDerivations, for a whole batch of blocks.
+        cols['Pmax'] = cols['Pmax'].copy()
+        cols['Pmax'][cols['Pmax'] < -3 * 10**38] = nan
+
+class ParseDevice_0x0011(ParseDevice):
+    def __new__(cls, data):
+        # Create a bare minimum instance of a dictionary.
+        # NB This step is essential, because otherwise, when this subclass was instantiated / created, it would call
+        # the __new__ method of ParseDevice itself, which would redirect the creation to this subclass, and so on until
+        # the recursion limit was reached!
+        return super(ParseDevice, cls).__new__(cls)
+
+    _dev = 0x0011
+    _devName = 'inverters'
+    _devType = _devName
+    _legacy = True
+    _batch = True
+    _defn = [
+        # device specific fields
+        #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
+        [4, 'L', "dateTime", "dateTime", False, "Seconds since the epoch"],
+        [4, 'L', 'Uptime', None, True, "Seconds, uptime"],
+        [4, 'L', 'Interval', None, True, "Seconds, time in last interval"],
+        [4, 'f', 'Temp', None, True, "degrees C, temperature"],
+        [4, 'f', 'Eday', None, True, "Wh, energy produced today"],
+        [4, 'f', 'Eac', None, True, "Wh, energy produced in last interval"],
+        [4, 'f', 'Vac1', None, True, "Volts, AC phase 1"],
+        [4, 'f', 'Vac2', None, True, "Volts, AC phase 2"],
+        [4, 'f', 'Vac3', None, True, "Volts, AC phase 3"],
+        [4, 'f', 'Iac1', None, True, "Amps, AC phase 1"],
+        [4, 'f', 'Iac2', None, True, "Amps, AC phase 2"],
+        [4, 'f', 'Iac3', None, True, "Amps, AC phase 3"],
+        [4, 'f', 'Freq1', None, True, "Hz, frequency phase 1"],
+        [4, 'f', 'Freq2', None, True, "Hz, frequency phase 2"],
+        [4, 'f', 'Freq3', None, True, "Hz, frequency phase 3"],
+        [
+            4, 'L', 'EdayDC', None, True,
+            "Same as Eday, but measured at DC side." + sp +
+            "Obfuscated by SE because it would directly reveal inverter efficiency."
+        ],
+        [
+            4, 'L', 'Edc', None, True,
+            "Same as Eac, but measured at DC side. Obfuscated by SE just like EdayDC."
+        ],
+        [4, 'f', 'Vdc', None, True, "Volts, DC"],
+        [4, 'L', 'Idc', None, True, "Same as Iac, but at DC side. Obfuscated by SE."],
+        [4, 'f', 'Etot', None, True, "Wh, total energy produced"],
+        [4, 'f', 'Irdc', None, True, "What's this?"],
+        [4, 'L', 'data21', None, True, "0xff7fffff"],
+        [4, 'L', 'data22', None, True, "0.0"],
+        [4, 'L', 'data23', None, True, "0.0"],
+        [4, 'f', 'CosPhi1', None, True, "Power factor phase 1"],
+        [4, 'f', 'CosPhi2', None, True, "Power factor phase 2"],
+        [4, 'f', 'CosPhi3', None, True, "Power factor phase 3"],
+        [
+            4, 'L', 'mode', None, True,
+            "Mode" + sp + "1=OFF, 2=SLEEPING, 3=STARTING, 4=MPPT, 6=SHUTTING_DOWN, 8=STANDBY"
+        ],
+        [4, 'f', 'GndFrR', None, True, "Ground Fault Resistance"],
+        [4, 'f', 'data29', None, True, "Is this Power Limit in percent?, always 100 or 0"],
+        [4, 'f', 'IoutDC', None, True, "This is what SolarEdge calls it."],
+        [4, 'L', 'data31', None, True, "0xff7fffff"],
+    ]
+
+class ParseDevice_0x0000(ParseDevice):
+    def __new__(cls, data):
+        # Create a bare minimum instance of a dictionary.
+        # NB This step is essential, because otherwise, when this subclass was instantiated / created, it would call
+        # the __new__ method of ParseDevice itself, which would redirect the creation to this subclass, and so on until
+        # the recursion limit was reached!
+        return super(ParseDevice, cls).__new__(cls)
+
+    _dev = 0x0000
+    _devName = 'optimizers'
+    _devType = _devName
+    _legacy = True
+    _batch = True
+    _defn = [
+        # device specific fields
+        #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
+        [4, 'L', "dateTime", "dateTime", False, "Seconds since the epoch"],
+        [4, 'L', 'Inverter', ParseDevice.parseId, True, "seId of the inverter the optimizer reports to"],
+        [4, 'x', 'data2', None, False, "Not reported, unknown"],
+        [4, 'L', 'Uptime', None, True, "Seconds, uptime ?"],
+        [4, 'f', 'Vmod', None, True, "Volts, module voltage"],
+        [4, 'f', 'Vopt', None, True, "Volts, optimizer voltage"],
+        [4, 'f', 'Imod', None, True, "Amps, module current"],
+        [4, 'f', 'Eday', None, True, "Wh, energy produced today"],
+        [4, 'f', 'Temp', None, True, "degrees C, temperature"],
+    ]
+
+class ParseDevice_0x0080(ParseDevice):
+    # Byte index (in reverse order):
+    #
+    # 0c 0b 0a 09 08 07 06 05 04 03 02 01 00
+    # Tt Ee ee Cc cO o# pp Uu uu Dd dd dd dd
+    #  # = oo|Pp
+    #
+    #  Temp, 8bit (1.6 degC)  Signed?, 1.6 is best guess at factor
+    #  Energy in day, 16bit (1/4 Wh)
+    #  Current (panel), 12 bit (1/160 Amp)
+    #  voltage Output, 10 bit (1/8 v)
+    #  voltage Panel, 10 bit (1/8 v)
+    #  Uptime of optimiser, 16 bit (secs)
+    #  DateTime, 32 bit (secs)
+
+    def __new__(cls, data):
+        # Create a bare minimum instance of a dictionary.
+        # NB This step is essential, because otherwise, when this subclass was instantiated / created, it would call
+        # the __new__ method of ParseDevice itself, which would redirect the creation to this subclass, and so on until
+        # the recursion limit was reached!
+        return super(ParseDevice, cls).__new__(cls)
+
+    _dev = 0x0080
+    _devName = 'optimizers'
+    _devType = _devName
+    _legacy = True
+    _batch = True
+    _defn = [
+        # device specific fields
+        #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
+        [4, 'L', "dateTime", "dateTime", False, "Seconds since the epoch"],
+        [2, 'H', 'Uptime', None, True, "Seconds, uptime of optimizer"],
+        [4, 'x', 'Packed_off06', None, False, "Vmod, Vopt and Imod, see _bitfields"],
+        [2, 'H', 'Eday', lambda eday: 0.25 * eday, True, "Wh, energy produced today, in 1/4 Wh"],
+        [1, 'b', 'Temp', lambda temp: 2.0 * temp, True, "degrees C, temperature, in 2 degC (best guess at factor)"],
+    ]
+
+    _bitfields = [
+        # [bitOffset, bitLen, paramName, scale, out (to csv or graphite) True or False, comment]
+        [48, 10, 'Vmod', 0.125, True, "Volts, module voltage, in 1/8 V"],
+        [58, 10, 'Vopt', 0.125, True, "Volts, optimizer voltage, in 1/8 V"],
+        [68, 12, 'Imod', 0.00625, True, "Amps, module current, in 1/160 A"],
+    ]
+
+    _derivn = [
+        # [paramName, paramDefault, out (to csv) True or False, comment]
+        ['Inverter', "0", True, "Not reported, substitute 0"],
+    ]
+
+class ParseDevice_0x0082(ParseDevice):
+    # S440 optimizers
+    #
+    # Byte index (in reverse order):
+    #
+    # 0e 0d 0c 0b 0a 09 08 07 06 05 04 03 02 01 00
+    # ?? ?? ?? ?? ?? Cc cO o# pp Uu uu Dd dd dd dd
+    #  # = oo|Pp
+    #  ?? ?? ?? ?? ?? always contain the same bytes, and are ignored
+    #
+    #  Current (panel), 12 bit (1/160 Amp)
+    #  voltage Output, 10 bit (1/8 v)
+    #  voltage Panel, 10 bit (1/8 v)
+    #  Uptime of optimiser, 16 bit (secs)
+    #  DateTime, 32 bit (secs)
+
+    def __new__(cls, data):
+        # Create a bare minimum instance of a dictionary.
+        # NB This step is essential, because otherwise, when this subclass was instantiated / created, it would call
+        # the __new__ method of ParseDevice itself, which would redirect the creation to this subclass, and so on until
+        # the recursion limit was reached!
+        return super(ParseDevice, cls).__new__(cls)
+
+    _dev = 0x0082
+    _devName = 'optimizers'
+    _devType = _devName
+    _legacy = True
+    _batch = True
+    _defn = [
+        # device specific fields
+        #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
+        [4, 'L', "dateTime", "dateTime", False, "Seconds since the epoch"],
+        [2, 'H', 'Uptime', None, True, "Seconds, uptime of optimizer"],
+        [4, 'x', 'Packed_off06', None, False, "Vmod, Vopt and Imod, see _bitfields"],
+    ]
+
+    _bitfields = [
+        # [bitOffset, bitLen, paramName, scale, out (to csv or graphite) True or False, comment]
+        [48, 10, 'Vmod', 0.125, True, "Volts, module voltage, in 1/8 V"],
+        [58, 10, 'Vopt', 0.125, True, "Volts, optimizer voltage, in 1/8 V"],
+        [68, 12, 'Imod', 0.00625, True, "Amps, module current, in 1/160 A"],
+    ]
+
+    _derivn = [
+        # [paramName, paramDefault, out (to csv) True or False, comment]
+        ['Inverter', "0", True, "Not reported, substitute 0"],
+        ['Eday', "0", True, "Not reported, substitute 0"],
+        ['Temp', "0", True, "Not reported, substitute 0"],
+    ]
+
+class ParseDevice_0x0300(ParseDevice):
+    def __new__(cls, data):
+        # Create a bare minimum instance of a dictionary.
+        # NB This step is essential, because otherwise, when this subclass was instantiated / created, it would call
+        # the __new__ method of ParseDevice itself, which would redirect the creation to this subclass, and so on until
+        # the recursion limit was reached!
+        return super(ParseDevice, cls).__new__(cls)
+
+    _dev = 0x0300
+    _devName = 'events'
+    _devType = _devName
+    _legacy = True
+    _defn = [
+        # device specific fields
+        #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
+        [4, 'L', "dateTime", "dateTime", False, "Seconds since the epoch"],
+        [4, 'L', 'Type', None, True, "0 or 1, wake or sleep"],
+        [4, 'L', 'Event1', None, True, "Event start time"],
+        [4, 'l', 'Event2', None, True, "Event end time when Type=0" + sp + "tzOffset when Type=1"],
+        [4, 'L', 'Event3', None, True, "0 when Type=0" + sp + "Event end time when Type=1"],
+        [8, 'x', 'data5_6', None, False, "Not reported, 0" + sp + "0"],
+    ]
+
+    def codeDerivations(self):
+        # Format whichever of the items are times
+        self['Event1'] = self.formatDateTime(self['Event1'])
+        if self['Type'] == 0:
+            self['Event2'] = self.formatDateTime(self['Event2'])
+        else:
+            self['Event3'] = self.formatDateTime(self['Event3'])
+
 class ParseDevice_0x0030(ParseDevice):
     def __new__(cls, data):
         # Create a bare minimum instance of a dictionary.  ALL subclasses of ParseDevice MUST do this.
@@ -380,6 +886,7 @@ class ParseDevice_0x0030(ParseDevice):
     _dev = 0x0030
     _devName = 'batteries'
     _devType = '{}_{:#06x}'.format(_devName, _dev)
+    _batch = True
     _defn = [
         # device specific fields
         #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
@@ -463,6 +970,7 @@ class ParseDevice_0x0022(ParseDevice):
     _dev = 0x0022
     _devName = 'meters'
     _devType = '{}_{:#06x}'.format(_devName, _dev)
+    _batch = True
     _defn = [
         # device specific fields
         #  [paramLen, paramInFmt, paramName, outFormatFn (can be None), out (to csv or graphite) True or False, comment]
@@ -597,6 +1105,11 @@ class ParseDevice_0x0022(ParseDevice):
         if self['P2X'] < -3 * 10**38:
             self["P2X"] = nan
 
+    @classmethod
+    def batchDerivations(cls, cols):
+        # The same P2X filter as codeDerivations, for a whole batch of blocks.
+        cols['P2X'][cols['P2X'] < -3 * 10**38] = nan
+
     def wrap_in_ids(self):
         """
         "Wrap" the dictionary of parsed data items inside a "dictionary of dictionary" structure (like invDict etc)
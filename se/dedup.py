@@ -0,0 +1,75 @@
+# SolarEdge duplicate device data detection
+
+import os
+import time
+import hashlib
+import binascii
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# size in bytes of the digest of a device data block
+digestSize = 16
+# minimum number of seconds between saves of the window to the state file
+saveInterval = 60
+
+# A window of the most recently seen device data blocks, which is used to drop the blocks that inverters resend in
+# later messages before they are parsed.  Blocks are identified by a digest of their raw data, header included, so
+# a block is only a duplicate if its timestamp and every value in it are the same.  The window holds the digests of
+# the last windowSize distinct blocks, least recently seen first, and is optionally saved to a file so that it
+# survives a restart.
+class BlockWindow(object):
+    def __init__(self, windowSize, stateFileName=None):
+        self.windowSize = windowSize
+        self.stateFileName = stateFileName
+        self.digests = OrderedDict()
+        self.saveTime = time.time()
+        self.changed = False
+        if stateFileName:
+            self.load()
+
+    # return True if the block is in the window, and add it to the window if it isn't
+    def seen(self, block):
+        digest = hashlib.blake2b(block, digest_size=digestSize).digest()
+        if digest in self.digests:
+            self.digests.move_to_end(digest)
+            return True
+        self.digests[digest] = None
+        if len(self.digests) > self.windowSize:
+            self.digests.popitem(last=False)
+        self.changed = True
+        if self.stateFileName and time.time() - self.saveTime >= saveInterval:
+            self.save()
+        return False
+
+    # read the window from the state file, one hex digest per line
+    def load(self):
+        try:
+            with open(self.stateFileName) as stateFile:
+                for line in stateFile:
+                    self.digests[binascii.unhexlify(line.strip())] = None
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as ex:
+            logger.info("Unable to read %s: %s", self.stateFileName, ex)
+            self.digests.clear()
+            return
+        while len(self.digests) > self.windowSize:
+            self.digests.popitem(last=False)
+        logger.info("read %d block digests from %s", len(self.digests), self.stateFileName)
+
+    # write the window to the state file, replacing the previous one in a single step
+    def save(self):
+        self.saveTime = time.time()
+        if not (self.stateFileName and self.changed):
+            return
+        tmpFileName = self.stateFileName + ".tmp"
+        try:
+            with open(tmpFileName, "w") as stateFile:
+                for digest in self.digests:
+                    stateFile.write(binascii.hexlify(digest).decode("ascii") + "\n")
+            os.replace(tmpFileName, self.stateFileName)
+            self.changed = False
+        except OSError as ex:
+            logger.info("Unable to write %s: %s", self.stateFileName, ex)
@@ -0,0 +1,81 @@
+# SolarEdge changed fields only (delta) output
+
+import time
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# device items which are output whenever any other item of the device is, so that it can still be identified
+keyItems = ["Date", "Time", "dateTime", "ID", "seType", "seId", "devLen", "devType"]
+
+# Reduce the parsed device data of each message to the items which have changed since they were last output.
+# The last output value of every item of every device is kept, and an item is only output again when it differs from
+# that value by more than the tolerance (or at all, if it isn't a number).  A device is dropped from the message if none
+# of its items have changed.  Every snapshotInterval seconds, and on the first message after a reset, the complete
+# message is output instead so that consumers which start late, or which lose their state, catch up.
+class DeltaOutput(object):
+    def __init__(self, tolerance=0.0, snapshotInterval=3600):
+        self.tolerance = tolerance
+        self.snapshotInterval = snapshotInterval
+        self.reset()
+
+    # forget the output values, so the next message is output in full
+    def reset(self):
+        self.lastValues = {}
+        self.snapshotTime = None
+
+    # return the message reduced to the changed items
+    def changes(self, devsDict):
+        now = time.time()
+        if self.snapshotTime is None or now - self.snapshotTime >= self.snapshotInterval:
+            logger.info("full snapshot output")
+            self.snapshotTime = now
+            self.remember(devsDict, ())
+            return devsDict
+        return self.changedDevices(devsDict, ())
+
+    # record all the item values of the devices in a message as output
+    def remember(self, devsDict, path):
+        for k, v in devsDict.items():
+            if isDevice(v):
+                self.lastValues.setdefault(path + (k,), {}).update(v)
+            elif isinstance(v, dict):
+                self.remember(v, path + (k,))
+
+    # return the devices in the (nested) dictionary that have changed items, and only those items
+    def changedDevices(self, devsDict, path):
+        delta = {}
+        for k, v in devsDict.items():
+            if isDevice(v):
+                lastValues = self.lastValues.setdefault(path + (k,), {})
+                changedItems = {item: value for item, value in v.items()
+                                if item not in keyItems and
+                                (item not in lastValues or self.changed(lastValues[item], value))}
+                if changedItems:
+                    lastValues.update(changedItems)
+                    changedItems.update({item: v[item] for item in keyItems if item in v})
+                    delta[k] = changedItems
+            elif isinstance(v, dict):
+                devices = self.changedDevices(v, path + (k,))
+                # the top level device dictionaries are always output, even if they are empty
+                if devices or not path:
+                    delta[k] = devices
+            elif not path:
+                delta[k] = v
+        return delta
+
+    # return True if the value has changed from the last value output by more than the tolerance
+    def changed(self, lastValue, value):
+        if isNumber(value) and isNumber(lastValue):
+            if math.isnan(value) or math.isnan(lastValue):
+                return math.isnan(value) != math.isnan(lastValue)
+            return abs(value - lastValue) > self.tolerance
+        return value != lastValue
+
+# a device is a dictionary of items, rather than a dictionary of devices
+def isDevice(v):
+    return isinstance(v, dict) and any(not isinstance(item, dict) for item in v.values())
+
+def isNumber(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
@@ -8,6 +8,8 @@ from collections import namedtuple
 import logging
 import logging.handlers
 import se.logutils
+import se.sinks
+from se.datadevices import ParseDevice
 
 logger = logging.getLogger(__name__)
 
@@ -55,21 +57,58 @@ def getArgs():
             ports.append(int(p))
         return ports
 
+    def validated_windows(windows_str):
+        windows = []
+        for w in windows_str.split(","):
+            if not re.match(r"^[0-9]+$", w) or int(w) == 0:
+                raise argparse.ArgumentTypeError("Invalid rollup window: {}".format(w))
+            windows.append(int(w))
+        return windows
+
+    def validated_devices(devices_str):
+        seTypes = []
+        for d in devices_str.split(","):
+            devTypes = ParseDevice.seTypesFor(d)
+            if devTypes:
+                seTypes.extend(devTypes)
+            elif re.match(r"^(0x)?[0-9a-fA-F]{1,4}$", d):
+                seTypes.append(int(d, 16))
+            else:
+                raise argparse.ArgumentTypeError("Invalid device type: {}".format(d))
+        return seTypes
+
+    def validated_sinks(sinks_str):
+        try:
+            return se.sinks.readConfig(sinks_str)
+        except (IOError, ValueError) as ex:
+            raise argparse.ArgumentTypeError("Invalid sinks file: {}: {}".format(sinks_str, ex))
+
     parser = SeArgumentParser(description='Parse Solaredge data to extract inverter and optimizer telemetry',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("-a", dest="append", action="store_true", default=False, help="append to output file if the file exists")
     parser.add_argument("-b", dest="baudrate", type=int, default=115200, help="baud rate for serial data source")
     parser.add_argument("-c", dest="commands", type=validated_commands, default=[], help="send the specified command functions")
     parser.add_argument("-d", dest="logfile", default="stderr", help="where to write log messages.  either a file name or one of ['stderr', 'syslog']")
+    parser.add_argument("-e", dest="exclude", type=validated_devices, default=[], help="comma delimited list of device types or seTypes not to decode")
     parser.add_argument("-f", dest="follow", action="store_true", default=False, help="wait for appended data as the input file grows (as in tail -f)")
+    parser.add_argument("-g", dest="rollups", type=validated_windows, default=[], help="comma delimited list of window lengths in seconds to also output rollups of the device data for")
+    parser.add_argument("-i", dest="include", type=validated_devices, default=[], help="comma delimited list of device types or seTypes to decode (default: all)")
+    parser.add_argument("-j", dest="sinks", type=validated_sinks, default=[], help="file containing the configuration of the sinks to also write performance data to")
+    parser.add_argument("-l", dest="delta", type=float, help="only output the items that have changed by more than this tolerance")
+    parser.add_argument("-L", dest="snapshot", type=int, default=3600, help="seconds between outputs of all the items when only changed items are output")
     parser.add_argument("-m", dest="master", action="store_true", default=False, help="function as a RS485 master")
+    parser.add_argument("-n", dest="workers", type=int, default=0, help="number of processes to parse the messages in, with separate processes for reading and writing (0=parse them in this process)")
     parser.add_argument("-o", dest="outfile", default="stdout", help="write performance data to the specified file in JSON format (default: stdout)")
     parser.add_argument("-p", dest="ports", type=validated_ports, default=[22222, 22221, 80], help="ports to listen on in network mode")
+    parser.add_argument("-q", dest="queue", type=int, default=0, help="number of received messages that can wait to be parsed and output after they have been replied to (0=parse each message before reading the next)")
+    parser.add_argument("-Q", dest="queuepolicy", choices=["block", "drop-oldest"], default="block", help="what to do with a received message when the -q queue is full")
     parser.add_argument("-r", dest="record", help="file to record all incoming and outgoing messages to")
     parser.add_argument("-s", dest="slaves", type=validated_slaves, default=[], help="comma delimited list of SolarEdge slave inverter IDs")
     parser.add_argument("-t", dest="type", choices=["2","4","n"], help="serial data source type (2=RS232, 4=RS485, n=network)")
     parser.add_argument("-u", dest="updatefile", type=argparse.FileType('w'), help="file to write firmware update to (experimental)")
     parser.add_argument("-v", dest="verbose", action="count", default=0, help="verbose output")
+    parser.add_argument("-w", dest="window", type=int, default=0, help="number of recent device data blocks to remember and skip if they are repeated (0=don't skip)")
+    parser.add_argument("-W", dest="windowfile", help="file to save the recent device data blocks to so they are remembered after a restart")
     parser.add_argument("-x", dest="xerror", action="store_true", default=False, help="halt on data exception")
     parser.add_argument("datasource", default="stdin", nargs='?', help="Input filename or serial port")
 
@@ -156,6 +195,28 @@ def getArgs():
         if len(args.slaves) != 1:
             parser.error("Exactly one slave address must be specified for command mode")
 
+    # duplicate window validation
+    if args.window < 0:
+        parser.error("The duplicate window size cannot be negative")
+    if args.windowfile and not args.window:
+        parser.error("A duplicate window size must be specified with -w to use a window file")
+
+    # delta output validation
+    if args.delta is not None and args.delta < 0:
+        parser.error("The change tolerance cannot be negative")
+
+    # message queue validation
+    if args.queue < 0:
+        parser.error("The message queue size cannot be negative")
+
+    # pipeline validation
+    if args.workers < 0:
+        parser.error("The number of parser processes cannot be negative")
+    if args.workers and not args.queue:
+        parser.error("A message queue size must be specified with -q to use parser processes")
+    if args.workers and args.updatefile:
+        parser.error("A firmware update can't be written when using parser processes")
+
     # print out the arguments and option
     for k,v in sorted(vars(args).items()):
         if k == "commands":
@@ -164,6 +225,12 @@ def getArgs():
             v = ",".join(slave for slave in v)
         if k == "ports":
             v = ",".join(str(port) for port in v)
+        if k == "rollups":
+            v = ",".join(str(window) for window in v)
+        if k == "sinks":
+            v = ",".join(sink.get("name", sink["type"]) for sink in v)
+        if k in ["include", "exclude"]:
+            v = ",".join("{:#06x}".format(seType) for seType in v)
         logger.info("%s: %s", k, v)
 
     return (args, RunMode(serialDevice, networkDevice, args.type, passiveMode, args.master, args.follow))
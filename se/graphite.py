@@ -0,0 +1,36 @@
+# SolarEdge performance data in the graphite plaintext format
+
+import math
+import time
+import logging
+from se.metrics import unwrap_metricsDict
+
+logger = logging.getLogger(__name__)
+
+# the graphite metric lines for a message, <base><device type>.<device id>.<item> <value> <time>
+def metricLines(inDict, base):
+    for baseName, devAttrs in unwrap_metricsDict(inDict):
+        # convert date and time to unix time
+        try:
+            (year, month, day) = devAttrs["Date"].split("-")
+            (hour, minute, second) = devAttrs["Time"].split(":")
+            # Set the dst parameter in mktime to -1, so that the system determines whether dst is in effect!
+            # Without this, when dst is in effect, the timeStamp is 3600 seconds into the future!
+            timeStamp = int(time.mktime((int(year), int(month),
+                                         int(day), int(hour), int(minute),
+                                         int(second), 0, 0, -1)))
+        except (KeyError, AttributeError, ValueError):
+            logger.info("Date or Time is missing or incorrectly formatted for this set of metrics")
+            timeStamp = int(time.mktime((1970, 1, 1, 0, 1, 1, 0, 0, -1)))
+        # Treat every attribute as a metric - except for non-numeric ones!
+        for devAttr, value in devAttrs.items():
+            if devAttr != "Date" and devAttr != "Time" and devAttr != 'Undeciphered_data':
+                try:
+                    # Weed out attributes with non numeric values (graphite does this too, but why clog the network?)
+                    if not math.isfinite(float(value)):
+                        # It's a nan!
+                        continue
+                except (TypeError, ValueError):
+                    # It's not a numeric metric, ignore it
+                    continue
+                yield "{}{}.{} {} {}\n".format(base, baseName, devAttr, value, timeStamp)
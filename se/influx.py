@@ -0,0 +1,352 @@
+# SolarEdge performance data in InfluxDB line protocol
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from math import isnan
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from se.metrics import unwrap_metricsDict
+
+try:
+    import influxdb
+    from influxdb.exceptions import InfluxDBClientError
+    from influxdb.line_protocol import make_line, make_lines
+    from dateutil import tz
+except ImportError:
+    # influxdb is optional, it is only needed to write to InfluxDB
+    influxdb = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeviceParams:
+    mapping: Dict[str, Any]
+    max_series: int
+
+
+@dataclass
+class Device:
+    measurement: str
+    tags: Dict[str, str]
+    series: str
+    allowed: Optional[Set[str]]
+    excluded: Set[str]
+    strings: Set[str]
+
+
+# The measurement and tags that each device type is written with.  The ids that identify
+# a device (eg the inverter serial number, and the meter) are given the names in "tags",
+# in order.  The fields written can be limited to those in "fields", and those in
+# "exclude_fields" are never written.  A type can have its own "max_series", or be
+# skipped altogether with "skip".  Types that aren't here are written with the type as
+# the measurement, and the ids as the tags "serial", "id1", "id2", ...  The mapping of
+# each type in the se2influx.py --device_mapping file, or the mapping of an influx sink,
+# is merged into its mapping here.
+#
+# A field is written with the type of its value: a float, an integer, or a string.
+# InfluxDB rejects a point if the type of a field isn't the one that the field was
+# first written with, so fields whose type changes must be listed in "string_fields",
+# which are always written as strings.  Event2 and Event3 of an event are a date or a
+# number, depending on its Type, and the Inverter of an optimizer is the id of its
+# inverter, or the number 0 for the optimizers that don't report it.
+DEFAULT_MAPPING: Dict[str, Dict[str, Any]] = {
+    "inverters": {"measurement": "inverters", "tags": ["serial"]},
+    "optimizers": {"measurement": "optimizers", "tags": ["serial"], "string_fields": ["Inverter"]},
+    "events": {"measurement": "events", "tags": ["serial"], "string_fields": ["Event2", "Event3"]},
+    "meters_0x0022": {"measurement": "meters", "tags": ["serial", "meter"]},
+    "batteries_0x0030": {"measurement": "batteries", "tags": ["serial", "battery"]},
+}
+
+# Fields that aren't written unless a type has its own "exclude_fields": raw data that
+# hasn't been decoded, and the block header items, which are the same for every point
+DEFAULT_EXCLUDE_FIELDS = ["Undeciphered_data", "seType", "seId", "devType", "devLen", "dateTime"]
+
+
+class DateError(Exception):
+    pass
+
+
+def rejected(e: Exception) -> bool:
+    """
+    Did InfluxDB reject the points of a request, eg because of a field type
+    conflict, a bad line, or too many points, so that they will never be written
+    however many times the request is retried?  Connection errors, 5xx responses,
+    and the other 4xx responses (eg a bad password or a missing database), which
+    don't depend on the points, are worth retrying.
+    """
+
+    return isinstance(e, InfluxDBClientError) and e.code in (400, 413)
+
+
+def get_zone(local_tz: Optional[str]) -> Any:
+    """
+    The timezone that the inverter is set to, given by a timezone string (from
+    /usr/share/zoneinfo/), or the local machine timezone if it is None.  Returns
+    None if the timezone isn't found.
+    """
+
+    return tz.gettz(local_tz) if local_tz is not None else tz.tzlocal()
+
+
+class LineEncoder:
+    """
+    Encode semonitor data straight into InfluxDB line protocol, producing the same
+    lines that influxdb.line_protocol.make_lines does from point dicts, without
+    building them.  Timestamps are integer nanoseconds, NaN fields are skipped
+    while the fields are encoded, and the escaped measurement and tags of each
+    device, the escaped field names, and the timestamps of each date and time
+    are cached, as they repeat in every message.
+
+    Every device type is written, with the measurement, tags and fields given by
+    the device mapping.  To stop an unknown or badly decoded device type from
+    creating an unlimited number of series, only the first max_series devices of
+    each type are written.
+    """
+
+    def __init__(self, local_tz: Any, device_params: DeviceParams) -> None:
+        self.local_tz = local_tz
+        # the mapping of each type is merged into its default mapping
+        self.mapping = {
+            hw_type: {**DEFAULT_MAPPING.get(hw_type, {}), **device_params.mapping.get(hw_type, {})}
+            for hw_type in set(DEFAULT_MAPPING) | set(device_params.mapping)
+        }
+        self.max_series = device_params.max_series
+        self.devices: Dict[str, Optional[Device]] = {}
+        self.series_counts: Dict[str, int] = {}
+        self.field_keys: Dict[str, str] = {}
+        self.timestamps: Dict[Tuple[str, str], str] = {}
+
+    def encode(self, se_data: Dict[str, Any], lines: List[str]) -> None:
+        """
+        Append the line protocol points for the devices in the data to lines
+        """
+
+        for name, hw_data in unwrap_metricsDict(se_data):
+            try:
+                device = self.devices[name]
+            except KeyError:
+                device = self._device(name)
+            if device is None:
+                continue
+            timestamp = self._timestamp(hw_data["Date"], hw_data["Time"])
+
+            fields = []
+            for k in sorted(hw_data):
+                v = hw_data[k]
+                if v is None or k in device.excluded or (
+                    device.allowed is not None and k not in device.allowed
+                ):
+                    continue
+                if k in device.strings:
+                    value = _quote_string(str(v))
+                elif type(v) is float:
+                    # InfluxDB does not like NaN floats, so we filter them out
+                    if v != v:
+                        continue
+                    value = repr(v)
+                elif type(v) is int:
+                    value = f"{v}i"
+                elif type(v) is str:
+                    value = _quote_string(v)
+                else:
+                    value = str(v)
+                try:
+                    key = self.field_keys[k]
+                except KeyError:
+                    key = self.field_keys[k] = _escape(k)
+                if key:
+                    fields.append(f"{key}={value}")
+
+            # a point without fields would make InfluxDB reject the whole batch
+            if fields:
+                lines.append(f"{device.series} {','.join(fields)} {timestamp}")
+
+    def _device(self, name: str) -> Optional["Device"]:
+        """
+        Map a device name from unwrap_metricsDict (eg "meters_0x0022.7F101010.3_Consumption")
+        to its measurement, tags and fields, or None if it isn't to be written
+        """
+
+        hw_type, *ids = name.split(".")
+        mapping = self.mapping.get(hw_type, {})
+        if mapping.get("skip"):
+            device = None
+        else:
+            count = self.series_counts.get(hw_type, 0)
+            if count >= mapping.get("max_series", self.max_series):
+                if count == mapping.get("max_series", self.max_series):
+                    logger.warning(
+                        "Too many %s devices, not writing %s or any more new ones", hw_type, name
+                    )
+                    self.series_counts[hw_type] = count + 1
+                # don't remember the devices that aren't written, there could be any number of them
+                return None
+            self.series_counts[hw_type] = count + 1
+
+            tag_names = mapping.get("tags", ["serial"])
+            tag_names = tag_names + [f"id{i}" for i in range(len(tag_names), len(ids))]
+            tags = dict(zip(tag_names, ids))
+            measurement = mapping.get("measurement", hw_type)
+            allowed = mapping.get("fields")
+            device = Device(
+                measurement,
+                tags,
+                make_line(measurement, tags),
+                set(allowed) if allowed is not None else None,
+                set(mapping.get("exclude_fields", DEFAULT_EXCLUDE_FIELDS)) | {"Date", "Time"},
+                set(mapping.get("string_fields", [])),
+            )
+        self.devices[name] = device
+        return device
+
+    def _timestamp(self, date: str, time: str) -> str:
+        """
+        Convert a semonitor date and time (using a user-specified timezone, if
+        existant, or otherwise our local machine timezone) to a UTC timestamp in
+        nanoseconds
+        """
+
+        try:
+            return self.timestamps[(date, time)]
+        except KeyError:
+            pass
+
+        try:
+            local_time = datetime.strptime(
+                f"{date} {time}", "%Y-%m-%d %H:%M:%S"
+            ).replace(tzinfo=self.local_tz)
+            timestamp = str(int(local_time.timestamp()) * 1000000000)
+        except Exception as e:
+            raise DateError(e) from e
+
+        # a message only has a few different times, so there is no need to remember the old ones
+        if len(self.timestamps) > 1000:
+            self.timestamps.clear()
+        self.timestamps[(date, time)] = timestamp
+        return timestamp
+
+    def encode_points(self, se_data: Dict[str, Any], lines: List[str]) -> None:
+        """
+        The previous encoding, through point dicts and make_lines, which encode is
+        benchmarked against
+        """
+
+        data_out = []
+        try:
+            for name, hw_data in unwrap_metricsDict(se_data):
+                try:
+                    device = self.devices[name]
+                except KeyError:
+                    device = self._device(name)
+                if device is None:
+                    continue
+                # InfluxDB does not like NaN floats, so we filter them out
+                utc_date = self._pop_utc_date(dict(hw_data))
+                hw_data = {
+                    k: str(v) if k in device.strings else v
+                    for k, v in hw_data.items()
+                    if not (isinstance(v, float) and isnan(v))
+                    and k not in device.excluded
+                    and (device.allowed is None or k in device.allowed)
+                }
+                if not hw_data:
+                    continue
+                data_out.append(
+                    {
+                        "measurement": device.measurement,
+                        "tags": device.tags,
+                        "time": utc_date,
+                        "fields": hw_data,
+                    }
+                )
+        finally:
+            if data_out:
+                lines.extend(make_lines({"points": data_out}).splitlines())
+
+    def _pop_utc_date(self, data: Dict[str, Any]) -> str:
+        """
+        Take a semonitor data strict, remove the time and date fields, and then
+        convert them (using a user-specified timezone, if existant, or otherwise
+        our local machine timezone) to a UTC-based string format required by
+        python-influxdb
+        """
+
+        date = data.pop("Date")
+        time = data.pop("Time")
+
+        try:
+            local_time = datetime.strptime(
+                f"{date} {time}", "%Y-%m-%d %H:%M:%S"
+            ).replace(tzinfo=self.local_tz)
+            utc_time = local_time.astimezone(tz.tzutc())
+            return utc_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        except Exception as e:
+            raise DateError(e) from e
+
+
+def _escape(name: str) -> str:
+    """
+    Escape a measurement, tag or field name, or a tag value
+    """
+
+    return (
+        str(name)
+        .replace("\\", "\\\\")
+        .replace(" ", "\\ ")
+        .replace(",", "\\,")
+        .replace("=", "\\=")
+        .replace("\n", "\\n")
+    )
+
+
+def _quote_string(value: str) -> str:
+    """
+    Quote a string field value
+    """
+
+    return '"{}"'.format(
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+def write_lines(
+    db_client: "influxdb.InfluxDBClient", points: List[str]
+) -> List[Tuple[str, "InfluxDBClientError"]]:
+    """
+    Write points to an InfluxDB, and return the points that it rejected, with
+    its errors.  When a request is rejected, its points are split in two and
+    each half is written again, down to single points, so that a bad point or
+    series only drops itself, and not the other devices' points in the batch.
+    Other errors are raised, and the caller may write the points again (InfluxDB
+    handles duplicate data points by overwriting field data, so the halves
+    already written should be fine).
+    """
+
+    try:
+        db_client.write_points(points, protocol="line")
+        return []
+    except Exception as e:
+        if not rejected(e):
+            raise
+        if len(points) == 1:
+            return [(points[0], e)]
+    half = len(points) // 2
+    return write_lines(db_client, points[:half]) + write_lines(db_client, points[half:])
+
+
+def log_rejected(count: int, rejected_points: List[Tuple[str, "InfluxDBClientError"]]) -> None:
+    """
+    Log the points of a batch of count points that InfluxDB rejected, with the
+    server's error and the first of them
+    """
+
+    point, e = rejected_points[0]
+    logger.error(
+        "InfluxDB rejected %s of %s points, dropping them: %s -- first rejected point: %s",
+        len(rejected_points),
+        count,
+        e.content,
+        point,
+    )
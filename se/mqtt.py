@@ -0,0 +1,56 @@
+# SolarEdge performance data published to MQTT topics
+
+import json
+from se.metrics import unwrap_metricsDict
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    # paho-mqtt is optional, it is only needed to publish to MQTT
+    mqtt = None
+
+# The state of each device, by device name (eg "inverters.7F101234"), which is published to its own topic,
+# <topic>/<device type>/<device id>.  The records may only contain the values that have changed (semonitor.py -l), so
+# the values are merged into the state of the device, and the published state still contains all its values.
+class DeviceStates(object):
+    def __init__(self):
+        self.stateDict = {}
+
+    # update the states with a record, and return the topics and payloads of the devices that have changed
+    def update(self, inDict, topic):
+        devNames = []
+        for devName, devAttrs in unwrap_metricsDict(inDict):
+            self.stateDict.setdefault(devName, {}).update(devAttrs)
+            devNames.append(devName)
+        # zero current energy and power when an event occurs
+        if len(inDict.get("events", {})) != 0:
+            for devName, devAttrs in self.stateDict.items():
+                if devName.startswith("inverters."):
+                    devAttrs["Eac"] = 0.0
+                    devAttrs["Pac"] = 0.0
+                    if devName not in devNames:
+                        devNames.append(devName)
+        return [(topic + "/" + devName.replace(".", "/"), json.dumps(self.stateDict[devName])) for devName in devNames]
+
+    # the accumulated state of the inverters and optimizers, in the form published by earlier versions of se2MQTT.py
+    def aggregate(self):
+        aggregateDict = {"inverters": {}, "optimizers": {}}
+        for devName, devAttrs in self.stateDict.items():
+            devType, devId = devName.split(".", 1)
+            if devType in aggregateDict:
+                aggregateDict[devType][devId] = devAttrs
+        return aggregateDict
+
+# A paho client which queues at most maxQueue outgoing messages, and reconnects to the server with a delay of up to
+# maxRetryDelay seconds when the connection is lost.  The caller connects it and starts its network loop.
+def newClient(clientid, user, passwd, maxQueue, maxRetryDelay=60):
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=clientid)
+    except AttributeError:
+        # paho-mqtt versions before 2.0
+        client = mqtt.Client(client_id=clientid)
+    if user:
+        client.username_pw_set(user, passwd)
+    client.max_queued_messages_set(maxQueue)
+    client.reconnect_delay_set(1, maxRetryDelay)
+    return client
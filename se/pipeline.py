@@ -0,0 +1,177 @@
+# SolarEdge multiprocess message pipeline
+
+import time
+import atexit
+import signal
+import collections
+import functools
+import threading
+import multiprocessing
+import logging
+from queue import Full, Empty
+from se.workqueue import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# number of messages per parser process that may be being parsed, or waiting to be output, at once
+IN_FLIGHT = 16
+
+# sentinel which is queued to stop the writer process
+STOP = None
+
+# seconds between checks for the writer process stopping while waiting for the queue
+POLL_INTERVAL = 1
+
+# Parse the messages in a pool of processes, so that on a multi-core machine reading and replying to the messages,
+# parsing them, and writing the output aren't all limited to one core by the GIL.  The process that owns the data
+# source queues each message after it has replied to it.  A writer process takes the messages from the queue, and
+# for each of them, in order:
+#   prepare(item)               returns the item to be parsed, eg without the device data blocks that are skipped
+#   parse(item)                 is called in one of the parser processes, and returns the parsed data
+#   output(item, parsed, error) is called with the parsed data, or the exception raised by prepare or parse
+# The results of the parser processes are output in the order the messages were received, and the time from
+# receiving each message to outputting it is reported.  start and finish are called in the writer process before the
+# first message and after the last one.  The processes are forked, so they start with the state of the process that
+# creates the pipeline, and parse must be a module level function.  When the queue is full the policy determines
+# what happens to a new message, as for se.workqueue.WorkQueue.  If output raises an exception the parser processes
+# are terminated, the rest of the queue is discarded, and the writer process exits, so that put and stop raise an
+# exception.
+class Pipeline(object):
+    def __init__(self, name, workers, size, policy, prepare, parse, output, start=None, finish=None):
+        self.name = name
+        self.policy = policy
+        self.dropped = 0
+        self.stopped = False
+        context = multiprocessing.get_context("fork")
+        self.queue = context.Queue(size)
+        self.process = context.Process(name=name, target=self.run,
+                                       args=(context, workers, prepare, parse, output, start, finish))
+        self.process.start()
+        # the writer process has to be stopped before the program can end
+        atexit.register(self.stop)
+        logger.info("starting %s with %d parser processes", name, workers)
+
+    # queue a message, with the time it was received
+    def put(self, item, receiptTime):
+        if not self.process.is_alive():
+            self.writerStopped()
+        if self.policy == "block":
+            self.wait((item, receiptTime))
+            return
+        while True:
+            try:
+                self.queue.put_nowait((item, receiptTime))
+                return
+            except Full:
+                pass
+            try:
+                self.queue.get_nowait()
+                if not self.dropped:
+                    logger.error("%s queue is full, dropping messages", self.name)
+                self.dropped += 1
+            except Empty:
+                pass
+
+    # queue an item when there is space, unless the writer process has stopped
+    def wait(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except Full:
+                if not self.process.is_alive():
+                    self.writerStopped()
+
+    # the writer process has stopped before it was told to, so it won't be stopped again at exit
+    def writerStopped(self):
+        self.stopped = True
+        self.process.join()
+        # don't wait for the messages that are still queued to be sent to it
+        self.queue.cancel_join_thread()
+        raise RuntimeError("{} has stopped".format(self.name))
+
+    # wait for the queued messages to be output
+    def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        try:
+            self.wait(STOP)
+        except RuntimeError:
+            pass
+        self.process.join()
+        if self.dropped:
+            logger.info("%s: %d messages dropped", self.name, self.dropped)
+        if self.process.exitcode:
+            # don't wait for the messages that are still queued to be sent to it
+            self.queue.cancel_join_thread()
+            raise RuntimeError("{} failed".format(self.name))
+
+    # the writer process
+    def run(self, context, workers, prepare, parse, output, start, finish):
+        # an interrupt from the terminal is handled by the process that owns the data source
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        latency = LatencyStats("output latency")
+        inFlight = threading.Semaphore(workers * IN_FLIGHT)
+        failed = threading.Event()      # output has failed, so stop reading the queue
+        pending = collections.deque()   # the messages in the pool, in order, with the time they were received
+        pool = context.Pool(workers, initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN))
+
+        # the prepared messages, in order, which the pool reads in a thread of its own
+        def prepared():
+            while True:
+                try:
+                    queued = self.queue.get(timeout=POLL_INTERVAL)
+                except Empty:
+                    if failed.is_set():
+                        return
+                    continue
+                if queued is STOP:
+                    return
+                (item, receiptTime) = queued
+                # limit the messages in the pool, which would otherwise read the whole queue
+                while not inFlight.acquire(timeout=POLL_INTERVAL):
+                    if failed.is_set():
+                        return
+                if failed.is_set():
+                    return
+                try:
+                    preparedItem = prepare(item)
+                    error = None
+                except Exception as ex:
+                    preparedItem = None
+                    error = ex
+                pending.append((item, receiptTime, error))
+                yield preparedItem
+
+        if start:
+            start()
+        try:
+            for (parsed, parseError) in pool.imap(functools.partial(parseItem, parse), prepared()):
+                inFlight.release()
+                (item, receiptTime, error) = pending.popleft()
+                output(item, parsed, error or parseError)
+                latency.add(time.time() - receiptTime)
+        except BaseException:
+            # the pool can't be closed while it is waiting for the next message, so stop reading the queue and
+            # terminate it, and let the exception end the process with a nonzero exit code
+            failed.set()
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+            pool.join()
+        finally:
+            latency.report()
+            if finish:
+                finish()
+
+# parse a prepared message in a parser process, returning the exception rather than raising it
+def parseItem(parse, preparedItem):
+    if preparedItem is None:
+        return (None, None)
+    try:
+        return (parse(preparedItem), None)
+    except Exception as ex:
+        # not every exception can be pickled
+        return (None, RuntimeError("{}: {}".format(type(ex).__name__, ex)))
@@ -0,0 +1,162 @@
+# SolarEdge protocol library interface
+#
+# Read and parse SolarEdge messages from a recording, a socket, or a serial device within a program, without running
+# semonitor.py and reading its JSON output.  All the configuration is passed as parameters, and none of the module
+# variables that semonitor.py sets are used, so any number of sources may be read at the same time.  For example:
+#
+#   import se.reader
+#   for record in se.reader.readRecords("yyyymmdd.dat", exclude=["events"]):
+#       for seId, inverter in record["inverters"].items():
+#           print(seId, inverter["Date"], inverter["Time"], inverter["Pac"])
+#
+# readRecords returns the performance data of each message in the same form as the semonitor.py output, and
+# readMessages returns every message, with its header and parsed data.  Messages which fail validation are logged
+# and skipped.  Nothing is sent to the data source, so a network or RS232 connection must be served by semonitor.py.
+
+import time
+import struct
+import socket
+import logging
+from collections import namedtuple
+import se.msg
+import se.data
+import se.dedup
+import se.commands
+from se.datadevices import ParseDevice
+
+logger = logging.getLogger(__name__)
+
+# reader parameters
+CHUNK_SIZE = 65536      # maximum number of bytes read from the data source at a time
+FOLLOW_INTERVAL = .1    # seconds between checks for more data when following a file
+
+# a message that has been read and parsed
+Message = namedtuple("Message", ("seq",       # message sequence number
+                                 "fromAddr",  # address of the sender
+                                 "toAddr",    # address of the recipient
+                                 "function",  # function code, eg se.commands.PROT_CMD_SERVER_POST_DATA
+                                 "data",      # parsed message data
+                                 ))
+
+# return the performance data of each message from the data source, see readMessages for the parameters
+def readRecords(dataSource, **params):
+    for msg in readMessages(dataSource, **params):
+        # messages which only contain skipped blocks aren't returned
+        if msg.function == se.commands.PROT_CMD_SERVER_POST_DATA and any(msg.data.values()):
+            yield msg.data
+
+# return each message from the data source, parsed
+#   dataSource  a file name, or an open binary file, socket, or serial device
+#   passive     the messages are found by searching for the magic number that starts each of them, as for
+#               recordings and RS485, rather than from the length in their header, as for network and RS232 data
+#   follow      wait for data to be appended to a file when its end is reached (as in tail -f)
+#   include     device types or seTypes to decode (default: all)
+#   exclude     device types or seTypes not to decode
+#   window      number of recent device data blocks to remember and skip if they are repeated, or a
+#               se.dedup.BlockWindow (default: don't skip)
+#   strict      raise the exception when the data of a message can't be parsed, rather than skipping the message
+def readMessages(dataSource, passive=True, follow=False, include=None, exclude=None, window=0, strict=False):
+    if isinstance(dataSource, str):
+        with open(dataSource, "rb") as dataFile:
+            for msg in readMessages(dataFile, passive, follow, include, exclude, window, strict):
+                yield msg
+        return
+    includeTypes = seTypes(include) if include else None
+    excludeTypes = seTypes(exclude) if exclude else frozenset()
+    blockWindow = se.dedup.BlockWindow(window) if isinstance(window, int) and window else window or None
+    if isinstance(dataSource, socket.socket):
+        dataSource = dataSource.makefile("rb")
+    for frame in readFrames(dataSource, passive, follow):
+        if frame == bytes(len(frame)):  # ignore messages containing all zeros
+            continue
+        (msgSeq, fromAddr, toAddr, function, data) = se.msg.parseMsg(frame)
+        if function == 0:
+            # message could not be processed
+            continue
+        try:
+            if function == se.commands.PROT_CMD_SERVER_POST_DATA:
+                msgData = se.data.decodeDeviceData(data, includeTypes, excludeTypes, blockWindow)
+            else:
+                msgData = se.data.parseData(function, data)
+        except Exception as ex:
+            logger.info("Failed to parse message: "+str(ex))
+            if strict:
+                raise
+            continue
+        yield Message(msgSeq, fromAddr, toAddr, function, msgData)
+
+# return each message from an open data source, without the magic number
+def readFrames(dataFile, passive=True, follow=False):
+    magic = se.msg.magic
+    magicLen = se.msg.magicLen
+    buf = bytearray()
+    searchPtr = 0
+    started = not passive
+    for chunk in readChunks(dataFile, follow):
+        buf += chunk
+        while True:
+            msgPtr = buf.find(magic, searchPtr)
+            if msgPtr < 0:
+                # the start of a magic number may be at the end of the buffer
+                searchPtr = max(0, len(buf) - magicLen + 1)
+                if not (passive and started):
+                    # the data isn't part of a message
+                    del buf[:searchPtr]
+                    searchPtr = 0
+                break
+            if passive:
+                # a message is everything up to the next magic number, and data before the first one is skipped
+                if started:
+                    yield bytes(buf[:msgPtr])
+                started = True
+                del buf[:msgPtr + magicLen]
+            else:
+                # the length of a message is in its header
+                if len(buf) < msgPtr + magicLen + se.msg.msgHdrLen:
+                    searchPtr = msgPtr
+                    break
+                dataLen = struct.unpack_from("<H", buf, msgPtr + magicLen)[0]
+                msgEnd = msgPtr + magicLen + se.msg.msgHdrLen + dataLen + se.msg.checksumLen
+                if len(buf) < msgEnd:
+                    searchPtr = msgPtr
+                    break
+                yield bytes(buf[msgPtr + magicLen:msgEnd])
+                del buf[:msgEnd]
+            searchPtr = 0
+    if passive and started and buf:
+        # the last message ends at the end of the data
+        yield bytes(buf)
+
+# return the data from an open data source as it becomes available
+def readChunks(dataFile, follow=False):
+    if hasattr(dataFile, "in_waiting"):
+        # serial device, don't wait for more than is available
+        read = lambda: dataFile.read(max(1, dataFile.in_waiting))
+    elif hasattr(dataFile, "read1"):
+        # buffered file or socket, don't wait for a complete chunk
+        read = lambda: dataFile.read1(CHUNK_SIZE)
+    else:
+        read = lambda: dataFile.read(CHUNK_SIZE)
+    while True:
+        try:
+            chunk = read()
+        # treat exceptions as end of file
+        except (IOError, OSError) as ex:
+            logger.info("Exception while reading data: "+str(ex))
+            return
+        if not chunk:
+            if not follow:
+                return
+            time.sleep(FOLLOW_INTERVAL)
+            continue
+        yield chunk
+
+# the seTypes of a list of device types or seTypes
+def seTypes(devs):
+    types = set()
+    for dev in devs:
+        if isinstance(dev, int):
+            types.add(dev)
+        else:
+            types.update(ParseDevice.seTypesFor(dev) or [int(dev, 16)])
+    return frozenset(types)
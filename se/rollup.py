@@ -0,0 +1,194 @@
+# SolarEdge telemetry rollups
+
+import time
+import math
+import logging
+from array import array
+from se.delta import keyItems, isDevice, isNumber
+
+logger = logging.getLogger(__name__)
+
+# items which are energy counters, rolled up as the energy produced during the window rather than as a mean
+energyItems = ["Eday", "Etot"]
+# energy counters which start again from 0 each day
+dailyItems = ["Eday"]
+
+# accumulator for each numeric item of a device, stored consecutively in an array of doubles
+COUNT, MIN, MAX, SUM, LAST, DELTA = range(6)
+accLen = 6
+emptyAcc = [0.0, math.inf, -math.inf, 0.0, math.nan, 0.0]
+
+# Aggregate the numeric items of every device into fixed time windows (eg 1 min, 15 min, 1 hour), aligned to the epoch.
+# When a device reports in a later window, the rollup of its previous window is returned as a record of its own,
+# named after the device type and the window length, eg {"optimizers_900s": {"100F7A1B": {...}}}.
+# Each rolled up item is reported as <item>_min, <item>_max, <item>_mean and <item>_last, except energy counters which
+# are reported as <item>_last and <item>_delta, the energy produced during the window.  Only the accumulators for the
+# current window of each device are kept, so memory doesn't grow with the number of reports.  Inverters resend stored
+# data when they have been unable to send it, so a report which is older than the current window of a device is
+# ignored for that window, and one which is older than the last report of the device is not used for the last values
+# or the energy produced.
+class Rollups(object):
+    def __init__(self, windows):
+        self.windows = windows
+        self.devices = {}
+        self.timeStamps = {}
+
+    # add the devices in a parsed message, and return a list of the rollup records for the windows that are complete
+    def add(self, devsDict):
+        records = {}
+        for path, device in devices(devsDict, ()):
+            timeStamp = self.timeStamp(device)
+            if timeStamp is None:
+                continue
+            try:
+                deviceRollup = self.devices[path]
+            except KeyError:
+                deviceRollup = self.devices[path] = DeviceRollup(self.windows)
+            for window, rollup in deviceRollup.add(timeStamp, device):
+                addRecord(records, path, window, rollup)
+        return [{name: record} for name, record in records.items()]
+
+    # return a list of the rollup records of the incomplete windows
+    def flush(self):
+        records = {}
+        for path, deviceRollup in self.devices.items():
+            for window, rollup in deviceRollup.flush():
+                addRecord(records, path, window, rollup)
+        return [{name: record} for name, record in records.items()]
+
+    # the time of a device report in seconds since the epoch
+    def timeStamp(self, device):
+        if isNumber(device.get("dateTime")):
+            return device["dateTime"]
+        dateTime = (device.get("Date"), device.get("Time"))
+        try:
+            return self.timeStamps[dateTime]
+        except KeyError:
+            pass
+        try:
+            timeStamp = int(time.mktime(time.strptime(" ".join(dateTime), "%Y-%m-%d %H:%M:%S")))
+        except (TypeError, ValueError) as ex:
+            logger.info("Invalid time stamp: %s %s", dateTime, ex)
+            return None
+        if len(self.timeStamps) > 1000:
+            # a message only has a few different times, so there is no need to remember the old ones
+            self.timeStamps.clear()
+        self.timeStamps[dateTime] = timeStamp
+        return timeStamp
+
+# the rollups of one device for each of the windows
+class DeviceRollup(object):
+    def __init__(self, windows):
+        self.items = {}                   # accumulator index of each numeric item
+        self.lastValues = array('d')      # last value of each item, for the energy produced since the last report
+        self.lastTime = None              # time of the last report
+        self.windows = [[window, None, 0, array('d')] for window in windows]  # window, start, reports, accumulators
+
+    # add a device report, and return the rollups of any windows that it completes
+    def add(self, timeStamp, device):
+        lastTime = self.lastTime
+        late = lastTime is not None and timeStamp < lastTime
+        if not late:
+            self.lastTime = timeStamp
+        values = []
+        for item, value in device.items():
+            if item in keyItems or not isNumber(value):
+                continue
+            try:
+                i = self.items[item]
+            except KeyError:
+                i = self.items[item] = len(self.lastValues)
+                self.lastValues.append(math.nan)
+                for window in self.windows:
+                    window[3].extend(emptyAcc)
+            if math.isnan(value):
+                continue
+            delta = 0.0
+            if not late:
+                lastValue = self.lastValues[i]
+                self.lastValues[i] = value
+                if item in energyItems and not math.isnan(lastValue):
+                    if value >= lastValue:
+                        delta = value - lastValue
+                    elif item in dailyItems and localDay(timeStamp) != localDay(lastTime):
+                        # the counter has been reset at midnight
+                        delta = value
+            values.append((i * accLen, value, delta))
+
+        rollups = []
+        for window in self.windows:
+            (length, start, reports, acc) = window
+            windowStart = timeStamp - timeStamp % length
+            if start is not None and windowStart < start:
+                # the window has already been output
+                continue
+            if windowStart != start:
+                if reports:
+                    rollups.append((length, self.rollup(window)))
+                acc[:] = array('d', emptyAcc * len(self.items))
+                window[1] = windowStart
+                window[2] = 0
+            window[2] += 1
+            for (j, value, delta) in values:
+                acc[j + COUNT] += 1
+                if value < acc[j + MIN]:
+                    acc[j + MIN] = value
+                if value > acc[j + MAX]:
+                    acc[j + MAX] = value
+                acc[j + SUM] += value
+                if not late:
+                    acc[j + LAST] = value
+                acc[j + DELTA] += delta
+        return rollups
+
+    # return the rollups of the windows that have any reports, and start them again
+    def flush(self):
+        rollups = []
+        for window in self.windows:
+            if window[2]:
+                rollups.append((window[0], self.rollup(window)))
+                window[1] = None
+                window[2] = 0
+        return rollups
+
+    # the items of a rollup record for a window
+    def rollup(self, window):
+        (length, start, reports, acc) = window
+        rollup = {
+            "Date": time.strftime("%Y-%m-%d", time.localtime(start)),
+            "Time": time.strftime("%H:%M:%S", time.localtime(start)),
+            "dateTime": start,
+            "count": reports,
+        }
+        for item, i in self.items.items():
+            j = i * accLen
+            if not acc[j + COUNT]:
+                continue
+            rollup[item + "_last"] = acc[j + LAST]
+            if item in energyItems:
+                rollup[item + "_delta"] = acc[j + DELTA]
+            else:
+                rollup[item + "_min"] = acc[j + MIN]
+                rollup[item + "_max"] = acc[j + MAX]
+                rollup[item + "_mean"] = acc[j + SUM] / acc[j + COUNT]
+        return rollup
+
+# the local date of a time in seconds since the epoch
+def localDay(timeStamp):
+    return time.localtime(timeStamp)[:3]
+
+# the devices in a parsed message, with the path of keys to each of them
+def devices(devsDict, path):
+    for k, v in devsDict.items():
+        if isDevice(v):
+            yield (path + (k,), v)
+        elif isinstance(v, dict):
+            for device in devices(v, path + (k,)):
+                yield device
+
+# add a rollup to the record for its device type and window
+def addRecord(records, path, window, rollup):
+    record = records.setdefault("{}_{}s".format(path[0], window), {})
+    for k in path[1:-1]:
+        record = record.setdefault(k, {})
+    record[path[-1]] = rollup
@@ -0,0 +1,74 @@
+# SolarEdge message sequence numbers
+
+import os
+import threading
+import logging
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# largest sequence number, after which the sequence starts again at 1
+maxSeq = 65535
+# number of sequence numbers that are reserved in the file at a time
+reserveSize = 100
+
+# Allocate the sequence numbers of the messages that are sent to the inverters.  The numbers are allocated in memory
+# from a block which is reserved by writing the last number in it to the sequence file, so the file is only read and
+# written once per reserveSize messages, and a restart continues after the last number that may have been used.  The
+# file is replaced in a single step, and a new block is always reserved after the one in the file, under a lock, so
+# processes sharing the file don't allocate the same numbers.  The file contains a single decimal number, as it
+# did when it was rewritten for every message.
+class SeqAllocator(object):
+    def __init__(self, seqFileName):
+        self.seqFileName = seqFileName
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.remaining = 0
+
+    # return the next sequence number
+    def next(self):
+        with self.lock:
+            if not self.remaining:
+                self.seq = self.reserve()
+                self.remaining = reserveSize
+            self.seq = self.seq % maxSeq + 1
+            self.remaining -= 1
+            return self.seq
+
+    # reserve the block after the one in the file, and return the number before it
+    def reserve(self):
+        lockFile = None
+        try:
+            if fcntl:
+                lockFile = open(self.seqFileName + ".lock", "w")
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+            seq = self.read()
+            self.write((seq + reserveSize - 1) % maxSeq + 1)
+            return seq
+        finally:
+            if lockFile:
+                lockFile.close()
+
+    # the last sequence number in the file
+    def read(self):
+        try:
+            with open(self.seqFileName) as seqFile:
+                return int(seqFile.read().rstrip("\n")) % (maxSeq + 1)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as ex:
+            logger.info("Unable to read %s: %s", self.seqFileName, ex)
+            return 0
+
+    # write the sequence file, replacing the previous one in a single step
+    def write(self, seq):
+        tmpFileName = self.seqFileName + ".tmp"
+        try:
+            with open(tmpFileName, "w") as seqFile:
+                seqFile.write(str(seq) + "\n")
+            os.replace(tmpFileName, self.seqFileName)
+        except OSError as ex:
+            logger.info("Unable to write %s: %s", self.seqFileName, ex)
@@ -0,0 +1,492 @@
+# SolarEdge performance data output sinks
+
+import csv
+import json
+import time
+import socket
+import threading
+import logging
+from queue import Queue, Full, Empty
+from se.rollup import devices
+from se.spool import SegmentSpool
+from se.graphite import metricLines
+import se.state
+import se.influx
+import se.mqtt
+
+logger = logging.getLogger(__name__)
+
+# sink parameters
+QUEUE_SIZE = 1000           # records waiting to be written by a sink
+BATCH_SIZE = 100            # records written by a sink at a time
+SPOOL_SIZE = 100000000      # maximum size of the records in a spool, after which the oldest are dropped
+SPOOL_SEGMENT_SIZE = 1000000    # size of each spool file, which is removed once it has been written to the sink
+SPOOL_READ_SIZE = 1000000   # maximum size of the records read from a spool at a time
+IDLE_TIMEOUT = 1.0          # seconds a sink waits for a record before doing its idle work
+RETRY_DELAY = 1.0           # seconds before the first retry of a failed write
+MAX_RETRY_DELAY = 60.0      # maximum seconds between retries of a failed write
+MAX_RETRIES = 5             # failed attempts to write a batch before it is dropped, unless it can be spooled
+CLOSE_TIMEOUT = 10.0        # seconds a sink has to write its queued records when the program terminates
+
+# what a sink does with a record when its queue is full
+POLICIES = ["block", "drop-oldest", "spool"]
+
+# sentinel which is queued to stop a sink
+STOP = object()
+
+# Output the records of performance data to a number of sinks, eg a JSON file, a CSV file, and an InfluxDB database,
+# in place of a shell pipeline of conversion programs that each parse the JSON output again.  Each sink has its own
+# bounded queue, which is drained by its own thread, so a sink that is slow or whose server is down doesn't hold up
+# the others.  When the queue of a sink is full, its policy determines what happens to a new record:
+#   block        wait for the sink to make space in its queue, which holds up reading the data source
+#   drop-oldest  discard the oldest record in the queue
+#   spool        append the record to a spool, which is written to the sink when it catches up
+# A write that fails is retried with an increasing delay.  A sink with the spool policy keeps trying, while the new
+# records go to the spool, and spools the records it hasn't written when it is stopped, the other sinks drop them
+# after MAX_RETRIES attempts.  The records are shared by all the sinks, so a sink must not change them.
+class Sinks(object):
+    def __init__(self, configs):
+        self.sinks = [openSink(config) for config in configs]
+
+    # queue a record for every sink
+    def put(self, record):
+        for sink in self.sinks:
+            sink.put(record)
+
+    # wait for the sinks to write the records that are queued, and close them
+    def close(self):
+        for sink in self.sinks:
+            sink.stop()
+        for sink in self.sinks:
+            sink.close()
+
+# The base class of the sinks, which queues the records and writes them in batches from its thread.  Subclasses
+# implement writeRecords, and optionally idle, which is called when no records have arrived for IDLE_TIMEOUT seconds,
+# and closeSink.
+class Sink(object):
+    def __init__(self, name, queue=QUEUE_SIZE, policy="drop-oldest", batch=BATCH_SIZE, spool=None,
+                 spoolsize=SPOOL_SIZE):
+        if policy not in POLICIES:
+            raise ValueError("Invalid policy for {} sink: {}".format(name, policy))
+        if policy == "spool" and not spool:
+            raise ValueError("A spool directory must be specified for the {} sink".format(name))
+        self.name = name
+        self.policy = policy
+        self.batchSize = batch
+        self.queue = Queue(queue)
+        self.retryTime = 0
+        self.retryDelay = RETRY_DELAY
+        self.stopping = threading.Event()
+        self.stopTime = None
+        self.held = []                      # records that couldn't be written when the sink was stopped
+        self.written = self.dropped = self.spooled = self.errors = 0
+        self.spool = None
+        self.spooling = False
+        if policy == "spool":
+            self.spool = SegmentSpool(spool, spoolsize, SPOOL_SEGMENT_SIZE, ".json")
+            self.spoolLock = threading.Lock()   # held while the records are switched to or from the spool
+            self.spoolQueue = Queue(queue)      # records waiting to be appended to the spool
+            self.spoolBacklog = 0               # records that have been queued, but not appended, to the spool
+            # records are going to the spool
+            self.spooling = self.spool.pending()
+            self.spoolThread = threading.Thread(name=name + " spool", target=self.runSpool)
+            self.spoolThread.daemon = True
+            self.spoolThread.start()
+        self.thread = threading.Thread(name=name + " sink", target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("starting %s sink", name)
+
+    # queue a record, as the policy of the sink allows
+    def put(self, record):
+        if self.spooling and self.spoolRecord(record):
+            # keep the records in order until the spool has been written
+            return
+        if self.policy == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except Full:
+                pass
+            if self.policy == "spool" and self.spoolRecord(record, True):
+                return
+            try:
+                self.queue.get_nowait()
+                self.drop(1)
+            except Empty:
+                pass
+
+    # queue a record to be appended to the spool by the spool thread, so the caller doesn't wait for the file
+    def spoolRecord(self, record, start=False):
+        with self.spoolLock:
+            if not (self.spooling or start):
+                # the spool has been written in the meantime
+                return False
+            try:
+                self.spoolQueue.put_nowait(record)
+            except Full:
+                self.drop(1)
+                return True
+            self.spoolBacklog += 1
+            self.spooling = True
+            return True
+
+    def drop(self, count):
+        if self.dropped // 1000 != (self.dropped + count) // 1000 or not self.dropped:
+            logger.error("%s sink is dropping records, %d dropped", self.name, self.dropped + count)
+        self.dropped += count
+
+    # write the records that are queued, in batches
+    def run(self):
+        while True:
+            try:
+                records = [self.queue.get(timeout=IDLE_TIMEOUT)]
+            except Empty:
+                self.doIdle()
+                continue
+            while len(records) < self.batchSize:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            stop = records[-1] is STOP
+            if stop:
+                records.pop()
+            if records:
+                self.write(records)
+            if stop:
+                if self.held:
+                    # they are older than the records in the spool
+                    self.spool.prepend(encodeRecords(self.held))
+                    self.spooled += len(self.held)
+                    self.held = []
+                self.doIdle()
+                return
+
+    # append the records that are queued for the spool to it, in batches
+    def runSpool(self):
+        while True:
+            records = [self.spoolQueue.get()]
+            while len(records) < self.batchSize:
+                try:
+                    records.append(self.spoolQueue.get_nowait())
+                except Empty:
+                    break
+            stop = records[-1] is STOP
+            if stop:
+                records.pop()
+            if records:
+                if self.spool.append(encodeRecords(records)):
+                    self.spooled += len(records)
+                else:
+                    self.drop(len(records))
+                with self.spoolLock:
+                    self.spoolBacklog -= len(records)
+            if stop:
+                return
+
+    def doIdle(self):
+        if self.spooling and time.time() >= self.retryTime:
+            self.replaySpool()
+        try:
+            self.idle()
+        except Exception as ex:
+            logger.error("%s sink error: %s", self.name, str(ex))
+
+    # write a batch of records, retrying if it fails
+    def write(self, records):
+        if self.held:
+            # the sink has been stopped, and the records can't be written before the ones that failed
+            self.held += records
+            return False
+        attempts = 0
+        while True:
+            wait = self.retryTime - time.time()
+            if wait > 0:
+                self.stopping.wait(wait)
+            try:
+                self.writeRecords(records)
+                self.written += len(records)
+                self.retryDelay = RETRY_DELAY
+                return True
+            except Exception as ex:
+                attempts += 1
+                self.errors += 1
+                logger.error("%s sink error: %s", self.name, str(ex))
+                self.retryTime = time.time() + self.retryDelay
+                self.retryDelay = min(self.retryDelay * 2, MAX_RETRY_DELAY)
+            if self.policy == "spool":
+                # keep trying until the sink is stopped, the new records are spooled when the queue is full
+                if self.stopping.is_set():
+                    self.held = records
+                    return False
+                continue
+            if attempts >= MAX_RETRIES or self.stopping.is_set():
+                self.drop(len(records))
+                return False
+
+    # write the records in the spool, once the queue has been written, committing them as they are written
+    def replaySpool(self):
+        logger.info("%s sink writing spooled records", self.name)
+        while True:
+            if self.stopping.is_set() and time.time() >= self.stopTime + CLOSE_TIMEOUT / 2:
+                # the rest are written after a restart
+                return
+            (lines, size, position) = self.spool.read(self.batchSize, SPOOL_READ_SIZE)
+            if not lines:
+                break
+            records = [json.loads(line) for line in lines]
+            try:
+                self.writeRecords(records)
+                self.written += len(records)
+            except Exception as ex:
+                self.errors += 1
+                logger.error("%s sink error: %s", self.name, str(ex))
+                self.retryTime = time.time() + self.retryDelay
+                self.retryDelay = min(self.retryDelay * 2, MAX_RETRY_DELAY)
+                return
+            self.spool.commit(position)
+            self.retryDelay = RETRY_DELAY
+        with self.spoolLock:
+            if not (self.spoolBacklog or self.spool.pending()):
+                self.spooling = False
+
+    # stop taking records, the queued records are still written
+    def stop(self):
+        self.stopTime = time.time()
+        self.stopping.set()
+        try:
+            self.queue.put(STOP, timeout=CLOSE_TIMEOUT)
+        except Full:
+            pass
+        if self.spool:
+            self.spoolQueue.put(STOP)
+
+    def close(self):
+        self.thread.join(max(0, self.stopTime + CLOSE_TIMEOUT - time.time()))
+        if self.spool:
+            self.spoolThread.join(max(0, self.stopTime + CLOSE_TIMEOUT - time.time()))
+        if self.thread.is_alive():
+            logger.error("%s sink didn't finish writing its records", self.name)
+        else:
+            try:
+                self.closeSink()
+            except Exception as ex:
+                logger.error("%s sink error: %s", self.name, str(ex))
+        if self.spool:
+            self.spool.close()
+        logger.info("%s sink: %d records written, %d dropped, %d spooled, %d errors", self.name,
+                    self.written, self.dropped, self.spooled, self.errors)
+
+    def writeRecords(self, records):
+        raise NotImplementedError
+
+    def idle(self):
+        pass
+
+    def closeSink(self):
+        pass
+
+# the records in the format they are spooled in
+def encodeRecords(records):
+    return [json.dumps(record, sort_keys=True) for record in records]
+
+# Write the records to a file in JSON format, in the same form as the semonitor.py output file
+class JsonSink(Sink):
+    def __init__(self, file, append=False, name="json", **params):
+        self.outFile = open(file, "ab" if append else "wb")
+        Sink.__init__(self, name, **params)
+
+    def writeRecords(self, records):
+        self.outFile.write(b"".join(json.dumps(record, sort_keys=True).encode("latin-1") + b"\n"
+                                    for record in records))
+        self.outFile.flush()
+
+    def closeSink(self):
+        self.outFile.close()
+
+# Write the items of each type of device to a separate CSV file, as se2csv.py does, named <prefix>.<device type>.csv
+class CsvSink(Sink):
+    def __init__(self, prefix, append=False, delimiter=",", headers=False, name="csv", **params):
+        self.prefix = prefix
+        self.append = append
+        self.delimiter = delimiter
+        self.headers = headers
+        self.files = {}
+        Sink.__init__(self, name, **params)
+
+    def writeRecords(self, records):
+        for record in records:
+            for path, device in devices(record, ()):
+                devName = deviceName(path)
+                devType, devId = devName.split(".", 1) if "." in devName else (devName, "")
+                try:
+                    (csvFile, writer) = self.files[devType]
+                except KeyError:
+                    csvFile = open("{}.{}.csv".format(self.prefix, devType), "a" if self.append else "w", newline="")
+                    writer = csv.DictWriter(csvFile, ["__Identifier__"] + sorted(device.keys()),
+                                            delimiter=self.delimiter, extrasaction="ignore")
+                    if self.headers:
+                        writer.writeheader()
+                    self.files[devType] = (csvFile, writer)
+                row = dict(device)
+                row["__Identifier__"] = devId
+                writer.writerow(row)
+        for (csvFile, writer) in self.files.values():
+            csvFile.flush()
+
+    def closeSink(self):
+        for (csvFile, writer) in self.files.values():
+            csvFile.close()
+
+# Maintain a file containing the current state and statistics of the inverters and optimizers, as se2state.py does.
+# The file is replaced, rather than rewritten, no more often than every interval seconds, and the stats can also be
+# written to a binary file.
+class StateSink(Sink):
+    def __init__(self, file, interval=5.0, binfile=None, name="state", **params):
+        self.state = se.state.State(se.state.readState(file))
+        self.writer = se.state.StateWriter(file, interval, binfile)
+        Sink.__init__(self, name, **params)
+
+    def writeRecords(self, records):
+        with self.writer.lock:
+            for record in records:
+                self.state.update(record)
+            self.writer.update(self.state.stateDict)
+
+    def closeSink(self):
+        self.writer.close()
+
+# Write every device type to an InfluxDB database, with the same measurements, tags and fields as se2influx.py, which
+# are given by the mapping parameter in the form of its --device_mapping file, and the same limit on the number of
+# devices of each type.  The points that the database rejects, eg because of a field type conflict, are dropped.
+class InfluxSink(Sink):
+    def __init__(self, database, host="localhost", port=8086, user="root", password="root", ssl=False, mapping=None,
+                 maxseries=1000, timezone=None, name="influx", **params):
+        if se.influx.influxdb is None:
+            raise ValueError("The influxdb module is needed for the {} sink".format(name))
+        zone = se.influx.get_zone(timezone)
+        if zone is None:
+            raise ValueError("Time-zone not found for the {} sink: {}".format(name, timezone))
+        self.encoder = se.influx.LineEncoder(zone, se.influx.DeviceParams(mapping or {}, maxseries))
+        self.client = se.influx.influxdb.InfluxDBClient(host=host, port=port, username=user, password=password,
+                                                        database=database, ssl=ssl)
+        Sink.__init__(self, name, **params)
+
+    def writeRecords(self, records):
+        lines = []
+        for record in records:
+            try:
+                self.encoder.encode(record, lines)
+            except (KeyError, AttributeError, se.influx.DateError) as ex:
+                logger.error("%s sink can't encode a record: %s", self.name, str(ex))
+        if lines:
+            rejected = se.influx.write_lines(self.client, lines)
+            if rejected:
+                se.influx.log_rejected(len(lines), rejected)
+
+    def closeSink(self):
+        self.client.close()
+
+# Write the numeric items of every device to a graphite server in its plaintext format, as se2graphite.py does, as
+# <prefix>.<device type>.<device id>.<item> <value> <time>.  The connection is reopened if a write fails.
+class GraphiteSink(Sink):
+    def __init__(self, host="localhost", port=2003, prefix="solaredge", name="graphite", **params):
+        self.host = host
+        self.port = port
+        self.base = prefix + "." if prefix else ""
+        self.socket = None
+        Sink.__init__(self, name, **params)
+
+    def writeRecords(self, records):
+        lines = [line for record in records for line in metricLines(record, self.base)]
+        if not lines:
+            return
+        if not self.socket:
+            self.socket = socket.create_connection((self.host, self.port), timeout=30)
+        try:
+            self.socket.sendall("".join(lines).encode("ascii", "replace"))
+        except OSError:
+            self.closeSink()
+            raise
+
+    def closeSink(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+# Publish the state of each device to its own MQTT topic, <topic>/<device type>/<device id>, as se2MQTT.py does.
+# The paho network loop keeps the connection open, and its queue holds the messages while it is reconnecting.
+class MqttSink(Sink):
+    def __init__(self, host="localhost", port=1883, topic="solaredge", clientid="", user=None, password=None, qos=0,
+                 retain=False, name="mqtt", **params):
+        if se.mqtt.mqtt is None:
+            raise ValueError("The paho-mqtt module is needed for the {} sink".format(name))
+        self.topic = topic
+        self.qos = qos
+        self.retain = retain
+        self.states = se.mqtt.DeviceStates()
+        self.lastMsg = None
+        self.client = se.mqtt.newClient(clientid, user, password, params.get("queue", QUEUE_SIZE), int(MAX_RETRY_DELAY))
+        self.client.connect_async(host, port)
+        self.client.loop_start()
+        Sink.__init__(self, name, **params)
+
+    def writeRecords(self, records):
+        for record in records:
+            for (devTopic, payload) in self.states.update(record, self.topic):
+                msg = self.client.publish(devTopic, payload, self.qos, self.retain)
+                if msg.rc == se.mqtt.mqtt.MQTT_ERR_QUEUE_SIZE:
+                    self.drop(1)
+                elif msg.rc == se.mqtt.mqtt.MQTT_ERR_SUCCESS:
+                    self.lastMsg = msg
+
+    # wait for the queued messages to be sent, then disconnect
+    def closeSink(self):
+        if self.lastMsg and self.client.is_connected():
+            self.lastMsg.wait_for_publish(CLOSE_TIMEOUT)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+# the sink classes, by the type used in the configuration file
+sinkTypes = {
+    "json": JsonSink,
+    "csv": CsvSink,
+    "state": StateSink,
+    "influx": InfluxSink,
+    "graphite": GraphiteSink,
+    "mqtt": MqttSink,
+}
+
+# read a sinks configuration file, which is a JSON list of the parameters of each sink, eg
+#   [{"type": "json", "file": "performance.json"},
+#    {"type": "influx", "database": "solaredge", "policy": "spool", "spool": "influx.spool"}]
+def readConfig(fileName):
+    with open(fileName) as configFile:
+        configs = json.load(configFile)
+    if isinstance(configs, dict):
+        configs = configs.get("sinks", [])
+    if not isinstance(configs, list):
+        raise ValueError("The sinks configuration must be a list")
+    for config in configs:
+        if not isinstance(config, dict) or config.get("type") not in sinkTypes:
+            raise ValueError("Invalid sink type: {}".format(config.get("type") if isinstance(config, dict) else config))
+        if config.get("policy", "drop-oldest") not in POLICIES:
+            raise ValueError("Invalid sink policy: {}".format(config["policy"]))
+    return configs
+
+# create a sink from its configuration
+def openSink(config):
+    params = dict(config)
+    sinkClass = sinkTypes[params.pop("type")]
+    try:
+        return sinkClass(**params)
+    except TypeError as ex:
+        raise ValueError("Invalid {} sink parameters: {}".format(config["type"], str(ex)))
+
+# the name of a device from its path, eg inverters.7F101234
+def deviceName(path):
+    return ".".join(str(k).replace("\x00", "").replace(" ", "_") for k in path)
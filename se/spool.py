@@ -0,0 +1,230 @@
+# SolarEdge disk spool of data points or records
+
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentSpool:
+    """
+    A disk spool of points, one per line (eg InfluxDB line protocol points, or
+    records in JSON format), kept as numbered segment files in a directory.
+    Points are appended to the newest segment, and read back in order from the
+    oldest, starting at the offset recorded in the offset file.  The offset
+    file is replaced atomically once the points read have been written, so that
+    after a crash nothing is lost, although the last batch may be written twice
+    (InfluxDB handles duplicate data points by overwriting field data, so this
+    should be fine).  A new segment is started on each start-up, so a line left
+    incomplete by a crash is never appended to, and is skipped when it is read.
+    When the spool grows beyond its maximum size the oldest segments are dropped.
+    """
+
+    OFFSET_FILE = "offset"
+
+    def __init__(self, path: str, max_bytes: int, segment_bytes: int, suffix: str = ".lp") -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.suffix = suffix
+        self.lock = threading.Lock()
+
+        self.points_spooled = 0
+        self.bytes_dropped = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.sizes: Dict[int, int] = {}
+        for name in os.listdir(path):
+            root, ext = os.path.splitext(name)
+            if ext == suffix and root.isdigit():
+                self.sizes[int(root)] = os.path.getsize(os.path.join(path, name))
+
+        self.read_segment, self.read_offset = min(self.sizes, default=0), 0
+        try:
+            with open(os.path.join(path, self.OFFSET_FILE)) as f:
+                segment, offset = (int(n) for n in f.read().split())
+            if segment in self.sizes:
+                self.read_segment, self.read_offset = segment, offset
+        except (OSError, ValueError):
+            pass
+        self.read_fh = None
+
+        self.write_segment = max(self.sizes, default=-1) + 1
+        self.sizes[self.write_segment] = 0
+        self.write_fh = open(self._segment_path(self.write_segment), "ab")
+        self.total_bytes = sum(self.sizes.values()) - self.read_offset
+        if self.total_bytes:
+            logger.info("%s bytes of spooled points in %s", self.total_bytes, path)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"{segment:012d}{self.suffix}")
+
+    def pending(self) -> bool:
+        """
+        Are there points in the spool waiting to be written to the DB?
+        """
+
+        with self.lock:
+            return (
+                self.read_segment != self.write_segment
+                or self.read_offset < self.sizes[self.write_segment]
+            )
+
+    def append(self, points: List[str]) -> bool:
+        """
+        Append points to the spool, and return whether they could be written
+        """
+
+        data = ("\n".join(points) + "\n").encode("utf-8")
+        with self.lock:
+            try:
+                self.write_fh.write(data)
+                self.write_fh.flush()
+            except OSError as e:
+                logger.error("Error writing to spool %s: %s", self.path, e)
+                return False
+            self.sizes[self.write_segment] += len(data)
+            self.total_bytes += len(data)
+            self.points_spooled += len(points)
+
+            if self.sizes[self.write_segment] >= self.segment_bytes:
+                self.write_fh.close()
+                self.write_segment += 1
+                self.sizes[self.write_segment] = 0
+                self.write_fh = open(self._segment_path(self.write_segment), "ab")
+
+            while self.total_bytes > self.max_bytes and self.read_segment != self.write_segment:
+                logger.warning(
+                    "Spool %s full, dropping %s bytes of points",
+                    self.path,
+                    self.sizes[self.read_segment] - self.read_offset,
+                )
+                self.bytes_dropped += self.sizes[self.read_segment] - self.read_offset
+                self._next_segment()
+            return True
+
+    def prepend(self, points: List[str]) -> None:
+        """
+        Put points in front of the ones that haven't been read, eg the points of
+        a batch that couldn't be written when the program is stopping.  This is
+        the only time a segment is rewritten: the segment being read is replaced
+        by the points followed by its unread part.
+        """
+
+        data = ("\n".join(points) + "\n").encode("utf-8")
+        with self.lock:
+            if self.read_segment == self.write_segment:
+                # start a new segment for the points appended after these
+                self.write_fh.close()
+                self.write_segment += 1
+                self.sizes[self.write_segment] = 0
+                self.write_fh = open(self._segment_path(self.write_segment), "ab")
+            if self.read_fh is not None:
+                self.read_fh.close()
+                self.read_fh = None
+            segment_path = self._segment_path(self.read_segment)
+            try:
+                with open(segment_path + ".tmp", "wb") as f:
+                    f.write(data)
+                    with open(segment_path, "rb") as segment_fh:
+                        segment_fh.seek(self.read_offset)
+                        shutil.copyfileobj(segment_fh, f)
+                    size = f.tell()
+                # if the program stops in between, the points that have been read are written again
+                self.read_offset = 0
+                self._save_offset()
+                os.replace(segment_path + ".tmp", segment_path)
+            except OSError as e:
+                logger.error("Error writing to spool %s: %s", self.path, e)
+                return
+            self.total_bytes += len(data)
+            self.sizes[self.read_segment] = size
+            self.points_spooled += len(points)
+
+    def read(self, max_points: int, max_bytes: int) -> Tuple[List[str], int, Tuple[int, int]]:
+        """
+        Read a batch of points from the spool, without removing them.  Returns
+        the points, their size, and the position to commit once they have been
+        written.
+        """
+
+        with self.lock:
+            while True:
+                if self.read_fh is None:
+                    self.read_fh = open(self._segment_path(self.read_segment), "rb")
+                self.read_fh.seek(self.read_offset)
+                points = []
+                size = 0
+                while len(points) < max_points and size < max_bytes:
+                    point = self.read_fh.readline()
+                    if not point.endswith(b"\n"):
+                        break
+                    points.append(point[:-1].decode("utf-8"))
+                    size += len(point)
+                if points or self.read_segment == self.write_segment:
+                    return points, size, (self.read_segment, self.read_offset + size)
+                # the rest of an old segment is empty or an incomplete line
+                self._next_segment()
+
+    def commit(self, position: Tuple[int, int]) -> None:
+        """
+        Remove the points up to a position returned by read from the spool
+        """
+
+        with self.lock:
+            segment, offset = position
+            if segment != self.read_segment:
+                # the segment has been dropped in the meantime
+                return
+            self.total_bytes -= offset - self.read_offset
+            self.read_offset = offset
+            if self.read_segment != self.write_segment and offset >= self.sizes[segment]:
+                self._next_segment()
+            self._save_offset()
+
+    def _next_segment(self) -> None:
+        """
+        Drop the segment being read and move on to the next one, the lock must be held
+        """
+
+        if self.read_fh is not None:
+            self.read_fh.close()
+            self.read_fh = None
+        self.total_bytes -= self.sizes[self.read_segment] - self.read_offset
+        del self.sizes[self.read_segment]
+        try:
+            os.remove(self._segment_path(self.read_segment))
+        except OSError as e:
+            logger.error("Error removing spool segment: %s", e)
+        self.read_segment = min(self.sizes)
+        self.read_offset = 0
+        self._save_offset()
+
+    def _save_offset(self) -> None:
+        """
+        Replace the offset file in a single step, the lock must be held
+        """
+
+        offset_path = os.path.join(self.path, self.OFFSET_FILE)
+        try:
+            with open(offset_path + ".tmp", "w") as f:
+                f.write(f"{self.read_segment} {self.read_offset}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(offset_path + ".tmp", offset_path)
+        except OSError as e:
+            logger.error("Error saving spool offset: %s", e)
+
+    def close(self) -> None:
+        """
+        Close the segment files
+        """
+
+        with self.lock:
+            for fh in (self.read_fh, self.write_fh):
+                if fh is not None:
+                    fh.close()
+            self.read_fh = None
@@ -0,0 +1,187 @@
+# SolarEdge current state and statistics of the inverters and optimizers
+
+import os
+import json
+import math
+import mmap
+import struct
+import threading
+import time
+
+# the attributes of each type of device that the statistics are computed from
+statAttrs = {"inverters": ["Vac", "Pac", "Eac", "Eday", "Etot", "Temp"],
+             "optimizers": ["Temp"]}
+
+# return the sum of the specified attribute of the items in the specified dictionary
+# ignore the stats item
+def sumItems(itemDict, itemAttr):
+    itemSum = 0
+    for item in itemDict.keys():
+        if item != "stats":
+            itemSum += itemDict[item].get(itemAttr, 0.0)
+    return itemSum
+
+# The current state of each inverter and optimizer, by device type and id, and the "stats" item of each type,
+# which are updated from records of performance data.  The records may only contain the values that have changed
+# (semonitor.py -l).  Running sums of the attributes the stats are computed from are kept, and the number of devices
+# of each type, excluding the stats item, so the stats aren't recomputed from every device for each record.
+class State(object):
+    def __init__(self, stateDict):
+        self.stateDict = stateDict
+        self.sums = {}
+        self.counts = {}
+        # start the running sums from the devices in the state
+        for devType, attrs in statAttrs.items():
+            devices = stateDict.setdefault(devType, {})
+            devices.setdefault("stats", {attr: 0.0 for attr in attrs})
+            self.counts[devType] = len(devices) - 1
+            self.sums[devType] = {attr: sumItems(devices, attr) for attr in attrs}
+
+    # update the state with a record
+    def update(self, inDict):
+        stateDict = self.stateDict
+        sums = self.sums
+        for devId, devAttrs in inDict.get("inverters", {}).items():
+            self.updateDevice("inverters", devId, devAttrs)
+        for devId, devAttrs in inDict.get("optimizers", {}).items():
+            optimizer = self.updateDevice("optimizers", devId, devAttrs)
+            # compute optimizer power
+            optimizer["Pdc"] = optimizer.get("Vmod", 0.0) * optimizer.get("Imod", 0.0)
+        # compute the stats
+        stateDict["inverters"]["stats"]["Vac"] = self.avgItems("inverters", "Vac")
+        stateDict["inverters"]["stats"]["Pac"] = sums["inverters"]["Pac"]
+        stateDict["inverters"]["stats"]["Eac"] = sums["inverters"]["Eac"]
+        Eday = sums["inverters"]["Eday"]
+        # only update Eday if it increases
+        if Eday > stateDict["inverters"]["stats"]["Eday"]:
+            stateDict["inverters"]["stats"]["Eday"] = Eday
+        stateDict["inverters"]["stats"]["Etot"] = sums["inverters"]["Etot"]
+        stateDict["inverters"]["stats"]["Temp"] = self.avgItems("inverters", "Temp")
+        stateDict["optimizers"]["stats"]["Temp"] = self.avgItems("optimizers", "Temp")
+        # zero current energy and power for devices when an event occurs
+        # this touches every device, but events only occur when the inverters wake up or go to sleep
+        if len(inDict.get("events", {})) != 0:
+            for inverter in stateDict["inverters"].keys():
+                stateDict["inverters"][inverter]["Eac"] = 0.0
+                stateDict["inverters"][inverter]["Pac"] = 0.0
+            for optimizer in stateDict["optimizers"].keys():
+                stateDict["optimizers"][optimizer]["Vmod"] = 0.0
+                stateDict["optimizers"][optimizer]["Vopt"] = 0.0
+                stateDict["optimizers"][optimizer]["Imod"] = 0.0
+                stateDict["optimizers"][optimizer]["Pdc"] = 0.0
+            sums["inverters"]["Eac"] = 0.0
+            sums["inverters"]["Pac"] = 0.0
+
+    # update the attributes of a device in the state, and the running sums of its type
+    def updateDevice(self, devType, devId, devAttrs):
+        devices = self.stateDict[devType]
+        sums = self.sums[devType]
+        try:
+            device = devices[devId]
+        except KeyError:
+            device = devices[devId] = {}
+            self.counts[devType] += 1
+        changed = [attr for attr in statAttrs[devType] if attr in devAttrs]
+        for attr in changed:
+            sums[attr] += devAttrs[attr] - device.get(attr, 0.0)
+        device.update(devAttrs)
+        for attr in changed:
+            if math.isnan(sums[attr]):
+                # a nan can't be subtracted out again, so sum the devices again, which is only a nan until it has gone
+                sums[attr] = sumItems(devices, attr)
+        return device
+
+    # return the average of the specified attribute of the devices of the specified type
+    def avgItems(self, devType, itemAttr):
+        try:
+            return self.sums[devType][itemAttr]/self.counts[devType]
+        except ZeroDivisionError:
+            return 0
+
+# return the state in a state file, or an empty state if there isn't one
+def readState(fileName):
+    try:
+        with open(fileName) as stateFile:
+            return json.load(stateFile)
+    except (IOError, ValueError):
+        return {}
+
+# layout of the binary state file:
+#   magic "SEST", layout version, sequence number (odd while the file is being updated), time of the update,
+#   then the inverter stats Vac, Pac, Eac, Eday, Etot, Temp and the optimizer stats Temp
+binMagic = b"SEST"
+binVersion = 1
+binHeader = struct.Struct("<4sHHL")
+binValues = struct.Struct("<d" + "d" * 7)
+binStats = [("inverters", attr) for attr in statAttrs["inverters"]] + \
+           [("optimizers", attr) for attr in statAttrs["optimizers"]]
+
+# Write the state file, but no more often than every minInterval seconds.  Updates in between are coalesced and
+# written when the interval has passed.  The state is written to a temporary file which then replaces the state file,
+# so readers never see a partial file, and it isn't written at all if it hasn't changed.  Optionally the stats are also
+# written to a memory mapped binary file with a fixed layout, which can be polled cheaply.  A reader must read the
+# sequence number before and after the values, and read them again if it was odd or has changed.
+class StateWriter(object):
+    def __init__(self, outFileName, minInterval, binFileName=None):
+        self.outFileName = outFileName
+        self.minInterval = minInterval
+        self.lock = threading.Lock()    # held while the state is being updated or written
+        self.stateDict = None
+        self.stateJson = None
+        self.writeTime = 0
+        self.timer = None
+        self.binMap = None
+        if binFileName:
+            with open(binFileName, "a+b") as binFile:
+                binFile.truncate(binHeader.size + binValues.size)
+                self.binMap = mmap.mmap(binFile.fileno(), binHeader.size + binValues.size)
+            self.sequence = 0
+            binHeader.pack_into(self.binMap, 0, binMagic, binVersion, 0, self.sequence)
+
+    # the state has been updated, write it now if the interval has passed or schedule it for when it has
+    # the lock must be held
+    def update(self, stateDict):
+        self.stateDict = stateDict
+        wait = self.writeTime + self.minInterval - time.time()
+        if wait <= 0:
+            self.write()
+        elif not self.timer:
+            self.timer = threading.Timer(wait, self.timedWrite)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def timedWrite(self):
+        with self.lock:
+            self.timer = None
+            self.write()
+
+    # write any update that is waiting for the interval to pass
+    def close(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+                self.write()
+
+    def write(self):
+        self.writeTime = time.time()
+        stateJson = json.dumps(self.stateDict)
+        if stateJson == self.stateJson:
+            return
+        tmpFileName = self.outFileName + ".tmp"
+        with open(tmpFileName, "w") as outFile:
+            outFile.write(stateJson)
+            outFile.flush()
+            os.fsync(outFile.fileno())
+        os.replace(tmpFileName, self.outFileName)
+        self.stateJson = stateJson
+        if self.binMap:
+            self.writeBin()
+
+    def writeBin(self):
+        values = [self.stateDict[devType]["stats"].get(attr, float("nan")) for devType, attr in binStats]
+        self.sequence += 1
+        binHeader.pack_into(self.binMap, 0, binMagic, binVersion, 0, self.sequence)
+        binValues.pack_into(self.binMap, binHeader.size, self.writeTime, *values)
+        self.sequence += 1
+        binHeader.pack_into(self.binMap, 0, binMagic, binVersion, 0, self.sequence)
@@ -0,0 +1,122 @@
+# SolarEdge message processing queue
+
+import time
+import threading
+import logging
+from queue import Queue, Full, Empty
+
+logger = logging.getLogger(__name__)
+
+# what the reader does with a message when the queue is full
+POLICIES = ["block", "drop-oldest"]
+
+# sentinel which is queued to stop the worker
+STOP = object()
+
+# A bounded queue of the messages that have been received and replied to, which a worker thread parses and outputs, so
+# a slow consumer of the output doesn't delay the replies to the inverter.  When the queue is full the policy
+# determines what happens to a new message:
+#   block        wait for the worker to make space in the queue, which delays reading (and replying to) the next message
+#   drop-oldest  discard the oldest message in the queue
+# Each item is a function and its arguments, which the worker calls in the order they were queued.  If a function raises
+# an exception the worker stops, and the exception is raised by the next put or by stop.
+class WorkQueue(object):
+    def __init__(self, name, size, policy="block"):
+        self.name = name
+        self.policy = policy
+        self.queue = Queue(size)
+        self.highWater = 0
+        self.dropped = 0
+        self.error = None
+        self.thread = threading.Thread(name=name, target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("starting %s", name)
+
+    # queue a function call for the worker
+    def put(self, function, *args):
+        item = (function, args)
+        if self.error:
+            raise self.error
+        if self.policy == "block":
+            self.wait(item)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except Full:
+                    pass
+                try:
+                    self.queue.get_nowait()
+                    if not self.dropped:
+                        logger.error("%s queue is full, dropping messages", self.name)
+                    self.dropped += 1
+                except Empty:
+                    pass
+        self.highWater = max(self.highWater, self.queue.qsize())
+
+    # queue an item when there is space, unless the worker has stopped
+    def wait(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except Full:
+                if self.error:
+                    raise self.error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is STOP:
+                return
+            (function, args) = item
+            try:
+                function(*args)
+            except Exception as ex:
+                self.error = ex
+                return
+
+    # wait for the queued function calls to be made
+    def stop(self):
+        if self.thread.is_alive() and not self.error:
+            self.wait(STOP)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+# Statistics of the time from receiving a message to sending the reply to it, which are logged every reportInterval
+# seconds, and when the program terminates.
+class LatencyStats(object):
+    def __init__(self, name, reportInterval=300):
+        self.name = name
+        self.reportInterval = reportInterval
+        self.lock = threading.Lock()
+        self.reportTime = time.time()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+    # add the latency of a reply, in seconds
+    def add(self, latency):
+        with self.lock:
+            self.count += 1
+            self.total += latency
+            self.max = max(self.max, latency)
+            if latency > .1:
+                self.slow += 1
+        if time.time() >= self.reportTime + self.reportInterval:
+            self.report()
+
+    def report(self):
+        with self.lock:
+            self.reportTime = time.time()
+            if self.count:
+                logger.info("%s: %d messages, mean %.2f ms, max %.2f ms, %d over 100 ms", self.name, self.count,
+                            self.total / self.count * 1000, self.max * 1000, self.slow)
+            self.reset()
@@ -6,11 +6,19 @@ import time
 import threading
 import sys
 import struct
+import functools
 import se.env
 import se.logutils
 import se.files
 import se.msg
 import se.data
+import se.dedup
+import se.delta
+import se.rollup
+import se.sinks
+import se.workqueue
+import se.pipeline
+import se.seq
 import se.commands
 import logging
 from builtins import bytes
@@ -20,16 +28,26 @@ logger = logging.getLogger(__name__)
 # action parameters
 COMMAND_DELAY = 2
 READ_THREAD_NAME = "read thread"
+WORK_THREAD_NAME = "work thread"
+PIPELINE_PROCESS_NAME = "writer process"
 MASTER_THREAD_NAME = "master thread"
 MASTER_MSG_INTERVAL = 5
 MASTER_MSG_TIMEOUT = 10
 MASTER_ADDR = 0xfffffffe
 SEQ_FILE_NAME = "seseq.txt"
 UPDATE_SIZE = 0x80000
+RECONNECT = None  # queued in place of a message function to output everything again after a reconnect
 
 # global variables
 threadLock = threading.Lock()  # lock to synchronize reads and writes
 masterEvent = threading.Event()  # event to signal RS485 master release
+deltaOutput = None  # changed items only output, if it is enabled
+rollups = None  # rollups of the device data, if they are enabled
+sinks = None  # sinks that performance data is also written to, if they are configured
+workQueue = None  # queue of messages to parse and output after they have been replied to, if it is enabled
+pipeline = None  # processes which parse and output the messages after they have been replied to, if it is enabled
+ackLatency = se.workqueue.LatencyStats("reply latency")  # time from receiving a message to replying to it
+seqAllocator = se.seq.SeqAllocator(SEQ_FILE_NAME)  # sequence numbers of the messages that are sent
 
 # program termination
 def terminate(code=0, msg=b""):
@@ -48,69 +66,168 @@ def readData(args, mode, state, dataFile, recFile, outFile):
         (msg, eof) = se.msg.readMsg(dataFile, recFile, mode, state)
     while not eof:
         (msg, eof) = se.msg.readMsg(dataFile, recFile, mode, state)
+        receiptTime = time.time()
         if eof:  # end of file
             logger.info("End of file")
             # eof from network means connection was broken, wait for a reconnect and continue
             if mode.networkDevice:
                 se.files.closeData(dataFile, True)
                 dataFile = se.files.openDataSocket(args.ports)
+                if deltaOutput:
+                    # output everything again after a reconnect
+                    doWork(RECONNECT, b"", args, outFile, updateBuf, receiptTime)
                 eof = False
         if msg == b"\x00" * len(msg):  # ignore messages containing all zeros
             logger.data(msg)
+            continue
+        with threadLock:
+            se.logutils.setState(state, "threadLock", True)
+            try:
+                # validate the message and reply to it straight away
+                (msgSeq, fromAddr, toAddr, function, data) = se.msg.parseMsg(msg)
+                if function and (mode.networkDevice or mode.masterMode):
+                    replyMsg(msgSeq, fromAddr, toAddr, function, state, dataFile, recFile, receiptTime)
+            except Exception as ex:
+                logger.info("Failed to parse message: "+str(ex))
+                for l in se.logutils.format_data(msg):
+                    logger.data(l)
+                if args.xerror:
+                    raise
+                (function, data) = (0, msg)
+            se.logutils.setState(state, "threadLock", False)
+        if function == 0:
+            # message could not be processed
+            logger.data("Ignoring this message")
+            for l in se.logutils.format_data(data):
+                logger.data(l)
         else:
-            with threadLock:
-                se.logutils.setState(state, "threadLock", True)
-                try:
-                    processMsg(msg, args, mode, state, dataFile, recFile, outFile, updateBuf)
-                except Exception as ex:
-                    logger.info("Failed to parse message: "+str(ex))
-                    for l in se.logutils.format_data(msg):
-                        logger.data(l)
-                    if args.xerror:
-                        raise
-                se.logutils.setState(state, "threadLock", False)
+            doWork(function, data, args, outFile, updateBuf, receiptTime)
     # all finished
+    if pipeline:
+        pipeline.stop()
+    if workQueue:
+        workQueue.stop()
     if args.updatefile:  # write the firmware update file
         writeUpdate(updateBuf, args.updatefile)
     return
 
-# process a received message
-def processMsg(msg, args, mode, state, dataFile, recFile, outFile, updateBuf):
-    # parse the message
-    (msgSeq, fromAddr, toAddr, function, data) = se.msg.parseMsg(msg)
-    if function == 0:
-        # message could not be processed
-        logger.data("Ignoring this message")
-        for l in se.logutils.format_data(data):
-            logger.data(l)
+# parse and output a message in the pipeline or the work thread, or now if there are neither
+def doWork(function, data, args, outFile, updateBuf, receiptTime):
+    if pipeline:
+        pipeline.put((function, data), receiptTime)
+    elif workQueue:
+        workQueue.put(processMsg, function, data, args, outFile, updateBuf)
     else:
-        msgData = se.data.parseData(function, data)
-        if function == se.commands.PROT_CMD_SERVER_POST_DATA and data:  # performance data
-            # write performance data to output file
-            se.data.writeData(msgData, outFile)
-        elif updateBuf and function == se.commands.PROT_CMD_UPGRADE_WRITE:  # firmware update data
-            updateBuf[msgData["offset"]:msgData["offset"] + msgData["length"]] = msgData["data"]
-        if mode.networkDevice or mode.masterMode:  # send reply
-            replyFunction = b""
-            if function == se.commands.PROT_CMD_SERVER_POST_DATA:  # performance data
-                # send ack
-                replyFunction = se.commands.PROT_RESP_ACK
-                replyData = b""
-            elif function == 0x0503:  # encryption key
-                # send ack
-                replyFunction = se.commands.PROT_RESP_ACK
-                replyData = b""
-            elif function == se.commands.PROT_CMD_SERVER_GET_GMT:  # time request
-                # set time
-                replyFunction = se.commands.PROT_RESP_SERVER_GMT
-                replyData = se.data.formatTime(int(time.time()),
-                    (time.localtime().tm_hour - time.gmtime().tm_hour) * 60 * 60)
-            elif function == se.commands.PROT_RESP_POLESTAR_MASTER_GRANT_ACK:  # RS485 master release
-                masterEvent.set()
-                se.logutils.setState(state, "masterEvent", masterEvent.is_set())
-            if replyFunction:
-                msg = se.msg.formatMsg(msgSeq, toAddr, fromAddr, replyFunction, replyData)
-                se.msg.sendMsg(dataFile, msg, recFile)
+        processMsg(function, data, args, outFile, updateBuf)
+
+# reply to a received message
+def replyMsg(msgSeq, fromAddr, toAddr, function, state, dataFile, recFile, receiptTime):
+    replyFunction = b""
+    if function == se.commands.PROT_CMD_SERVER_POST_DATA:  # performance data
+        # send ack
+        replyFunction = se.commands.PROT_RESP_ACK
+        replyData = b""
+    elif function == 0x0503:  # encryption key
+        # send ack
+        replyFunction = se.commands.PROT_RESP_ACK
+        replyData = b""
+    elif function == se.commands.PROT_CMD_SERVER_GET_GMT:  # time request
+        # set time
+        replyFunction = se.commands.PROT_RESP_SERVER_GMT
+        replyData = se.data.formatTime(int(time.time()),
+            (time.localtime().tm_hour - time.gmtime().tm_hour) * 60 * 60)
+    elif function == se.commands.PROT_RESP_POLESTAR_MASTER_GRANT_ACK:  # RS485 master release
+        masterEvent.set()
+        se.logutils.setState(state, "masterEvent", masterEvent.is_set())
+    if replyFunction:
+        msg = se.msg.formatMsg(msgSeq, toAddr, fromAddr, replyFunction, replyData)
+        se.msg.sendMsg(dataFile, msg, recFile)
+        ackLatency.add(time.time() - receiptTime)
+
+# parse and output the data of a received message
+def processMsg(function, data, args, outFile, updateBuf):
+    if function == RECONNECT:
+        deltaOutput.reset()
+        return
+    try:
+        outputMsg(function, data, se.data.parseData(function, data), outFile, updateBuf)
+    except Exception as ex:
+        parseFailed(ex, data, args)
+
+# output the parsed data of a message
+def outputMsg(function, data, msgData, outFile, updateBuf):
+    if function == se.commands.PROT_CMD_SERVER_POST_DATA and data:  # performance data
+        rollupData = rollups.add(msgData) if rollups else []
+        if deltaOutput:
+            msgData = deltaOutput.changes(msgData)
+        # write performance data to output file, unless every device was skipped
+        if any(msgData.values()):
+            writeRecord(msgData, outFile)
+        # followed by the rollups of any windows which have been completed
+        for rollup in rollupData:
+            writeRecord(rollup, outFile)
+    elif updateBuf and function == se.commands.PROT_CMD_UPGRADE_WRITE:  # firmware update data
+        updateBuf[msgData["offset"]:msgData["offset"] + msgData["length"]] = msgData["data"]
+
+# log a message that couldn't be parsed, and stop if -x was specified
+def parseFailed(ex, data, args):
+    logger.info("Failed to parse message: "+str(ex))
+    for l in se.logutils.format_data(data):
+        logger.data(l)
+    if args.xerror:
+        raise ex
+
+# skip the device data blocks that aren't wanted in a message for the pipeline, which must be done in order
+def prepareMsg(item):
+    (function, data) = item
+    if function == se.commands.PROT_CMD_SERVER_POST_DATA:
+        return (function, se.data.filterDeviceData(data))
+    return item
+
+# parse a message in a pipeline parser process
+def parseMsgData(item):
+    (function, data) = item
+    if function == RECONNECT:
+        return None
+    if function == se.commands.PROT_CMD_SERVER_POST_DATA:
+        # the blocks have already been filtered
+        return se.data.decodeDeviceData(data)
+    return se.data.parseData(function, data)
+
+# output a message that has been parsed by the pipeline
+def pipelineOutput(args, outFile, item, msgData, error):
+    (function, data) = item
+    if error:
+        parseFailed(error, data, args)
+    elif function == RECONNECT:
+        deltaOutput.reset()
+    else:
+        outputMsg(function, data, msgData, outFile, [])
+
+# open the sinks
+def openSinks(args):
+    global sinks
+    if args.sinks:
+        try:
+            sinks = se.sinks.Sinks(args.sinks)
+        except (IOError, ValueError) as ex:
+            terminate(1, str(ex))
+
+# output the rollups of the windows that are still incomplete, and close the sinks
+def closeOutput(outFile):
+    if rollups:
+        for rollup in rollups.flush():
+            writeRecord(rollup, outFile)
+    if sinks:
+        sinks.close()
+    if se.data.blockWindow is not None:
+        se.data.blockWindow.save()
+
+# write performance data to the output file and the sinks
+def writeRecord(record, outFile):
+    se.data.writeData(record, outFile)
+    if sinks:
+        sinks.put(record)
 
 # write firmware image to file
 def writeUpdate(updateBuf, updateFileName):
@@ -134,7 +251,7 @@ def masterGrant(state, dataFile, recFile, slaveAddr):
         se.logutils.setState(state, "threadLock", True)
         # grant control of the bus to the slave
         se.msg.sendMsg(dataFile,
-                    se.msg.formatMsg(nextSeq(), MASTER_ADDR, int(slaveAddr, 16),
+                    se.msg.formatMsg(seqAllocator.next(), MASTER_ADDR, int(slaveAddr, 16),
                           se.commands.PROT_CMD_POLESTAR_MASTER_GRANT), recFile)
         se.logutils.setState(state, "threadLock", False)
 
@@ -164,7 +281,7 @@ def doCommands(args, mode, state, dataFile, recFile, outFile):
         function = int(command[0], 16)
         format = "<" + "".join(c[0] for c in command[1:])
         params = [int(p[1:], 16) for p in command[1:]]
-        seq = nextSeq()
+        seq = seqAllocator.next()
         # send the command
         se.msg.sendMsg(dataFile,
                 se.msg.formatMsg(seq, MASTER_ADDR, int(args.slaves[0], 16), function,
@@ -203,21 +320,6 @@ def block(state):
     except KeyboardInterrupt:
         se.logutils.dumpState(state)
 
-# get next sequence number
-def nextSeq():
-    try:
-        with open(SEQ_FILE_NAME) as seqFile:
-            seq = int(seqFile.read().rstrip("\n"))
-        seq += 1
-        if seq > 65535:
-            seq = 1
-    except IOError:
-        seq = 1
-    with open(SEQ_FILE_NAME, "w") as seqFile:
-        seqFile.write(str(seq) + "\n")
-    return seq
-
-
 if __name__ == "__main__":
     # create the state variables with timestamps
     state = {}
@@ -229,15 +331,13 @@ if __name__ == "__main__":
 
     # get the command line arguments and run mode
     (args, mode) = se.env.getArgs()
-
-    # open the specified data source
-    logger.info("opening %s", args.datasource)
-    if args.datasource == "network":
-        dataFile =  se.files.openDataSocket(args.ports)
-    elif mode.serialDevice:
-        dataFile =  se.files.openSerial(args.datasource, args.baudrate)
-    else:
-        dataFile =  se.files.openInFile(args.datasource)
+    se.data.setDeviceFilter(args.include, args.exclude)
+    if args.window:
+        se.data.setBlockWindow(se.dedup.BlockWindow(args.window, args.windowfile))
+    if args.delta is not None:
+        deltaOutput = se.delta.DeltaOutput(args.delta, args.snapshot)
+    if args.rollups:
+        rollups = se.rollup.Rollups(args.rollups)
 
     # open the output files
     recFile = se.files.openOutFile(args.record, "ab" if args.append else "wb")
@@ -249,6 +349,27 @@ if __name__ == "__main__":
     else:
         outFile = se.files.openOutFile(args.outfile, "ab" if args.append else "wb")
 
+    # parse and output the messages separately, so the replies aren't delayed by the output
+    if args.workers:
+        # in other processes, which must be started before the data source is opened so they don't share it
+        pipeline = se.pipeline.Pipeline(PIPELINE_PROCESS_NAME, args.workers, args.queue, args.queuepolicy,
+            prepareMsg, parseMsgData, functools.partial(pipelineOutput, args, outFile),
+            start=functools.partial(openSinks, args), finish=functools.partial(closeOutput, outFile))
+    else:
+        if args.queue:
+            # in a separate thread
+            workQueue = se.workqueue.WorkQueue(WORK_THREAD_NAME, args.queue, args.queuepolicy)
+        openSinks(args)
+
+    # open the specified data source
+    logger.info("opening %s", args.datasource)
+    if args.datasource == "network":
+        dataFile =  se.files.openDataSocket(args.ports)
+    elif mode.serialDevice:
+        dataFile =  se.files.openSerial(args.datasource, args.baudrate)
+    else:
+        dataFile =  se.files.openInFile(args.datasource)
+
     # figure out what to do based on the mode of operation
     if mode.passiveMode:  # only reading from file or serial device
         # read until eof then terminate
@@ -272,5 +393,15 @@ if __name__ == "__main__":
             block(state)
 
     # cleanup
+    if pipeline:
+        # the writer process outputs the rollups and closes the sinks
+        pipeline.stop()
+    else:
+        if workQueue:
+            workQueue.stop()
+            logger.info("%s: %d messages at most waiting, %d dropped", WORK_THREAD_NAME, workQueue.highWater,
+                        workQueue.dropped)
+        closeOutput(outFile)
+    ackLatency.report()
     se.files.closeData(dataFile, mode.networkDevice)
     se.files.closeOutFiles(recFile, outFile)
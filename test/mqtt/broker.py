@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# A minimal stand-in for an MQTT 3.1.1 broker, which records the messages that are published to it, for testing
+# se2MQTT.py without a real broker.  It acknowledges connections, publishes with a quality of service of 1, and pings,
+# and can drop the first connection after a number of messages, to test reconnecting.
+#
+# -p port to listen on (default 1883)
+# -d drop the first connection after this number of messages (default 0, don't drop it)
+
+import getopt
+import socket
+import sys
+import threading
+
+# MQTT control packet types
+CONNECT = 1
+PUBLISH = 3
+PINGREQ = 12
+DISCONNECT = 14
+
+# a message that has been published to the broker
+class Message(object):
+    def __init__(self, connection, topic, payload, qos, retain):
+        self.connection = connection    # number of the connection it was published on, starting at 1
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+class Broker(object):
+    def __init__(self, port=0, dropAfter=0):
+        self.dropAfter = dropAfter
+        self.connections = 0
+        self.messages = []
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", port))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # accept connections until the broker is closed
+    def run(self):
+        while True:
+            try:
+                (conn, addr) = self.sock.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self.serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    # handle the packets of a connection until it is closed
+    def serve(self, conn):
+        count = 0
+        try:
+            while True:
+                (header, body) = readPacket(conn)
+                packetType = header >> 4
+                if packetType == CONNECT:
+                    with self.lock:
+                        self.connections += 1
+                        connection = self.connections
+                    conn.sendall(b"\x20\x02\x00\x00")   # CONNACK, accepted
+                elif packetType == PUBLISH:
+                    qos = (header >> 1) & 3
+                    topicLen = int.from_bytes(body[:2], "big")
+                    topic = body[2:2 + topicLen].decode("utf-8")
+                    ptr = 2 + topicLen
+                    if qos:
+                        conn.sendall(b"\x40\x02" + body[ptr:ptr + 2])   # PUBACK with the message id
+                        ptr += 2
+                    with self.lock:
+                        self.messages.append(Message(connection, topic, body[ptr:].decode("utf-8"), qos,
+                                                     bool(header & 1)))
+                    count += 1
+                    if connection == 1 and count == self.dropAfter:
+                        return
+                elif packetType == PINGREQ:
+                    conn.sendall(b"\xd0\x00")
+                elif packetType == DISCONNECT:
+                    return
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+# read an MQTT packet, and return its fixed header byte and its body
+def readPacket(conn):
+    header = readBytes(conn, 1)[0]
+    length = 0
+    shift = 0
+    while True:
+        byte = readBytes(conn, 1)[0]
+        length += (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return (header, readBytes(conn, length))
+
+def readBytes(conn, length):
+    data = b""
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+if __name__ == "__main__":
+    port = 1883
+    dropAfter = 0
+    (opts, args) = getopt.getopt(sys.argv[1:], "d:p:")
+    for opt in opts:
+        if opt[0] == "-d":
+            dropAfter = int(opt[1])
+        if opt[0] == "-p":
+            port = int(opt[1])
+    broker = Broker(port, dropAfter)
+    printed = 0
+    try:
+        while True:
+            broker.thread.join(1)
+            with broker.lock:
+                for msg in broker.messages[printed:]:
+                    print(msg.connection, msg.topic, "qos", msg.qos, "retain" if msg.retain else "", msg.payload)
+                printed = len(broker.messages)
+    except KeyboardInterrupt:
+        broker.close()
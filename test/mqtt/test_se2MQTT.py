@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Test se2MQTT.py against the stand-in broker in broker.py: the topics each device is published to, the retained
+# flag, the bound on the outgoing queue, and reconnecting after the connection is dropped.  The input is
+# se2MQTT.json, and the topics it is expected to be published to are in se2MQTT.topics.  Exits with status 1 if a test
+# fails.
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from broker import Broker
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+se2MQTT = os.path.join(testDir, "..", "..", "conversion", "se2MQTT.py")
+TIMEOUT = 30
+
+with open(os.path.join(testDir, "se2MQTT.json")) as inFile:
+    inLines = inFile.readlines()
+with open(os.path.join(testDir, "se2MQTT.topics")) as topicsFile:
+    expectedTopics = topicsFile.read().split()
+failures = 0
+
+def check(condition, msg):
+    global failures
+    print(("ok      " if condition else "FAILED  ") + msg)
+    if not condition:
+        failures += 1
+
+# run se2MQTT.py with the options, writing the input lines to it with a delay between them, and return its output
+def run(options, lines, delay=0):
+    proc = subprocess.Popen([sys.executable, se2MQTT] + options, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True)
+    for line in lines:
+        proc.stdin.write(line)
+        proc.stdin.flush()
+        time.sleep(delay)
+    proc.stdin.close()
+    output = proc.stdout.read()
+    proc.wait(TIMEOUT)
+    check(proc.returncode == 0, "se2MQTT.py {} exits with status 0".format(" ".join(options)))
+    if proc.returncode:
+        print(output)
+    return output
+
+# the last message published to a topic
+def lastMessage(broker, topic):
+    return [msg for msg in broker.messages if msg.topic == topic][-1]
+
+# each device is published to its own topic, with all its values, as retained messages
+broker = Broker()
+run(["-s", "127.0.0.1", "-P", str(broker.port), "-t", "solaredge", "-r"], inLines)
+check(sorted(set(msg.topic for msg in broker.messages)) == expectedTopics, "device topics")
+check(all(msg.retain for msg in broker.messages), "retained messages")
+inverter = json.loads(lastMessage(broker, "solaredge/inverters/7F101010").payload)
+check(inverter["Pac"] == 2005.0 and inverter["Vac"] == 240.1, "changed values are merged into the device state")
+inverter = json.loads(lastMessage(broker, "solaredge/inverters/7F202020").payload)
+check(inverter["Pac"] == 0.0, "inverter power is zeroed by an event")
+check(len(broker.messages) == 24, "one message for each device in each line")
+broker.close()
+broker = Broker()
+run(["-s", "127.0.0.1", "-P", str(broker.port), "-t", "solaredge"], inLines[:1])
+check(not any(msg.retain for msg in broker.messages), "messages aren't retained without -r")
+broker.close()
+
+# messages are dropped when the outgoing queue is full because the broker can't be reached
+sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+sock.bind(("127.0.0.1", 0))
+port = sock.getsockname()[1]
+sock.close()
+output = run(["-s", "127.0.0.1", "-P", str(port), "-t", "solaredge", "-q", "1", "-m", "5"], inLines)
+check(output.count("MQTT queue full") == 19, "messages beyond the queue size are dropped")
+
+# the connection is reestablished after the broker drops it, and the queued messages are sent
+broker = Broker(dropAfter=3)
+run(["-s", "127.0.0.1", "-P", str(broker.port), "-t", "solaredge", "-q", "1"], inLines, delay=.5)
+check(broker.connections == 2, "reconnected after the connection was dropped")
+check(set(msg.topic for msg in broker.messages if msg.connection == 2) >=
+      {"solaredge/inverters/7F101010", "solaredge/optimizers/100F7A1C"}, "messages are published after reconnecting")
+inverter = json.loads(lastMessage(broker, "solaredge/inverters/7F101010").payload)
+check(inverter["Pac"] == 2005.0, "the last message is delivered")
+broker.close()
+
+sys.exit(1 if failures else 0)
@@ -5,6 +5,11 @@ set -eux
 
 export TZ='US/Pacific'
 
+# se2MQTT.py against a stand-in broker, if the paho-mqtt module is installed
+if python3 -c "import paho.mqtt.client" 2>/dev/null; then
+    python3 test/mqtt/test_se2MQTT.py
+fi
+
 for rec in test/rec/*.rec; do
     TMP=$(mktemp -d)
     if [ ! -d "${TMP}" ]; then
@@ -4,20 +4,122 @@ import time
 import os
 import sys
 import datetime
-from collections import OrderedDict
+import gzip
+import shutil
+import threading
+import concurrent.futures
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "conversion"))
+from common import readLines
+
+filebuffersize = 65536
+
+# Write lines to hourly (or daily) files, named after the time that the lines were received.  The current file is kept
+# open with a buffer, which is flushed every flushsecs seconds by a timer, and when the file is rotated.  The time of the
+# next rotation is worked out when a file is started, so each line only costs a comparison.  If no lines are written
+# for openfilesecs seconds the file is closed until the next line.  Optionally the files are compressed by a
+# background thread once they have been rotated.
+class RotatingWriter(object):
+    def __init__(self, basedir, prefix, store_daily, make_daily_dir, openfilesecs, flushsecs, compress, debug):
+        self.basedir = basedir
+        self.prefix = prefix
+        self.store_daily = store_daily
+        self.make_daily_dir = make_daily_dir
+        self.openfilesecs = openfilesecs
+        self.flushsecs = flushsecs
+        self.debug = debug
+        self.compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if compress else None
+        self.lock = threading.Lock()    # held while the file is being written, flushed or rotated
+        self.writefile = None
+        self.writefilename = None
+        self.rotatetime = 0
+        self.lastwrite = 0
+        self.timer = None
+
+    def write(self, line):
+        with self.lock:
+            self.lastwrite = time.time()
+            if self.lastwrite >= self.rotatetime:
+                self.rotate()
+            if self.writefile is None:
+                self.writefile = open(self.writefilename, "a", buffering=filebuffersize)
+            self.writefile.write(line)
+            if not self.timer:
+                self.timer = threading.Timer(self.flushsecs, self.timedflush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    # start the file for the current hour or day, the lock must be held
+    def rotate(self):
+        curtime = datetime.datetime.fromtimestamp(self.lastwrite)
+        if self.store_daily:
+            start = curtime.replace(hour=0, minute=0, second=0, microsecond=0)
+            self.rotatetime = (start + datetime.timedelta(days=1)).timestamp()
+            curstore = start.strftime("%Y-%m-%d")
+        else:
+            start = curtime.replace(minute=0, second=0, microsecond=0)
+            self.rotatetime = (start + datetime.timedelta(hours=1)).timestamp()
+            curstore = start.strftime("%Y-%m-%d-%H")
+        if self.make_daily_dir:
+            dirname = os.path.join(self.basedir, start.strftime("%Y-%m-%d"))
+            os.makedirs(dirname, exist_ok=True)
+        else:
+            dirname = self.basedir
+        tfname = os.path.join(dirname, self.prefix + curstore + ".json")
+        if tfname != self.writefilename:
+            if self.debug:
+                print("Looks like a new %s: Temp Name: %s - Old Name: %s" % ("day" if self.store_daily else "hour", tfname, self.writefilename))
+            self.closefile()
+            if self.compressor and self.writefilename:
+                self.compressor.submit(compressfile, self.writefilename)
+            self.writefilename = tfname
+
+    def timedflush(self):
+        with self.lock:
+            self.timer = None
+            if self.writefile is None:
+                return
+            if time.time() - self.lastwrite > self.openfilesecs:
+                # Let's not leave output files open if we haven't seen data in a while
+                if self.debug:
+                    print("Well it's been %s seconds, closing file" % self.openfilesecs)
+                self.closefile()
+            else:
+                self.writefile.flush()
+                self.timer = threading.Timer(self.flushsecs, self.timedflush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def closefile(self):
+        if self.writefile is not None:
+            self.writefile.close()
+            self.writefile = None
+
+    # write out everything, and wait for the files to be compressed
+    def close(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.closefile()
+        if self.compressor:
+            self.compressor.shutdown(wait=True)
+
+# compress a file which has been rotated, appending to the compressed file if it already exists
+def compressfile(filename):
+    try:
+        with open(filename, "rb") as f_in:
+            with gzip.open(filename + ".gz", "ab") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        os.remove(filename)
+    except OSError as ex:
+        print("Unable to compress %s: %s" % (filename, ex))
+
 def main():
 # state values
     args = getargs()
 
-    blank_max = 10 # Since we want to work on files and std in. We will count the number of lines that are blank. If we process 100 blank lines and we are not doing stdin, we will assume that the file is done
-    basedir = args.basedir
-    debug = args.debug
-    prefix = args.prefix
-    openfilesecs = int(args.openfilesecs)
-    store_daily = args.store_daily
-    make_daily_dir = args.make_daily_dir
     looper = args.looper
     if args.infile == "stdin":
         inFile = sys.stdin
@@ -25,74 +127,22 @@ def main():
         try:
             inFile = open(args.infile, "r")
         except:
-            print("We could not open %s. Exiting" % ars.infile)
+            print("We could not open %s. Exiting" % args.infile)
             sys.exit(1)
-        # We always set looper = False for files, even if the args set it to true. 
-        looper = False
-
-    lastwrite = 0
-# read the input forever or until we have 100 blank lines in the case of file as input
-    writefile = None
-    writefilename = ""
-    jsonStr = ""
-    lcnt = 0
-    filebuffersize = 0
-    blank_cnt = 0
-    while looper or blank_cnt <= blank_max: # If stdin is set, the blank_cnt will be ignored
-        lcnt += 1
-        jsonStr = inFile.readline().strip()
-        curepoch = int(time.time())
-    # wait for and handle data coming in
-        if jsonStr != "":
-            blank_cnt = 0 # If we have data, reset the blank_cnt variable
-            if debug:
-                print("Got some data: %s" % jsonStr)
-            curtime = datetime.datetime.now()
-            curday = curtime.strftime("%Y-%m-%d")
-            curhour = curtime.strftime("%Y-%m-%d-%H")
-            if store_daily == True:
-                curstore = curday
-            else:
-                curstore = curhour
-            if make_daily_dir == True:
-                if not os.path.isdir(basedir + "/" + curday):
-                    os.mkdir(basedir + "/" + curday)
-                tfname = basedir + "/" + curday + "/" + prefix + curstore + ".json"
-            else:
-                tfname = basedir + "/" + prefix + curstore + ".json"
-            if tfname != writefilename:
-                if debug:
-                    print("Looks like a new day: Temp Name: %s - Old Name: %s" % (tfname, writefilename))
-                if writefile is not None:
-                    writefile.close()
-                    writefile = None
-                writefilename = tfname
-
-            if writefile is None:
-                writefile  = open(writefilename, "a",  buffering=filebuffersize)
-            writefile.write(jsonStr + "\n")
-            lastwrite = curepoch
-            writefile.close()
-            writefile = None
-            jsonStr = ""
-        else:
-            blank_cnt += 1
-            time.sleep(0.5)
-     # Let's not leave output files open if we haven't seen data in a while
-        if curepoch - lastwrite > openfilesecs:
-            if debug:
-                print("Well it's been %s seconds, closing file" % openfilesecs)
-            if writefile is not None:
-                writefile.close()
-                writefile = None
-        # Keep track of when we are looping and report on it of debug is enabled.
-        lreport = 60
-        if lcnt % lreport == 0:
-            lcnt = 0
-            if debug:
-                curtime = datetime.datetime.now()
-                curstr = curtime.strftime("%Y-%m-%d-%H:%m:%s")
-                print("We've looped %s times at %s" % (lreport, curstr))
+
+    writer = RotatingWriter(args.basedir, args.prefix, args.store_daily, args.make_daily_dir,
+                            int(args.openfilesecs), float(args.flushsecs), args.compress, args.debug)
+# read the input until it ends (stdin is closed, or the end of the file is reached unless we are following it)
+    try:
+        for jsonStr in readLines(inFile, follow=looper):
+            jsonStr = jsonStr.strip()
+        # handle data coming in
+            if jsonStr != "":
+                if args.debug:
+                    print("Got some data: %s" % jsonStr)
+                writer.write(jsonStr + "\n")
+    finally:
+        writer.close()
 
 
 
@@ -103,13 +153,13 @@ def getargs():
     parser.add_argument("-p", dest="prefix", default="solardata_", help="prefix for all csv filenames (defaults to 'solardata_')")
     parser.add_argument("-d", dest="store_daily", default=False, action="store_true", help="Instead of using Hourly files (YYYY-MM-DD-hh) store in daily files (YYYY-MM-DD) - Results in larger files. Default is False (Use Hourly)")
     parser.add_argument("-t", dest="openfilesecs", default="120", help="If no data added to open outputfiles in this many seconds, then close them and wait for more data. Defaults to 120 seconds")
-    parser.add_argument("-w", dest="looper", default=False, action="store_true", help="Wait forever on stdin. This only applies when -s is not set or set to stdin. It will wait forever on listening to stdin. Use this to wait for long running processes. If this is not set, after 10 attempts to read from stdin, it will exit gracefully. This is the default so you can cat files to this, and have it return. If you are running this as part of a semonitor.py process that is live, then set -w so it can go a long time without input and not close")
+    parser.add_argument("-f", dest="flushsecs", default="5", help="Flush the data written to the output file every this many seconds. Defaults to 5 seconds")
+    parser.add_argument("-z", dest="compress", default=False, action="store_true", help="Compress (gzip) each output file once the next hour (or day) has started")
+    parser.add_argument("-w", dest="looper", default=False, action="store_true", help="Wait forever for new data to be written to infile (follow it, like tail -f). Otherwise it will exit when the end of infile is reached. Reading from stdin always waits for more data until stdin is closed, so you can cat files to this and have it return, or run it as part of a semonitor.py process that is live and have it go a long time without input and not close")
     parser.add_argument("-m", dest="make_daily_dir", default=False, action="store_true", help="Create a use a directory in the format YYYY-MM-DD for each day of files. Otherwise all files will be in the root of the -b argument")
     parser.add_argument("infile", default="stdin", nargs='?', help="File to process. The Default of stdin is used to pipe data to this script. Otherwise it will just process a single file (provided by -s) and exit)")
 
     defargs = parser.parse_args()
-    if defargs.looper == True and defargs.infile != "stdin": 
-        print("Warning: You have set wait forever (-w) on a infile that is not stdin, we will NOT wait forever")
 
     return defargs
 
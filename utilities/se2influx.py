@@ -11,16 +11,21 @@ import shutil
 import sys
 import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import List, Optional, Tuple
 
 import influxdb
-from dateutil import tz
-from math import isnan
+from influxdb.exceptions import InfluxDBClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from se.influx import DateError, DeviceParams, LineEncoder, get_zone, log_rejected, write_lines  # noqa: E402
+from se.spool import SegmentSpool  # noqa: E402
 
 STDIN_TIMEOUT = 1
 DB_ERROR_SLEEP = 30
+LOG_BATCH_LINES = 1000
 
 
 @dataclass
@@ -38,38 +43,110 @@ class InfluxParams:
     udp_port: int
 
 
-class DateError(Exception):
-    pass
+@dataclass
+class BatchParams:
+    max_points: int
+    max_bytes: int
+    max_latency: float
+    concurrency: int
+
+
+@dataclass
+class SpoolParams:
+    path: Optional[str]
+    max_bytes: int
+    segment_bytes: int
 
 
 class EndOfFile(Exception):
     pass
 
 
+def benchmark(path: str, local_tz: Optional[str], device_params: DeviceParams) -> None:
+    """
+    Time the encoding of a file of semonitor data, with encode and with the
+    previous encoding, and check that they produce the same points
+    """
+
+    zone = get_zone(local_tz)
+    if zone is None:
+        sys.exit(f"Time-zone not found: {local_tz}")
+    with open(path) as f:
+        data = [json.loads(line) for line in f if line.strip()]
+
+    results = {}
+    for name in ("encode_points", "encode"):
+        # a new encoder each time, so the caches start empty
+        encode = getattr(LineEncoder(zone, device_params), name)
+        lines: List[str] = []
+        start = time.perf_counter()
+        for se_data in data:
+            try:
+                encode(se_data, lines)
+            except (KeyError, DateError):
+                pass
+        secs = time.perf_counter() - start
+        results[name] = lines
+        logging.info(
+            "%-13s %8d points %8.3f s %10.0f points/s",
+            name,
+            len(lines),
+            secs,
+            len(lines) / secs if secs else 0,
+        )
+
+    mismatches = sum(
+        a != b for a, b in zip(results["encode_points"], results["encode"])
+    ) + abs(len(results["encode_points"]) - len(results["encode"]))
+    logging.info("%s points differ", mismatches)
+
+
 class Se2Influx:
     def __init__(
         self,
         influx_params: InfluxParams,
+        batch_params: BatchParams,
+        spool_params: SpoolParams,
         queue_size: int,
         log_path: Optional[str],
         max_log_size: int,
+        log_compress_level: int,
         local_tz: Optional[str],
+        device_params: DeviceParams,
         stat_timer_secs: Optional[int],
     ) -> None:
 
         self.influx_params = influx_params
+        self.batch_params = batch_params
         self.log_path = log_path
         self.max_log_size = max_log_size
+        self.log_compress_level = log_compress_level
         self.stat_timer_secs = stat_timer_secs
 
-        self.local_tz = tz.gettz(local_tz) if local_tz is not None else tz.tzlocal()
+        self.local_tz = get_zone(local_tz)
         if self.local_tz is None:
             sys.exit(f"Time-zone not found: {local_tz}")
+        self.encoder = LineEncoder(self.local_tz, device_params)
 
         self.writer_queue = queue.Queue(maxsize=queue_size)
         self.logger_queue = queue.Queue(maxsize=queue_size)
         self.shutdown = threading.Event()
 
+        # Each flush thread has its own InfluxDB client
+        self.flush_local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.points_written = 0
+        self.bytes_written = 0
+        self.requests_written = 0
+        self.points_drained = 0
+        self.points_rejected = 0
+
+        self.spool = None
+        if spool_params.path:
+            self.spool = SegmentSpool(
+                spool_params.path, spool_params.max_bytes, spool_params.segment_bytes
+            )
+
     def run(self) -> None:
         """
         Run method;  start our read, write and (optionally) logger threads and then
@@ -90,6 +167,12 @@ class Se2Influx:
             logger_thread.setName("logger")
             threads.append(logger_thread)
 
+        if self.spool:
+            logging.info("Starting spool drainer thread")
+            drainer_thread = threading.Thread(target=self.drainer, daemon=True)
+            drainer_thread.setName("drainer")
+            threads.append(drainer_thread)
+
         for thread in threads:
             thread.start()
 
@@ -137,9 +220,21 @@ class Se2Influx:
     def writer(self) -> None:
         """
         Writer method: read data from our queue, parse the json, turn it into
-        valid influxdb data points, and then write it to our influxDB. Based on
-        the configured retries, we may end up blocking forever on the write if
-        the DB is down/unavailable.
+        valid influxdb data points, and then write them to our influxDB.  Points
+        from successive lines are accumulated into a batch, which is flushed when
+        it reaches the configured number of points or bytes, or when its first
+        point has waited for the configured latency.  Flushes are written by a
+        pool of threads, so several can be in flight at once; when they all are,
+        we wait for one of them to finish.  Based on the configured retries, a
+        flush may end up blocking forever if the DB is down/unavailable.
+
+        With a spool, we never wait for the DB: batches which fail to be written
+        because of a connection error or a server error are appended to the
+        spool (the points that InfluxDB rejects with a 400 or 413 client error,
+        eg because of a field type conflict, are logged and dropped, as they could
+        never be written), and so are new batches while there are points in the
+        spool (so that they are written in order) or while all the flushes are in
+        flight.  The drainer thread then writes them to the DB.
         """
 
         logging.info("Connecting to InfluxDB")
@@ -155,68 +250,189 @@ class Se2Influx:
                 db_client.create_database(self.influx_params.database)
         except Exception as e:
             logging.error("Unable to connect to influxdb host or create DB: %s", e)
-            return
+            if not self.spool:
+                return
 
-        data_points_written = 0
-        last_stat_print = int(time.time())
-        while True:
-            if self.stat_timer_secs is not None:
-                now = int(time.time())
-                if now > last_stat_print + self.stat_timer_secs:
-                    logging.info("Data points written to DB: %s", data_points_written)
-                    data_points_written = 0
-                    last_stat_print = now
+        batch: List[str] = []
+        batch_bytes = 0
+        batch_deadline = None
+        in_flight = set()
+        last_stat_print = time.time()
+        with ThreadPoolExecutor(
+            max_workers=self.batch_params.concurrency, thread_name_prefix="flush"
+        ) as executor:
+            while True:
+                now = time.time()
+                if self.stat_timer_secs is not None:
+                    if now > last_stat_print + self.stat_timer_secs:
+                        self._print_stats(now - last_stat_print, len(in_flight))
+                        last_stat_print = now
+
+                if batch and (
+                    len(batch) >= self.batch_params.max_points
+                    or batch_bytes >= self.batch_params.max_bytes
+                    or now >= batch_deadline
+                ):
+                    in_flight = {f for f in in_flight if not f.done()}
+                    if self.spool and (
+                        len(in_flight) >= self.batch_params.concurrency
+                        or self.spool.pending()
+                    ):
+                        self.spool.append(batch)
+                    else:
+                        while len(in_flight) >= self.batch_params.concurrency:
+                            in_flight = wait(in_flight, return_when=FIRST_COMPLETED)[1]
+                        in_flight.add(executor.submit(self._flush, batch, batch_bytes))
+                    batch = []
+                    batch_bytes = 0
+                    batch_deadline = None
 
-            try:
-                line = self.writer_queue.get(timeout=1)
-            except queue.Empty:
-                if self.shutdown.is_set():
-                    return
-                continue
+                try:
+                    line = self.writer_queue.get(
+                        timeout=1 if batch_deadline is None else max(0, batch_deadline - now)
+                    )
+                except queue.Empty:
+                    if self.shutdown.is_set():
+                        if batch and self.spool and self.spool.pending():
+                            self.spool.append(batch)
+                        elif batch:
+                            in_flight.add(executor.submit(self._flush, batch, batch_bytes))
+                        break
+                    continue
 
-            try:
-                se_data = json.loads(line)
-            except json.decoder.JSONDecodeError as e:
-                logging.error("Got bad JSON data; %s -- %s", line, e)
-                continue
+                points = self._encode(line)
+                if not points:
+                    continue
+                if not batch:
+                    batch_deadline = time.time() + self.batch_params.max_latency
+                batch.extend(points)
+                batch_bytes += sum(len(point) + 1 for point in points)
 
-            data_out = []
-            try:
-                for hw_type in ("inverters", "optimizers"):
-                    for serial, hw_data in se_data[hw_type].items():
-                        # InfluxDB does not like NaN floats, so we filter them out
-                        hw_data = {
-                            k: v
-                            for k, v in hw_data.items()
-                            if not (isinstance(v, float) and isnan(v))
-                        }
-                        utc_date = self._pop_utc_date(hw_data)
-                        data_out.append(
-                            {
-                                "measurement": hw_type,
-                                "tags": {"serial": serial},
-                                "time": utc_date,
-                                "fields": hw_data,
-                            }
-                        )
-
-            except KeyError as e:
-                logging.error(
-                    "Decoded JSON missing required fields: %s -- %s", se_data, e
-                )
+        if self.stat_timer_secs is not None:
+            self._print_stats(time.time() - last_stat_print, 0)
 
-            except DateError as e:
-                logging.error("Error converting dates in JSON: %s -- %s", se_data, e)
+    def _encode(self, line: str) -> List[str]:
+        """
+        Turn a line of semonitor json into InfluxDB line protocol points
+        """
+
+        try:
+            se_data = json.loads(line)
+        except json.decoder.JSONDecodeError as e:
+            logging.error("Got bad JSON data; %s -- %s", line, e)
+            return []
+
+        lines: List[str] = []
+        try:
+            self.encoder.encode(se_data, lines)
+
+        except (KeyError, AttributeError) as e:
+            logging.error("Decoded JSON missing required fields: %s -- %s", se_data, e)
 
-            if not data_out:
+        except DateError as e:
+            logging.error("Error converting dates in JSON: %s -- %s", se_data, e)
+
+        return lines
+
+    def _flush(self, batch: List[str], batch_bytes: int) -> None:
+        """
+        Flush thread method: write a batch of points to our influxDB in a single request
+        """
+
+        db_client = getattr(self.flush_local, "db_client", None)
+        if db_client is None:
+            db_client = self.flush_local.db_client = influxdb.InfluxDBClient(
+                **self.influx_params.__dict__
+            )
+
+        try:
+            logging.debug("Writing %s points to influxdb", len(batch))
+            rejected = write_lines(db_client, batch)
+        except Exception as e:
+            logging.error("Error writing to influx db: %s", e)
+            if self.spool:
+                self.spool.append(batch)
+            return
+
+        self._written(batch, batch_bytes, rejected)
+
+    def drainer(self) -> None:
+        """
+        Drainer method: write the points in the spool to our influxDB in batches,
+        oldest first, removing them from the spool once they have been written,
+        or rejected by the DB.  If the DB is down/unavailable, wait a while before
+        trying again.
+        """
+
+        db_client = influxdb.InfluxDBClient(**self.influx_params.__dict__)
+        while not self.shutdown.is_set():
+            points, size, position = self.spool.read(
+                self.batch_params.max_points, self.batch_params.max_bytes
+            )
+            if not points:
+                self.shutdown.wait(1)
                 continue
 
             try:
-                logging.debug("Writing to influxdb: %s", data_out)
-                db_client.write_points(data_out)
-                data_points_written += len(data_out)
+                logging.debug("Writing %s spooled points to influxdb", len(points))
+                rejected = write_lines(db_client, points)
             except Exception as e:
-                logging.error("Error writing to influx db: %s", e)
+                logging.error("Error writing spooled points to influx db: %s", e)
+                self.shutdown.wait(DB_ERROR_SLEEP)
+                continue
+
+            # the rejected points are dropped too, retrying them would hold up the rest of the spool forever
+            self.spool.commit(position)
+            self._written(points, size, rejected)
+            with self.stats_lock:
+                self.points_drained += len(points)
+
+    def _written(
+        self, points: List[str], size: int, rejected: List[Tuple[str, InfluxDBClientError]]
+    ) -> None:
+        """
+        Count the points of a batch that have been written, and log and count
+        the points that InfluxDB rejected, which are dropped rather than spooled
+        """
+
+        if rejected:
+            log_rejected(len(points), rejected)
+        with self.stats_lock:
+            self.points_written += len(points) - len(rejected)
+            self.bytes_written += size - sum(len(point) + 1 for point, e in rejected)
+            self.requests_written += 1
+            self.points_rejected += len(rejected)
+
+    def _print_stats(self, secs: float, in_flight: int) -> None:
+        with self.stats_lock:
+            points, self.points_written = self.points_written, 0
+            nbytes, self.bytes_written = self.bytes_written, 0
+            requests, self.requests_written = self.requests_written, 0
+            rejected, self.points_rejected = self.points_rejected, 0
+        logging.info(
+            "Data points written to DB: %s (%.1f points/s, %s bytes, %s requests, %s in flight, "
+            "%s rejected)",
+            points,
+            points / secs if secs else 0,
+            nbytes,
+            requests,
+            in_flight,
+            rejected,
+        )
+        if self.spool:
+            with self.stats_lock:
+                drained, self.points_drained = self.points_drained, 0
+            with self.spool.lock:
+                spooled, self.spool.points_spooled = self.spool.points_spooled, 0
+                dropped, self.spool.bytes_dropped = self.spool.bytes_dropped, 0
+                spool_bytes = self.spool.total_bytes
+            logging.info(
+                "Spool: %s points spooled, %s points drained, %s bytes pending, %s bytes dropped",
+                spooled,
+                drained,
+                spool_bytes,
+                dropped,
+            )
 
     def logger(self) -> None:
         """
@@ -225,43 +441,55 @@ class Se2Influx:
         options for file rotation and compression.  This is useful if we need
         to later replay data and re-insert it into our influx DB (influxDB
         handles duplicate data points by overwriting field data, so this should
-        be fine)
+        be fine).  All the lines waiting in the queue are written together, and
+        the size of the file is kept track of from the bytes written.  When it
+        gets too big, it is renamed and compressed by a background thread, so
+        lines don't pile up in the queue while it is compressed.
         """
 
-        while True:
-            try:
-                log_fh = open(self.log_path, "a")
-            except Exception as e:
-                logging.error("Error opening %s: %s", self.log_path, e)
-                return
-
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="compress") as compressor:
             while True:
                 try:
-                    line = self.logger_queue.get(timeout=1)
-                except queue.Empty:
-                    if self.shutdown.is_set():
-                        return
-                    continue
-
-                try:
-                    log_fh.write(line)
-                    log_fh.flush()
+                    log_fh = open(self.log_path, "ab")
+                    size = os.fstat(log_fh.fileno()).st_size
                 except Exception as e:
-                    logging.error("Error writing to %s: %s", self.log_path, e)
+                    logging.error("Error opening %s: %s", self.log_path, e)
                     return
 
-                size = os.stat(self.log_path).st_size
-                if self.max_log_size and size > self.max_log_size:
-                    log_fh.close()
+                while True:
+                    try:
+                        lines = [self.logger_queue.get(timeout=1)]
+                    except queue.Empty:
+                        if self.shutdown.is_set():
+                            log_fh.close()
+                            return
+                        continue
+                    while len(lines) < LOG_BATCH_LINES:
+                        try:
+                            lines.append(self.logger_queue.get_nowait())
+                        except queue.Empty:
+                            break
+
+                    data = "".join(lines).encode("utf-8")
                     try:
-                        self._rotate_log()
+                        log_fh.write(data)
+                        log_fh.flush()
                     except Exception as e:
-                        logging.error("Failed to rotate file: %s, %s", self.log_path, e)
-                    break
+                        logging.error("Error writing to %s: %s", self.log_path, e)
+                        return
+
+                    size += len(data)
+                    if self.max_log_size and size > self.max_log_size:
+                        log_fh.close()
+                        try:
+                            compressor.submit(self._compress_log, self._rotate_log())
+                        except Exception as e:
+                            logging.error("Failed to rotate file: %s, %s", self.log_path, e)
+                        break
 
-    def _rotate_log(self) -> None:
+    def _rotate_log(self) -> str:
         """
-        Rotate and copress logs once they get too big
+        Rotate logs once they get too big, by renaming them, and return the new name
         """
 
         ts = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -270,34 +498,31 @@ class Se2Influx:
             log_root = log_ext
             log_ext = ""
 
-        gz_log = f"{log_root}-{ts}{sep}{log_ext}.gz"
+        rotated_log = f"{log_root}-{ts}{sep}{log_ext}"
+        n = 0
+        while os.path.exists(rotated_log) or os.path.exists(f"{rotated_log}.gz"):
+            # rotated more than once a second
+            n += 1
+            rotated_log = f"{log_root}-{ts}-{n}{sep}{log_ext}"
 
-        with open(self.log_path, "rb") as f_in:
-            with gzip.open(gz_log, "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        os.rename(self.log_path, rotated_log)
+        return rotated_log
 
-        with open(self.log_path, "w"):
-            pass
-
-    def _pop_utc_date(self, data: Dict[str, Any]) -> str:
+    def _compress_log(self, rotated_log: str) -> None:
         """
-        Take a semonitor data strict, remove the time and date fields, and then
-        convert them (using a user-specified timezone, if existant, or otherwise
-        our local machine timezone) to a UTC-based string format required by
-        python-influxdb
+        Compressor thread method: compress a rotated log, and then remove it
         """
 
-        date = data.pop("Date")
-        time = data.pop("Time")
-
         try:
-            local_time = datetime.strptime(
-                f"{date} {time}", "%Y-%m-%d %H:%M:%S"
-            ).replace(tzinfo=self.local_tz)
-            utc_time = local_time.astimezone(tz.tzutc())
-            return utc_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+            with open(rotated_log, "rb") as f_in:
+                with gzip.open(
+                    f"{rotated_log}.gz.tmp", "wb", compresslevel=self.log_compress_level
+                ) as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            os.replace(f"{rotated_log}.gz.tmp", f"{rotated_log}.gz")
+            os.remove(rotated_log)
         except Exception as e:
-            raise DateError(e) from e
+            logging.error("Failed to compress file: %s, %s", rotated_log, e)
 
 
 def parse_args() -> argparse.Namespace:
@@ -343,6 +568,72 @@ def parse_args() -> argparse.Namespace:
         "--udp_port", help="UDP port to connect to InfluxDB", default=4444
     )
 
+    batch_args = parser.add_argument_group(description="Batching options")
+    batch_args.add_argument(
+        "--batch_points",
+        help="Maximum number of data points written to InfluxDB in one request",
+        type=int,
+        default=5000,
+    )
+    batch_args.add_argument(
+        "--batch_bytes",
+        help="Maximum size in bytes of the data points written in one request",
+        type=int,
+        default=1000000,
+    )
+    batch_args.add_argument(
+        "--batch_latency",
+        help="Maximum number of seconds a data point waits before being written",
+        type=float,
+        default=1.0,
+    )
+    batch_args.add_argument(
+        "--batch_concurrency",
+        help="Maximum number of requests to InfluxDB in flight at once",
+        type=int,
+        default=2,
+    )
+
+    device_args = parser.add_argument_group(description="Device options")
+    device_args.add_argument(
+        "--device_mapping",
+        help=(
+            "JSON file of the measurement, tags and fields to write each device type with, "
+            'eg {"meters_0x0022": {"measurement": "meters", "tags": ["serial", "meter"], '
+            '"exclude_fields": ["Undeciphered_data"], "max_series": 20}, "events": {"skip": true}}.  '
+            'Fields whose type changes must be in "string_fields", which are written as strings'
+        ),
+        type=str,
+    )
+    device_args.add_argument(
+        "--max_series",
+        help="Maximum number of devices of each type to write, to limit the number of series",
+        type=int,
+        default=1000,
+    )
+
+    spool_args = parser.add_argument_group(description="Spool options")
+    spool_args.add_argument(
+        "--spool_dir",
+        help=(
+            "Directory to spool data points to while InfluxDB is unavailable; "
+            "leave unset to drop them"
+        ),
+        type=str,
+    )
+    spool_args.add_argument(
+        "--spool_max_bytes",
+        help="Size in bytes after which the oldest spooled data points are dropped",
+        type=int,
+        default=100000000,
+    )
+    spool_args.add_argument(
+        "--spool_segment_bytes",
+        help="Size in bytes of each spool segment file",
+        type=int,
+        default=4000000,
+    )
+
     other_args = parser.add_argument_group(description="Control options")
     other_args.add_argument(
         "--queue_size", help="Size (in lines) to limit buffer queues to", default=10000
@@ -355,8 +646,15 @@ def parse_args() -> argparse.Namespace:
     other_args.add_argument(
         "--max_log_size",
         help="Size in bytes after which to rotate+compress logged data",
+        type=int,
         default=1024000,
     )
+    other_args.add_argument(
+        "--log_compress_level",
+        help="gzip compression level (1-9) of rotated log files",
+        type=int,
+        default=1,
+    )
     other_args.add_argument(
         "--local_tz",
         help=(
@@ -370,6 +668,11 @@ def parse_args() -> argparse.Namespace:
         help="Print # data points written every N seconds; if unset print nothing",
         type=int,
     )
+    other_args.add_argument(
+        "--benchmark",
+        help="Time the encoding of the semonitor data in this file into InfluxDB points, and exit",
+        type=str,
+    )
     other_args.add_argument(
         "--debug",
         action="store_true",
@@ -386,6 +689,16 @@ if __name__ == "__main__":
         level=logging.DEBUG if args.debug else logging.INFO,
         datefmt="%Y-%m-%d %H:%M:%S",
     )
+    mapping = {}
+    if args.device_mapping:
+        with open(args.device_mapping) as f:
+            mapping = json.load(f)
+    device_params = DeviceParams(mapping, args.max_series)
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.local_tz, device_params)
+        sys.exit(0)
+
     db_params = InfluxParams(
         args.host,
         args.port,
@@ -400,12 +713,29 @@ if __name__ == "__main__":
         args.udp_port,
     )
 
+    batch_params = BatchParams(
+        args.batch_points,
+        args.batch_bytes,
+        args.batch_latency,
+        args.batch_concurrency,
+    )
+
+    spool_params = SpoolParams(
+        args.spool_dir,
+        args.spool_max_bytes,
+        args.spool_segment_bytes,
+    )
+
     se2influx = Se2Influx(
         db_params,
+        batch_params,
+        spool_params,
         args.queue_size,
         args.log_path,
         args.max_log_size,
+        args.log_compress_level,
         args.local_tz,
+        device_params,
         args.stat_timer_secs,
     )
     se2influx.run()
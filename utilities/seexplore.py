@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# Statistical explorer for undeciphered SolarEdge device types
+#
+# Gathers every data block of one seType from a recording (.rec) into a numpy matrix and scores every offset
+# and field type hypothesis over the whole corpus in one vectorized pass.  The result is a ranked list of
+# candidate fields and a candidate _defn list which can be pasted into a new ParseDevice subclass.
+
+import os
+import sys
+import struct
+import time
+import argparse
+import logging
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import se.env
+import se.msg
+import se.data
+import se.commands
+
+logger = logging.getLogger(__name__)
+
+devHdrLen = 8
+
+# field type hypotheses tried at each offset
+# [paramLen, paramInFmt, numpy dtype, item name suffix]
+hypotheses = [
+    [2, 'H', '<u2', "int2"],
+    [2, 'h', '<i2', "sint2"],
+    [4, 'L', '<u4', "int4"],
+    [4, 'l', '<i4', "sint4"],
+    [4, 'f', '<f4', "float"],
+]
+
+# inverter items that new device fields are compared against
+invRefItems = ["Uptime", "Interval", "Temp", "Eday", "Eac", "Vac", "Iac", "Freq", "Vdc", "Etot", "Pac"]
+
+# largest magnitude that is considered a plausible measurement
+maxPlausible = 1e7
+# smallest non zero magnitude that is considered a plausible measurement
+minPlausible = 1e-3
+# a timestamp must be within this many seconds of the inverter timestamp in the same message
+timestampWindow = 24 * 60 * 60
+# minimum score for a hypothesis to be used in the candidate definition
+minScore = 0.5
+
+# read all the data blocks of the specified seType from a recording
+# return a list of the block data and a list of the inverter values reported in the same message
+def readBlocks(recFileName, seType):
+    mode = se.env.RunMode(False, False, None, True, False, False)
+    state = {}
+    blocks = []
+    invRefs = []
+    with open(recFileName, "rb") as recFile:
+        # skip data until the start of the first complete message
+        (msg, eof) = se.msg.readMsg(recFile, None, mode, state)
+        while not eof:
+            (msg, eof) = se.msg.readMsg(recFile, None, mode, state)
+            (msgSeq, fromAddr, toAddr, function, data) = se.msg.parseMsg(msg)
+            if function != se.commands.PROT_CMD_SERVER_POST_DATA or not data:
+                continue
+            invRef = messageInvRef(data)
+            dataPtr = 0
+            while dataPtr + devHdrLen <= len(data):
+                (blockType, seId, devLen) = struct.unpack("<HLH", data[dataPtr:dataPtr + devHdrLen])
+                dataPtr += devHdrLen
+                if blockType == seType:
+                    blocks.append(data[dataPtr:dataPtr + devLen])
+                    invRefs.append(invRef)
+                dataPtr += devLen
+    return (blocks, invRefs)
+
+# the inverter values reported in a message, or nan if there are none
+def messageInvRef(data):
+    try:
+        inverters = se.data.parseDeviceData(data).get("inverters", {})
+    except Exception as ex:
+        logger.info("Unable to parse inverters: %s", ex)
+        inverters = {}
+    for inverter in inverters.values():
+        ref = [float(inverter.get(item, "nan")) for item in invRefItems]
+        try:
+            ref.append(time.mktime(time.strptime(inverter["Date"] + " " + inverter["Time"], "%Y-%m-%d %H:%M:%S")))
+        except (KeyError, ValueError):
+            ref.append(float("nan"))
+        return ref
+    return [float("nan")] * (len(invRefItems) + 1)
+
+# extract the column of values at the specified offset as the specified type
+def column(blockMatrix, offset, paramLen, dtype):
+    return np.ascontiguousarray(blockMatrix[:, offset:offset + paramLen]).view(dtype)[:, 0].astype(np.float64)
+
+# correlation of each column of refs with values, ignoring nan rows
+def correlations(values, refs):
+    corrs = np.zeros(refs.shape[1])
+    for i in range(refs.shape[1]):
+        ok = np.isfinite(values) & np.isfinite(refs[:, i])
+        if ok.sum() < 3:
+            continue
+        v = values[ok]
+        r = refs[ok, i]
+        if v.std() == 0 or r.std() == 0:
+            continue
+        corrs[i] = np.corrcoef(v, r)[0, 1]
+    return corrs
+
+# score every hypothesis at every offset
+def scoreBlocks(blockMatrix, invRefs, step):
+    (nBlocks, devLen) = blockMatrix.shape
+    refs = np.array(invRefs, dtype=np.float64)
+    refTimes = refs[:, -1]
+    refs = refs[:, :-1]
+    now = time.time()
+    candidates = []
+    for offset in range(0, devLen, step):
+        for paramLen, paramInFmt, dtype, suffix in hypotheses:
+            if offset + paramLen > devLen:
+                continue
+            values = column(blockMatrix, offset, paramLen, dtype)
+            finite = np.isfinite(values)
+            magnitude = np.abs(values)
+            plausible = float(np.mean(finite & ((magnitude == 0) |
+                                                ((magnitude >= minPlausible) & (magnitude <= maxPlausible)))))
+            if paramInFmt != 'f':
+                # integers are always plausible, but large ones are more likely to be something else
+                plausible = max(plausible, 0.5)
+            constant = bool(finite.all() and np.ptp(values) == 0)
+            # monotonic counters never decrease from one block to the next, random data increases half the time
+            diffs = np.diff(values[finite])
+            moving = diffs[diffs != 0]
+            counter = 0.0
+            if len(moving) > 1 and paramInFmt != 'f':
+                counter = max(0.0, 2 * float(np.mean(moving > 0)) - 1)
+            # timestamps are close to the inverter timestamp, or at least within the lifetime of the product
+            timeStamp = 0.0
+            if paramInFmt == 'L':
+                if np.isfinite(refTimes).any():
+                    timeStamp = float(np.mean(np.abs(values - refTimes) <= timestampWindow))
+                else:
+                    timeStamp = float(np.mean((values >= 1262304000) & (values <= now + 365 * 24 * 60 * 60)))
+            corrs = correlations(values, refs)
+            bestRef = int(np.argmax(np.abs(corrs)))
+            corr = float(abs(corrs[bestRef]))
+            if constant:
+                (score, kind) = (0.1, "constant")
+            else:
+                (score, kind) = max((timeStamp, "timestamp"), (counter, "counter"), (corr * plausible, "correlated"),
+                                    (0.5 * plausible, "measurement"))
+            candidates.append({
+                "offset": offset,
+                "paramLen": paramLen,
+                "paramInFmt": paramInFmt,
+                "suffix": suffix,
+                "kind": kind,
+                "score": score,
+                "plausible": plausible,
+                "timestamp": timeStamp,
+                "counter": counter,
+                "corr": corr,
+                "corrItem": invRefItems[bestRef],
+                "first": values[0],
+            })
+    # prefer the wider field when two hypotheses score the same
+    candidates.sort(key=lambda c: (c["score"], c["paramLen"]), reverse=True)
+    return candidates
+
+# pick the best non overlapping hypotheses and fill the gaps with hex fields
+def candidateDefn(candidates, devLen):
+    used = [False] * devLen
+    chosen = []
+    for c in candidates:
+        if c["score"] < minScore and c["kind"] != "constant":
+            continue
+        span = range(c["offset"], c["offset"] + c["paramLen"])
+        if any(used[i] for i in span):
+            continue
+        for i in span:
+            used[i] = True
+        chosen.append(c)
+    chosen.sort(key=lambda c: c["offset"])
+    defn = []
+    offset = 0
+    for c in chosen:
+        if c["offset"] > offset:
+            appendHex(defn, offset, c["offset"] - offset, False)
+        if c["kind"] == "constant":
+            appendHex(defn, c["offset"], c["paramLen"], True)
+        else:
+            defn.append(defnItem(c))
+        offset = c["offset"] + c["paramLen"]
+    if offset < devLen:
+        appendHex(defn, offset, devLen - offset, False)
+    return defn
+
+# add a hex field to the definition, merging it with the previous one if it is the same kind
+def appendHex(defn, offset, paramLen, constant):
+    if defn and defn[-1][1] == 'hex' and defn[-1][4] != constant:
+        defn[-1][0] += paramLen
+        return
+    if constant:
+        defn.append([paramLen, 'hex', "HexConst_{}".format(offset), "ParseDevice.hexData", False,
+                     "Unknown, constant value"])
+    else:
+        defn.append([paramLen, 'hex', "Unknown_off{:02}_hex".format(offset), "ParseDevice.hexData", True,
+                     "Unknown as yet"])
+
+def defnItem(c):
+    if c["kind"] == "timestamp" and c["offset"] == 0:
+        return [4, 'L', "dateTime", "dateTime", False, "Seconds since the epoch"]
+    name = "{}_off{:02}_{}".format(c["kind"].capitalize(), c["offset"], c["suffix"])
+    if c["kind"] == "correlated":
+        comment = "Correlates with inverter {} (r={:.2f})".format(c["corrItem"], c["corr"])
+    elif c["kind"] == "counter":
+        comment = "Increases in {:.0%} of changes".format(c["counter"])
+    elif c["kind"] == "timestamp":
+        comment = "Seconds since the epoch"
+    else:
+        comment = "Unknown, plausible values"
+    return [c["paramLen"], c["paramInFmt"], name, "dateTime" if c["kind"] == "timestamp" else None, True, comment]
+
+def printCandidates(candidates, top):
+    print("{:>6} {:>3} {:>4} {:<11} {:>6} {:>6} {:>6} {:>6} {:>6}  {}".format(
+        "offset", "len", "fmt", "kind", "score", "plaus", "time", "count", "corr", "first value"))
+    for c in candidates[:top]:
+        print("{:>6} {:>3} {:>4} {:<11} {:>6.2f} {:>6.2f} {:>6.2f} {:>6.2f} {:>6.2f}  {:g}".format(
+            c["offset"], c["paramLen"], c["paramInFmt"], c["kind"], c["score"], c["plausible"], c["timestamp"],
+            c["counter"], c["corr"], c["first"]))
+
+def printDefn(defn):
+    print("    _defn = [")
+    for paramLen, paramInFmt, paramName, outFormatFn, out, comment in defn:
+        outFormatFn = "None" if outFormatFn is None else (
+            outFormatFn if outFormatFn.startswith("ParseDevice") else repr(outFormatFn))
+        print("        [{}, {!r}, {!r}, {}, {}, {!r}],".format(paramLen, paramInFmt, paramName, outFormatFn, out, comment))
+    print("    ]")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score the possible interpretations of every offset of an undeciphered seType over a whole recording and suggest a ParseDevice _defn', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-t", dest="seType", required=True, type=lambda s: int(s, 16), help="seType to explore, in hex")
+    parser.add_argument("-l", dest="devLen", type=int, help="only use blocks of this length (default: the most common length)")
+    parser.add_argument("-n", dest="top", type=int, default=40, help="number of ranked candidates to print")
+    parser.add_argument("-s", dest="step", type=int, default=2, help="offset increment in bytes")
+    parser.add_argument("recfile", help="recording of SolarEdge messages (.rec)")
+    args = parser.parse_args()
+
+    (blocks, invRefs) = readBlocks(args.recfile, args.seType)
+    if not blocks:
+        sys.exit("No blocks of seType {:#06x} found in {}".format(args.seType, args.recfile))
+    devLen = args.devLen or Counter(len(block) for block in blocks).most_common(1)[0][0]
+    selected = [i for i, block in enumerate(blocks) if len(block) == devLen]
+    blockMatrix = np.frombuffer(b"".join(blocks[i] for i in selected), dtype=np.uint8).reshape(len(selected), devLen)
+    invRefs = [invRefs[i] for i in selected]
+    print("seType {:#06x}: {} blocks of length {} ({} of other lengths ignored)\n".format(
+        args.seType, len(selected), devLen, len(blocks) - len(selected)))
+
+    candidates = scoreBlocks(blockMatrix, invRefs, args.step)
+    printCandidates(candidates, args.top)
+    print("")
+    printDefn(candidateDefn(candidates, devLen))